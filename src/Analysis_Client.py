@@ -0,0 +1,54 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Thin client of the Analysis_Server. Runs an analysis script in the warm server and exits with the
+#              exit code of the script. If the server is not running, the script is run directly.
+#   e.g. python Analysis_Client.py Calculate_non-linearity.py $DIRNAME
+
+import os
+import sys
+import json
+import socket
+from Analysis_Server import socket_path, exit_marker, job_error
+
+def runScript(socket_path, script, args, lost_code=1):
+    '''
+    Run the script in the server listening on socket_path and exit with its exit code.
+    If the server is not running, the script is run directly. lost_code: exit code if the job terminated without reporting
+    '''
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError: # No server: run the script in a new interpreter
+        conn.close()
+        os.execv(sys.executable, [sys.executable, script, *args])
+    conn.sendall(json.dumps({'script': script, 'args': args, 'cwd': os.getcwd()}).encode() + b'\n')
+
+    out = sys.stdout.buffer
+    tail = b''
+    keep = len(exit_marker) + 8 # Hold back enough bytes to never print a part of the exit marker
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk: break
+        tail += chunk
+        if len(tail) > keep:
+            out.write(tail[:-keep])
+            out.flush()
+            tail = tail[-keep:]
+    conn.close()
+    pos = tail.rfind(exit_marker)
+    if pos < 0: # Job terminated without reporting
+        out.write(tail)
+        out.flush()
+        sys.exit(lost_code)
+    out.write(tail[:pos])
+    out.flush()
+    sys.exit(int(tail[pos + len(exit_marker):].strip() or 1))
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python Analysis_Client.py <script> [arguments]")
+        sys.exit(1)
+    runScript(socket_path, sys.argv[1], sys.argv[2:], job_error)
+
+if __name__ == "__main__":
+    main()
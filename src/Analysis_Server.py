@@ -0,0 +1,180 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Long-lived local analysis service. numpy, scipy, matplotlib, uproot and the analysis scripts are
+#              imported (and warmed up) once; every "analyse this directory" job received over the Unix socket is
+#              run in a forked copy of the warm process. The job output is streamed back to Analysis_Client.py,
+#              followed by the exit code of the script (0/1/2/3 as used by the shell scripts).
+#   start:  python Analysis_Server.py start     stop:  python Analysis_Server.py stop
+
+import os
+import sys
+import json
+import socket
+import signal
+import logging
+import argparse
+import importlib
+import traceback
+
+socket_path = '/tmp/moller_analysis.sock'
+log_file = 'analysis_server.log'
+exit_marker = b'\0EXIT '   # Followed by the exit code of the job
+job_error = 125             # Exit code of a job failing outside its script (not served, bad request, terminated without reporting)
+# Scripts served (script name: module name)
+scripts = {'Calculate_non-linearity.py': 'Calculate_non-linearity',
+           'Read_max_anode_current.py': 'Read_max_anode_current',
+           'Multiple_runs_analysis.py': 'Multiple_runs_analysis',
+           'Check_Record.py': 'Check_Record'}
+
+def listenPrivate(path):
+    '''
+    Listening Unix socket at path, accessible by the owner only. The socket file is created under a 0o177 umask
+    (not chmod-ed after the bind), so other local users can never connect to the server running the repo scripts
+    '''
+    if os.path.exists(path): os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen()
+    return server
+
+def readRequest(conn):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(4096)
+        if not chunk: break
+        data += chunk
+    return json.loads(data)
+
+def warmUp():
+    '''
+    Run the compiled code paths once (scipy routines, matplotlib font and mathtext caches)
+    '''
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from scipy.signal import find_peaks
+    from scipy.optimize import curve_fit
+    import Calculate_Asymmetry
+    y = np.sin(np.linspace(0, 20*np.pi, 4000))
+    find_peaks(Calculate_Asymmetry.sobelResponse(y, 100), distance=90)
+    curve_fit(lambda x, c, m: c + m*x, np.arange(9.), np.arange(9.)*0.1 + 1, p0=[1, 0])
+    fig, ax = plt.subplots()
+    ax.errorbar(np.arange(9.), np.arange(9.), yerr=np.ones(9), fmt='.')
+    ax.set_xlabel(r'$I_{anode}\ (\mu A)$')
+    ax.hist(y, bins=100)
+    fig.canvas.draw()
+    plt.close(fig)
+
+def configureLogging():
+    '''
+    The logging handlers were created when the server imported the scripts (in the server directory).
+    Open them again for the job: log files in the job directory, streams on the output sent to the client
+    '''
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.FileHandler): job_handler = logging.FileHandler(os.path.basename(handler.baseFilename))
+        elif isinstance(handler, logging.StreamHandler): job_handler = logging.StreamHandler()
+        else: continue
+        job_handler.setLevel(handler.level)
+        job_handler.setFormatter(handler.formatter)
+        root.removeHandler(handler)
+        handler.close()
+        root.addHandler(job_handler)
+
+def runJob(conn, request, modules):
+    '''
+    Executed in the forked child: run the script main() with the output sent to the client
+    '''
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL) # The server ignores SIGCHLD, subprocess waits of the job need the exit status
+    os.dup2(conn.fileno(), 1)
+    os.dup2(conn.fileno(), 2)
+    sys.stdout.reconfigure(line_buffering=True)
+    code = job_error
+    try:
+        script = os.path.basename(request['script'])
+        if script not in modules: raise ValueError(f"[Analysis Server]: {script} is not served")
+        os.chdir(request['cwd'])
+        configureLogging()
+        sys.argv = [script, *request['args']]
+    except BaseException:
+        traceback.print_exc()
+    else:
+        code = 1 # Uncaught exception of the script, as in a direct run
+        try:
+            modules[script].main()
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException:
+            traceback.print_exc()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        conn.sendall(exit_marker + f'{code}\n'.encode())
+    finally:
+        os._exit(0)
+
+def serve():
+    import matplotlib
+    matplotlib.use('Agg') # No display needed for the saved figures
+    modules = {script: importlib.import_module(module) for script, module in scripts.items()}
+    warmUp()
+    server = listenPrivate(socket_path)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN) # Finished jobs are reaped automatically
+    print(f"[Analysis Server]: Ready ({socket_path})", flush=True)
+    while True:
+        conn, _ = server.accept()
+        try:
+            request = readRequest(conn)
+        except (OSError, ValueError):
+            conn.close()
+            continue
+        if request.get('stop'):
+            conn.close()
+            break
+        if os.fork() == 0:
+            server.close()
+            runJob(conn, request, modules)
+        conn.close()
+    server.close()
+    os.remove(socket_path)
+
+def isRunning():
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(prog='MOLLER Experiment: Analysis server',
+                                     description='Keep the analysis modules loaded and run the analysis jobs of the shell scripts. \nCode by: Anuradha Gunawardhana')
+    parser.add_argument("command", choices=['start', 'stop', 'run'], help="start: run in the background, stop: stop the running server, run: run in the foreground")
+    args = parser.parse_args()
+
+    if args.command == 'stop':
+        if isRunning():
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(socket_path)
+                s.sendall(json.dumps({'stop': True}).encode() + b'\n')
+            print("[Analysis Server]: Stopped")
+        return
+    if isRunning():
+        print("[Analysis Server]: Already running")
+        return
+    if args.command == 'start':
+        if os.fork() != 0: return # Detach from the calling shell
+        os.setsid()
+        log = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+    serve()
+
+if __name__ == "__main__":
+    main()
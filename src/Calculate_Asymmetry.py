@@ -3,18 +3,30 @@
 # Description: Utility functions for calculating the LED asymmetry from the recorded root files
 
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.signal import find_peaks
-from matplotlib.ticker import AutoMinorLocator,AutoLocator
 import uproot
 import os
+import sys
+import subprocess
+import Record_Cache
+import Pedestal_Stats
+import Record_Features
+from Running_Stats import RunningStats
+import Experiment_Data
+from contextlib import nullcontext
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from itertools import repeat
 
 ADC_rate = 14705883         # Samples/sec
 selection_ratio = 60        # % portion of the data needed to be selected from a half cycle
 quartet_frequency = 960     # Chopper frequency for the quartet asymmetry analysis
 pairwise_frequency = 1920   # Chopper frequency for the pairwise asymmetry analysis
 dataQualityThreshold = 3    # Maximum threshold factor of standard deviations allowed for random noise 
+load_threads = 4            # Number of root files loaded concurrently
+chunk_size = 2**20          # Samples per chunk in the streaming analysis of long records
+plot_columns = 2000         # Pixel columns of a raw data trace after decimation (min/max of each column is drawn)
 debug = False
 
 # logging.basicConfig(#filename='logs',
@@ -23,70 +35,395 @@ debug = False
 #                     datefmt = "%Y-%m-%d %H:%M:%S")
 
 filter_transmission = [100, 79, 63, 50, 40, 32, 25, 10, 5, 1, 0.1, 0.01]
+pedestal_files = ('12-0.root','12-1.root') # Pedestal records before and after the filter records
 
-def createSobel(n): # n=8 -> [1, 1, 1, 1,-1,-1,-1,-1]
-    arr_1 = np.ones((int(n/2),),dtype=int)
-    f = np.append(arr_1, arr_1*-1)
-    return f
+def sobelResponse(y, sobelSize):
+    '''
+    Edge response of the data: abs(np.convolve(y, sobel, mode="same"))/sobelSize, sobel = [1,..,1,-1,..,-1] (sobelSize long)
+    with the missing values discarded from both sides (sobelSize/2 points each).
+    The kernel is the difference of two box sums, so the response is taken from one cumulative sum in O(N).
+    Works along the last axis, so a 2-D array of records gives the response of every row
+    '''
+    h = int(sobelSize/2)
+    y = np.asarray(y)
+    n = y.shape[-1] - 2*h
+    if h == 0 or n <= 0: return np.zeros(y.shape[:-1]+(0,))
+    offset = np.mean(y, axis=-1, keepdims=True) # The kernel sum is zero, remove the DC level to keep the precision of the sums
+    cs = np.cumsum(y - offset, axis=-1)
+    cs = np.concatenate((np.zeros(y.shape[:-1]+(1,)), cs), axis=-1)
+    # sum(y[j+h:j+2h]) - sum(y[j:j+h])
+    edge = cs[...,2*h:2*h+n] - 2*cs[...,h:h+n] + cs[...,0:n]
+    return abs(edge)*(1/sobelSize)
+
+def _loadRecord(path, dataArr_limit, branches, keepFull, executor):
+    arrays = Record_Cache.load(path, branches) if Record_Cache.enabled else None
+    cached = arrays is not None
+    if not cached:
+        with uproot.open(path) as file:
+            tree = file['DataTree'].arrays(branches, library='ak', array_cache=None, decompression_executor=executor)
+        arrays = {b: tree[b].to_numpy().reshape(-1) for b in branches} # One entry per record
+        if Record_Cache.enabled: Record_Cache.store(path, arrays)
+    record = {}
+    for b in branches:
+        arr = arrays[b]
+        record['length'] = len(arr)
+        if keepFull: 
+            record[f'{b}_full'] = arr
+            record[b] = arr[0:dataArr_limit]
+        elif cached: record[b] = arr[0:dataArr_limit] # Memory-mapped, nothing to release
+        else: record[b] = arr[0:dataArr_limit].copy() # Trim and release the full record
+    return record
+
+def loadRecords(data_path, rootFiles, dataArr_limit=None, branches=('ch1_data','ch0_data'), keepFull=(), threads=load_threads):
+    '''
+    Load the root files of a run directory concurrently. Each file is opened once and only the requested branches
+    are decompressed (baskets are decompressed in parallel on a shared thread pool).
+    If the Record_Cache is enabled the decoded branches are memory-mapped from the cache instead.
+    Returns one dictionary per file with the branches trimmed to dataArr_limit and the untrimmed 'length'.
+    Files listed in keepFull also keep the untrimmed arrays as '<branch>_full' (used for the pedestals)
+    '''
+    with ThreadPoolExecutor(max_workers=threads) as executor, ThreadPoolExecutor(max_workers=threads) as loader:
+        jobs = [loader.submit(_loadRecord, f'{data_path}/{rootFile}', dataArr_limit, list(branches), rootFile in keepFull, executor)
+                for rootFile in rootFiles]
+        return [job.result() for job in jobs]
+
+def pedestalStats(data_path, rootFiles, bins=None, records=None, branch='ch1_data'):
+    '''
+    Statistics (count, mean, std, min, max and the histogram if bins is given) of the full pedestal records,
+    cached per root file by Pedestal_Stats. Only the records without cached statistics are loaded, unless the
+    caller already loaded them: records (one per file, keeping the '<branch>_full' arrays)
+    '''
+    stats = {rootFile: Pedestal_Stats.lookup(f'{data_path}/{rootFile}', branch, bins) for rootFile in rootFiles}
+    missing = [rootFile for rootFile in rootFiles if stats[rootFile] is None]
+    if records is None and missing: records = dict(zip(missing, loadRecords(data_path, missing, branches=(branch,), keepFull=missing)))
+    elif records is not None: records = dict(zip(rootFiles, records))
+    for rootFile in missing:
+        stats[rootFile] = Pedestal_Stats.compute(records[rootFile][f'{branch}_full'], bins, chunk_size)
+        Pedestal_Stats.store(f'{data_path}/{rootFile}', stats[rootFile], branch)
+    return [stats[rootFile] for rootFile in rootFiles]
 
 def addOrReplaceLine(data_path, lineIdentifier, value):
     '''
     Add new entries to the experiment_data text file.
     If the value identifier already exist in the file, only the value is update
     If there's no existing identifier, a new one will be created with the value 
+    For several entries, use one Experiment_Data.ExperimentData object (single rewrite of the file)
     '''
-    lineFound=False
-    with open(f"{data_path}/Experiment_data.txt", 'r+') as Exp_data:
-        expLines = Exp_data.readlines()
-        for i, line in enumerate(expLines):
-            id = line.split('=')[0]
-            # value = i.split('=')[1].strip() 
-            if id == lineIdentifier:
-                lineFound=True
-                lineNum=i
-        if lineFound:
-            with open(f"{data_path}/Experiment_data.txt", 'w') as Exp_data:
-                for i, line in enumerate(expLines):
-                    if lineNum!=i: Exp_data.write(line)
-                    else: Exp_data.write(f'{lineIdentifier}={value}\n') # Replace the line with new data
-        else: Exp_data.write(f'{lineIdentifier}={value}\n') # Add the new data line if not exist
-
-def find_anomalies(data, threshold=dataQualityThreshold):
-    return np.abs(data - np.mean(data)) > threshold * np.std(data)
-
-def dataQualityTest(data,sobelSize):
-    anomaly_threshold = 1
-    for i,y in enumerate(data):
-        if i!=9 and i!=10: # Skip filter 10 and 11 as they are not used for the analysis but test pedestal runs
-            stat_anomalies = find_anomalies(y)
-            anSum = np.sum(stat_anomalies)
-            stat_factor = (anSum/len(stat_anomalies))*100
-            if stat_factor > anomaly_threshold: 
-                print(f'🚨 [ERROR]: {stat_factor:.2f}% anomalies detected in F{i+1} data')
-                return -1
-
-        if i<9: 
-            sobel_filtered_data = abs(np.convolve(y, createSobel(sobelSize), mode="same"))*(1/sobelSize)  
-            sobel_filtered_data = sobel_filtered_data[int(sobelSize/2):-int(sobelSize/2)] # discard missing values from sides 
-            peaks, _  = find_peaks(sobel_filtered_data, distance = int(sobelSize*0.9))
-            periods = np.diff(peaks)
-            
-            sobel_anomalies = find_anomalies(periods)
-            anSum = np.sum(sobel_anomalies)
-            sobel_factor = (anSum/len(sobel_anomalies))*100
-            if sobel_factor > anomaly_threshold:
-                print(f'🚨 [ERROR]: {sobel_factor:.2f}% period related anomalies detected in F{i+1}')
-                return -1
+    with Experiment_Data.ExperimentData(data_path) as expData:
+        expData[lineIdentifier] = value
+
+def deferPlots(data_path, kind, **arrays):
+    '''
+    Save the intermediate arrays of a figure set to <data_path>/<kind>_plot_data.npz and render the
+    figures in a background Render_Plots.py process, so the analysis never imports matplotlib
+    '''
+    np.savez(f"{data_path}/{kind}_plot_data.npz", **arrays)
+    renderer = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Render_Plots.py')
+    with open(f"{data_path}/plot_errors.log", 'a') as log: # Same log as the rendering errors of Render_Plots.py
+        subprocess.Popen([sys.executable, renderer, data_path, kind], stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=log, start_new_session=True)
+
+def minMaxDecimate(y, x=None, columns=plot_columns):
+    '''
+    Min/max envelope of a raw trace for plotting: y is split into 'columns' consecutive bins and only the
+    minimum and the maximum sample of each bin are kept (in time order). A line through these points covers
+    the same pixels as the full trace, with at most 2*columns points. Returns x, y
+    '''
+    y = np.asarray(y)
+    n = len(y)
+    if x is None: x = np.arange(n)
+    if n <= 4*columns: return x[:n], y
+    b = -(-n//columns) # samples per bin
+    bins = np.pad(y, (0, columns*b - n), mode='edge').reshape(columns, b)
+    start = np.arange(columns)*b
+    lo, hi = start + np.argmin(bins, axis=1), start + np.argmax(bins, axis=1)
+    idx = np.minimum(np.stack([np.minimum(lo, hi), np.maximum(lo, hi)], axis=1).ravel(), n-1)
+    return x[idx], y[idx]
+
+def rawTraces(f, record, dataArr_limit):
+    '''
+    Decimated raw traces of record f for Render_Plots: PMT data (first 2.5% and full length) and photodiode data
+    (first 2.5%) against the time stamps, so the figures are drawn without loading the records again
+    '''
+    pt = int(dataArr_limit*0.025) # custom points
+    traces = {}
+    for key, y in (('raw', record['ch1_data'][0:pt]), ('full', record['ch1_data']), ('diode', record['ch0_data'][0:pt])):
+        traces[f'{key}_t_{f}'], traces[f'{key}_{f}'] = minMaxDecimate(y, record['tStmp'])
+    return traces
+
+def anomalyPercentage(data, threshold=dataQualityThreshold, chunkSize=chunk_size):
+    '''
+    Percentage of the samples of a record farther than threshold standard deviations from its mean.
+    The mean and standard deviation are accumulated chunk by chunk (RunningStats), then the samples are
+    counted in a second pass, without a full-size boolean mask
+    '''
+    return RunningStats.of(data, chunkSize).anomalyFactor(data, threshold, chunkSize)
+
+def filterFeatures(f, sobelSize):
+    '''
+    Edge response, peaks and period anomalies of a single filter record
+    '''
+    sobel_filtered_data = sobelResponse(f, sobelSize)
+    peaks, _  = find_peaks(sobel_filtered_data, distance = int(sobelSize*0.9))
+    periods = np.diff(peaks)
+    return {'sobel': sobel_filtered_data,
+            'peaks': peaks,
+            'periods': periods,
+            'sobel_factor': anomalyPercentage(periods)}
+
+def pairMeans(windowSum, peaks, w, analysisMethod):
+    '''
+    Mean levels(v1, v2) of the H & L selection windows of every asymmetry pair, from the peaks of the edge response.
+    windowSum(a, b) returns the sums and lengths of the data slices [a:b] for arrays of slice bounds.
+    Returns v1 & v2 means and the quartet phase shift(0/1) of each pair
+    '''
+    Asy_count = max(int(len(peaks)/2)-2, 0)  # Asymmetry pair count. -2 for skipping last two peaks
+    k = 2*np.arange(Asy_count)+2             # First selected peak of each pair (skip two first peaks)
+    if analysisMethod == 'quartet':      # Quartet analysis for 960Hz
+        def quartet(k): # v1 = f[p(k):p(k)+w] + f[p(k+2)-w:p(k+2)],  v2 = f[p(k+1)-w:p(k+1)+w]
+            s1, n1 = windowSum(peaks[k], peaks[k]+w)
+            s2, n2 = windowSum(peaks[k+2]-w, peaks[k+2])
+            s3, n3 = windowSum(peaks[k+1]-w, peaks[k+1]+w)
+            return (s1+s2)/(n1+n2), s3/n3
+        v1, v2 = quartet(k)
+        shift = (v1 < v2).astype(int) # (v1<v2) = |+--+|+--+|+--+|,  (v1>v2) = |-++-|-++-|-++-|
+        if np.any(shift):
+            v1_shifted, v2_shifted = quartet(k[shift==1]+1)
+            v1[shift==1] = v1_shifted
+            v2[shift==1] = v2_shifted
+    else:                                # Pairwise analysis for 1920Hz flashing (every adjacent H&L pair)
+        s1, n1 = windowSum(peaks[k]-w, peaks[k]+w)        # -+-|+-|+-|+-|+-|+-
+        s2, n2 = windowSum(peaks[k+1]-w, peaks[k+1]+w)
+        v1, v2 = s1/n1, s2/n2
+        shift = np.zeros(Asy_count, dtype=int)
+    return v1, v2, shift
+
+def pairWindowBounds(peaks, w, analysisMethod):
+    '''
+    All the slice bounds pairMeans may ask for (including the quartet shifted windows)
+    '''
+    p = np.asarray(peaks)
+    if analysisMethod == 'quartet': return np.unique(np.concatenate((p, p+w, p-w)))
+    return np.unique(np.concatenate((p-w, p+w)))
+
+def asymmetryFromMeans(v1, v2):
+    #------H,L separation per each asymmetry pair ------#
+    H = np.maximum(v1, v2)    # Differentiate H and L based on the magnitude
+    L = np.minimum(v1, v2)
+    V_mean_temp = (H + L)/2
+    A_LED_temp = (H - L)/(H + L) # calculate Asymmetry for selected pair of High and LOW
+    return A_LED_temp, V_mean_temp
+
+def pairAsymmetry(f, peaks, w, analysisMethod):
+    '''
+    Select the H & L data of every asymmetry pair of a record at once.
+    All the window means are taken from a single cumulative sum of the record indexed by the peaks array,
+    instead of slicing and averaging the data pair by pair.
+    Returns the per pair asymmetries, mean levels, v1 & v2 means and the quartet phase shift(0/1) of each pair
+    '''
+    offset = np.mean(f)                      # Remove the DC level before summing to keep the precision of the window sums
+    cs = np.concatenate(([0], np.cumsum(f - offset)))
+
+    def windowSum(a, b): # Sum and length of f[a:b] for arrays of slice bounds
+        a = np.clip(a, 0, len(f))
+        b = np.clip(b, 0, len(f))
+        return cs[b] - cs[a], b - a
+
+    v1, v2, shift = pairMeans(windowSum, peaks, w, analysisMethod)
+    v1 += offset
+    v2 += offset
+    A_LED_temp, V_mean_temp = asymmetryFromMeans(v1, v2)
+    return A_LED_temp, V_mean_temp, v1, v2, shift
+
+def analyseFilter(f, sobelSize, w=None, analysisMethod=None, keepSobel=True):
+    '''
+    Features of a single filter record, followed by the H & L pairing when the selection width is given
+    '''
+    feature = filterFeatures(f, sobelSize)
+    if w is not None:
+        A_LED_temp, V_mean_temp, v1_mean, v2_mean, shift = pairAsymmetry(f, feature['peaks'], w, analysisMethod)
+        feature.update({'A_LED_temp': A_LED_temp, 'V_mean_temp': V_mean_temp, 'v1_mean': v1_mean, 'v2_mean': v2_mean, 'shift': shift})
+    if not keepSobel: feature['sobel'] = None # Only needed for plotting
+    return feature
+
+_shared_memory = None # Shared data block attached by each worker process
+_shared_data = None
+
+def _attachSharedData(name, shape, dtype):
+    global _shared_memory, _shared_data
+    _shared_memory = shared_memory.SharedMemory(name=name)
+    _shared_data = np.ndarray(shape, dtype=dtype, buffer=_shared_memory.buf)
+
+def _filterWorker(i, sobelSize, w, analysisMethod, keepSobel):
+    return analyseFilter(_shared_data[i], sobelSize, w, analysisMethod, keepSobel)
+
+def extractFeatures(data, sobelSize, feature_count=9, w=None, analysisMethod=None, keepSobel=True, workers=1):
+    '''
+    Compute the per filter features once, to be shared by the data quality test, the pairing and the plotting.
+    Statistical anomalies are counted for all the records (streaming, no full-size temporaries),
+    edge response, peaks, periods (and pairs) only for the first feature_count filters.
+    With workers>1 the filters are spread over a process pool that reads the data through shared memory
+    '''
+    stat_factor = [anomalyPercentage(y) for y in data]
+    feature_count = min(feature_count, len(data))
+    if workers > 1:
+        shm = shared_memory.SharedMemory(create=True, size=max(data[0:feature_count].nbytes, 1))
+        try:
+            shared = np.ndarray(data[0:feature_count].shape, dtype=data.dtype, buffer=shm.buf)
+            shared[:] = data[0:feature_count]
+            with ProcessPoolExecutor(max_workers=min(workers, feature_count),
+                                     initializer=_attachSharedData,
+                                     initargs=(shm.name, shared.shape, shared.dtype.str)) as pool:
+                filter_features = list(pool.map(_filterWorker, range(feature_count), repeat(sobelSize), repeat(w),
+                                                repeat(analysisMethod), repeat(keepSobel)))
+            del shared
+        finally:
+            shm.close()
+            shm.unlink()
+    else:
+        filter_features = [analyseFilter(y, sobelSize, w, analysisMethod, keepSobel) for y in data[0:feature_count]]
+
+    features = []
+    for i in range(len(data)):
+        feature = {'stat_factor': stat_factor[i]}
+        if i < feature_count: feature.update(filter_features[i])
+        features.append(feature)
+    return features
+
+def _chunks(n, chunkSize):
+    for a in range(0, n, chunkSize): yield a, min(a+chunkSize, n)
+
+def streamFeatures(y, sobelSize=None, w=None, analysisMethod=None, chunkSize=chunk_size, threshold=dataQualityThreshold):
+    '''
+    Chunked version of the statistical anomaly test and analyseFilter for a single record (ndarray or np.memmap).
+    Edge detection carries a halo of samples across the chunk boundaries and the pairing reads the window sums
+    from a running cumulative sum carried from chunk to chunk, so only one chunk is processed at a time.
+    Without a sobelSize only the statistics are computed (pedestal and unused filter records)
+    '''
+    N = len(y)
+    stats = RunningStats.of(y, chunkSize)
+    mean, std = stats.mean, stats.std
+    feature = {'mean': mean, 'std': std, 'count': N, 'sobel': None}
+    #------------- pass 1: edge response peaks ----------------#
+    if sobelSize is not None:
+        h = int(sobelSize/2)
+        distance = int(sobelSize*0.9)
+        halo = 4*distance          # Peaks closer than the distance to a chunk boundary are decided with the neighbouring data
+        peaks = [np.empty(0, dtype=int)]
+        for a,b in _chunks(max(N-2*h, 0), chunkSize):
+            lo = max(a-halo, 0)
+            hi = min(b+halo, N-2*h)
+            p, _ = find_peaks(sobelResponse(np.asarray(y[lo:hi+2*h], dtype=float), sobelSize), distance = distance)
+            p += lo
+            peaks.append(p[(p >= a) & (p < b)])
+        peaks = np.concatenate(peaks)
+        periods = np.diff(peaks)
+        feature.update({'peaks': peaks,
+                        'periods': periods,
+                        'sobel_factor': anomalyPercentage(periods)})
+        bounds = np.unique(np.clip(pairWindowBounds(peaks, w, analysisMethod), 0, N)) if w is not None else np.empty(0, dtype=int)
+    else: bounds = np.empty(0, dtype=int)
+    #------------- pass 2: anomaly count (as RunningStats.anomalies) and window sums ----------------#
+    anSum = 0
+    cs = np.zeros(len(bounds)) # Cumulative sums (around the mean) at the window bounds
+    carry = 0.0
+    for a,b in _chunks(N, chunkSize):
+        c = np.asarray(y[a:b], dtype=float) - mean
+        anSum += np.count_nonzero(np.abs(c) > threshold*std)
+        if len(bounds):
+            cc = np.cumsum(c)
+            sel = (bounds > a) & (bounds <= b)
+            cs[sel] = carry + cc[bounds[sel]-a-1]
+            carry += cc[-1]
+    feature['stat_factor'] = (anSum/N)*100 if N else np.nan # NaN for an empty record, as RunningStats.anomalyFactor
+    if sobelSize is not None and w is not None:
+        def windowSum(a, b):
+            a = np.clip(a, 0, N)
+            b = np.clip(b, 0, N)
+            return cs[np.searchsorted(bounds, b)] - cs[np.searchsorted(bounds, a)], b - a
+        v1, v2, shift = pairMeans(windowSum, peaks, w, analysisMethod)
+        feature.update({'v1_mean': v1 + mean, 'v2_mean': v2 + mean, 'shift': shift}) # Without the pedestal correction
+    return feature
+
+def analysisSettings(data_path, forcePairwise=False, forceQuartet=False):
+    '''
+    Collect the chopper frequency, run time and PMT serial from the Experiment_data file
+    and determine whether to do the pairwise or quartet analysis
+    '''
+    expData = Experiment_Data.readExperimentData(data_path)
+    chopper_frequency = int(expData["Chopper_Frequency(Hz)"])
+    runTime = expData["Record_Time(s)"]
+    pmtName = expData["PMT_Serial"]
+    analysisMethod = analysisMethodFor(chopper_frequency, forcePairwise, forceQuartet)
+    return chopper_frequency, runTime, pmtName, analysisMethod
+
+def analysisMethodFor(chopper_frequency, forcePairwise=False, forceQuartet=False):
+    #-------Determine whether to do the pairwise or quartet analysis ----------#
+    if chopper_frequency != pairwise_frequency and chopper_frequency != quartet_frequency: 
+        logging.error("🚨 [Analysis Failed]:Chopper frequencies don't match")
+    if forcePairwise and forceQuartet: 
+        logging.error("🚨 [Analysis Failed]:Cannot force both analysis same time")
+    if not forcePairwise and not forceQuartet: analysisMethod = 'pairwise' if chopper_frequency==pairwise_frequency else 'quartet'
+    elif forcePairwise: 
+        logging.info(f'Forcing pairwise analysis on {chopper_frequency} Hz data')
+        analysisMethod = 'pairwise'
+    elif forceQuartet: 
+        logging.info(f'Forcing quartet analysis on {chopper_frequency} Hz data')
+        analysisMethod = 'quartet'
+    return analysisMethod
+
+def streamWindows(sampling_rate, chopper_frequency):
+    '''
+    Sobel size and data selection width of the streaming analysis
+    '''
+    samples_per_cycle = sampling_rate/chopper_frequency
+    return int(samples_per_cycle*0.5), int(samples_per_cycle*selection_ratio/(4*100))
+
+anomaly_threshold = 1 # Maximum % of anomalies allowed in a record
+
+def featureQuality(i, feature):
+    '''
+    Data quality of the record at position i (0-8: filters, 9-10: filter 10 and 11, 11-12: pedestals) from its
+    features (extractFeatures, streamFeatures or reduceRecord). Returns the error message or None if it passed
+    '''
+    if i!=9 and i!=10: # Skip filter 10 and 11 as they are not used for the analysis but test pedestal runs
+        stat_factor = feature['stat_factor']
+        if np.isnan(stat_factor): # Empty record (a NaN factor would pass the threshold test)
+            return f'🚨 [ERROR]: No data in F{i+1}'
+        if stat_factor > anomaly_threshold: 
+            return f'🚨 [ERROR]: {stat_factor:.2f}% anomalies detected in F{i+1} data'
+
+    if i<9: 
+        sobel_factor = feature['sobel_factor']
+        if np.isnan(sobel_factor): # Less than two edges detected
+            return f'🚨 [ERROR]: No chopper periods detected in F{i+1}'
+        if sobel_factor > anomaly_threshold:
+            return f'🚨 [ERROR]: {sobel_factor:.2f}% period related anomalies detected in F{i+1}'
+    return None
+
+def dataQualityTest(data,sobelSize,features=None):
+    '''
+    Data quality of all the records of a run. Returns True if every record passed featureQuality
+    '''
+    if features is None: features = extractFeatures(data, sobelSize)
+    for i,feature in enumerate(features):
+        error = featureQuality(i, feature)
+        if error:
+            print(error)
+            return False
             
     if debug: print(f"✅ [Test Passed]: Total detected data irregularities are less than {anomaly_threshold}%")
-    return 1
+    return True
 
 def calculateAsymmetry(data_path,
                        filter_count,            # upto how many filters used for the analysis from filter 1
                        plotting=False,
                        forcePairwise=False,     # force the analysis to do the pairwise analysis regardless of the chopper frequency
                        forceQuartet=False,
-                       bins=100):               # Bin count of the histograms
+                       bins=100,                # Bin count of the histograms
+                       workers=1,               # Number of processes used for the per filter analysis (1 = serial)
+                       chunkSize=None,          # Process the records in chunks of this many samples (streaming mode for long records)
+                       expData=None):           # Experiment_Data.ExperimentData of the caller: entries are added to it, the caller flushes
 
     if debug: print(" ------------------------------------------------")
     if debug: print("|         Debug:Non-Linearity Analysis           |")
@@ -123,59 +460,35 @@ def calculateAsymmetry(data_path,
         record_length = float(lines[5].split(" ")[1])
     dataArr_limit = int((ADC_rate/prescale)*record_length*0.9)  # determine where the data 90% mark is
     if debug: print(f'prescale={prescale}, record_length={record_length:.2f}, data_limit:{dataArr_limit}')
+    if chunkSize: # Streaming mode: the records are reduced one at a time in chunks
+        if plotting: logging.info('Plotting is not available in the streaming analysis')
+        return streamAsymmetry(data_path, expected_file_list, fileTestPassed, prescale, dataArr_limit, filter_count,
+                               forcePairwise, forceQuartet, chunkSize, expData)
 
     if debug: print(f"[Test begin]: Preprocessing \"{data_path}\"")
     length_passed = np.empty([len(expected_file_list)])
     data = np.empty([len(expected_file_list),dataArr_limit])
     diode_data = np.empty([len(expected_file_list),dataArr_limit])
     if debug: print(f"Data size= {data.shape}")
-    #----------------------- Plot config ------------------------#
-    if plotting: 
-        figRaw, rawPlot = plt.subplots(figsize=(10, 7), constrained_layout = True)
-        figFull, fullPlot = plt.subplots(figsize=(10,7),constrained_layout = True)
-        figPhotodiode, diodePlot = plt.subplots(figsize=(10, 7), constrained_layout = True)
-        figPedestal, pedestalPlot = plt.subplots(figsize=(8, 6), constrained_layout = True)
-        figSobel, sobelPlot = plt.subplots(filter_count, 1,figsize=(15, 10),constrained_layout = True,sharex=True)
-        figAsyHist, asyPlot = plt.subplots(3, 3, figsize=(13, 12),constrained_layout = True)
     #----------------------- Load data ------------------------#
-    for f,rootFile in enumerate(expected_file_list):
-        file = uproot.open(f'{data_path}/{rootFile}')
-        tree = file['DataTree']
-        branches = tree.arrays()  
-        t = branches['tStmp'].to_numpy()
-        t = t.reshape((t.shape[1]))
-        ch0 = branches['ch1_data'].to_numpy()   # Photomultiplier(PMT) data
-        ch0 = ch0.reshape((ch0.shape[1]))
-
-        ch1 = branches['ch0_data'].to_numpy()   # Photo diode data
-        ch1 = ch1.reshape((ch1.shape[1]))
+    sampling_rate = ADC_rate/prescale                                   # Usual rate ~ 1,470,588.3
+    records = loadRecords(data_path, expected_file_list, dataArr_limit, keepFull=('12-0.root','12-1.root'),
+                          branches=('ch1_data','ch0_data','tStmp') if plotting else ('ch1_data','ch0_data'))
+    traces = {} # Decimated raw traces of the plots
+    for f,record in enumerate(records):
+        ch0 = record['ch1_data']   # Photomultiplier(PMT) data
+        ch1 = record['ch0_data']   # Photo diode data
 
         #---------------Check data lengths --------------------#
-        if (t[-1] > 100 and len(ch0) > dataArr_limit): 
-            data[f] = ch0[0:dataArr_limit]    # Trim the edges
-            diode_data[f] = ch1[0:dataArr_limit]
+        if (record['length']/(sampling_rate/1000) > 100 and record['length'] > dataArr_limit): # Record time(ms) taken from the sample count
+            data[f] = ch0    # Trimmed edges
+            diode_data[f] = ch1
             length_passed[f] = 1
+            if plotting and f not in (9, 10): traces.update(rawTraces(f, record, dataArr_limit))
             # if debug: print(f"F{f} - [Initial,Trimmed] shapes = [{ch0.shape},{data[f].shape}]")
-
-            #-------- setup raw PMT and photo-diode data for plotting -------#
-            pt = int(dataArr_limit*0.025) # custom points
-            ft = dataArr_limit  # Full length end point
-            # pt = int(dataArr_limit)
-            if plotting:
-                if f<9:
-                    rawPlot.plot(t[0:pt], data[f][0:pt],alpha=0.5,label=f'F{f+1}: {filter_transmission[f]}%')
-                    fullPlot.plot(t[0:ft], data[f],alpha=0.5,label=f'F{f+1}: {filter_transmission[f]}%')
-                    diodePlot.plot(t[0:pt], diode_data[f][0:pt],alpha=0.5,label=f'F{f+1}: {filter_transmission[f]}%')
-
-                if f==11: 
-                    rawPlot.plot(t[0:pt], data[f][0:pt],alpha=0.5,label='Pre-Pedestal')
-                    fullPlot.plot(t[0:ft], data[f],alpha=0.5,label='Pre-Pedestal')
-                    diodePlot.plot(t[0:pt], diode_data[f][0:pt],alpha=0.5,label='Pre-Pedestal')
-                if f==12: 
-                    rawPlot.plot(t[0:pt], data[f][0:pt],alpha=0.5,label='Post-Pedestal')
-                    fullPlot.plot(t[0:ft], data[f],alpha=0.5,label='Post-Pedestal')
-                    diodePlot.plot(t[0:pt], diode_data[f][0:pt],alpha=0.5,label='Post-Pedestal')
         else: length_passed[f] = 0
+    pedestal_records = records[11:13] # Untrimmed pedestal runs
+    del records
     #------------------- Length test results -------------------#
     if not np.all(length_passed): 
         logging.error(f" 🚨 [Test Failed]: Data length is less than {dataArr_limit} ms")
@@ -183,100 +496,36 @@ def calculateAsymmetry(data_path,
         if debug: print(f" ✅ [Test Passed]: Found adequate data for the analysis")
         dataTestPassed = True
         #---------------- Since test passed, collect Experiment_data --------------#
-        with open(f"{data_path}/Experiment_data.txt", 'r') as Exp_data:
-            expLines = Exp_data.readlines()
-            for i in expLines:
-                id = i.split('=')[0]
-                value = i.split('=')[1].strip() 
-                if id == "Chopper_Frequency(Hz)" : chopper_frequency = int(value)
-                if id == "Record_Time(s)" : runTime = value
-                if id == "PMT_Serial" : pmtName = value
-        #-------Determine whether to do the pairwise or quartet analysis ----------#
-        if chopper_frequency != pairwise_frequency and chopper_frequency != quartet_frequency: 
-            logging.error("🚨 [Analysis Failed]:Chopper frequencies don't match")
-        if forcePairwise and forceQuartet: 
-            logging.error("🚨 [Analysis Failed]:Cannot force both analysis same time")
-        if not forcePairwise and not forceQuartet: analysisMethod = 'pairwise' if chopper_frequency==pairwise_frequency else 'quartet'
-        elif forcePairwise: 
-            logging.info(f'Forcing pairwise analysis on {chopper_frequency} Hz data')
-            analysisMethod = 'pairwise'
-        elif forceQuartet: 
-            logging.info(f'Forcing quartet analysis on {chopper_frequency} Hz data')
-            analysisMethod = 'quartet'
+        chopper_frequency, runTime, pmtName, analysisMethod = analysisSettings(data_path, forcePairwise, forceQuartet)
         #----------------------Pedestal Correction------------------------#
-        pedestal = [0,0]
-        pedestal_sigma = [0,0]
-        pedestal_mean = [0,0]
-
-        for p in range(2):
-            file = uproot.open(f'{data_path}/12-{p}.root')   
-            ch0 = file['DataTree'].arrays()['ch1_data'].to_numpy()
-            pedestal[p] = ch0.reshape((ch0.shape[1]))
-            pedestal_sigma[p] = np.std(pedestal[p])
-            pedestal_mean[p] = np.mean(pedestal[p]) # mean of each pedestal
-            m="Pre" if p==0 else "Post"
-            if plotting: pedestalPlot.hist(pedestal[p], bins=bins, alpha=0.6, label=f'{m}-Pedestal',density=True)
+        pedestal = pedestalStats(data_path, expected_file_list[11:13], bins if plotting else None, pedestal_records) # 12-0.root, 12-1.root
+        pedestal_sigma = [pedestal[p]['std'] for p in range(2)]
+        pedestal_mean = [pedestal[p]['mean'] for p in range(2)] # mean of each pedestal
 
         pedestal_mean_diff = abs(pedestal_mean[1] - pedestal_mean[0])
         mean_pedestal_sigma = np.mean(pedestal_sigma) # mean of standard deviations 
         fac = 0.2 # fraction of acceptable drift 
         k = True if pedestal_mean_diff < fac*mean_pedestal_sigma else False
-        if plotting:
-            pedestalPlot.xaxis.set_minor_locator(AutoMinorLocator())
-            pedestalPlot.yaxis.set_minor_locator(AutoMinorLocator())
-            pedestalPlot.set_xlabel("ADC Voltage (V)")
-            pedestalPlot.set_ylabel("Probability Density")
-            pedestalPlot.set_title("Probability densities of ADC pedestal runs")
-            pedestalPlot.legend(title=rf'$\sigma_{{pre}}$= {pedestal_sigma[0]:.3e}'+'\n'+
-                                    fr'$\sigma_{{post}}$= {pedestal_sigma[1]:.3e}'+'\n'+
-                                    fr'{"✔️" if k else "‼️"} $|\mu_{{post}}-\mu_{{pre}}| {"<" if k else ">"} \sigma_{{avg}}*{int(fac*100)}\%$'+'\n'+
-                                    f'Run Time = {runTime}s')
-            pedestalPlot.margins(0)
-            figPedestal.savefig(f"{data_path}/pedestal.png")
 
         pedestal_correction = np.mean(pedestal_mean) # average of both mean
         data -= pedestal_correction
 
         #---------------------- Pedestal correction for photodiode ----------------------#
-        photodiode_pedestal = np.mean([np.mean(diode_data[11]), np.mean(diode_data[12])])
-        diode_data = diode_data[0:filter_count]  # keep only 9 filter positions
-        diode_data -= photodiode_pedestal
-        diodeMean = np.mean(diode_data,axis=1)
-        diodeMean_err = np.std(diode_data,axis=1)/np.sqrt(len(diode_data[0]))
-
-        if debug: print(f'Pedestal [mean(correction), drift/pre_sigma] = [{pedestal_correction:.4f}, {abs((np.mean(pedestal[0])-np.mean(pedestal[1]))/pedestal_sigma[0]):.8f}]')
-        #-------------Plot the raw PMT and photo-diode data----------------------#
+        diode_stats = [RunningStats.of(y) for y in diode_data]
+        photodiode_pedestal = np.mean([diode_stats[11].mean, diode_stats[12].mean])
+        diodeMean = np.array([stats.mean for stats in diode_stats[0:filter_count]]) - photodiode_pedestal # keep only 9 filter positions
+        diodeMean_err = np.array([stats.std for stats in diode_stats[0:filter_count]])/np.sqrt(dataArr_limit)
+
+        if debug: print(f'Pedestal [mean(correction), drift/pre_sigma] = [{pedestal_correction:.4f}, {abs((pedestal_mean[0]-pedestal_mean[1])/pedestal_sigma[0]):.8f}]')
+        #-------------Intermediate data of the raw PMT, photo-diode and pedestal plots----------------------#
         if plotting:
-            rawPlot.xaxis.set_minor_locator(AutoMinorLocator())
-            rawPlot.yaxis.set_minor_locator(AutoMinorLocator())
-            rawPlot.legend(loc='upper right',fontsize="12") 
-            rawPlot.set_ylabel(r'Voltage $(V)$',fontsize=15) 
-            rawPlot.set_xlabel(r"Time $(ms)$",fontsize=15)
-            rawPlot.set_title("Raw data: Constant LED with Flashing LED", fontsize=18)
-            rawPlot.margins(x=0)
-            figRaw.savefig(f"{data_path}/RawData.png")
-
-            # fullPlot.xaxis.set_minor_locator(AutoMinorLocator())
-            # fullPlot.yaxis.set_minor_locator(AutoMinorLocator())
-            fullPlot.grid(linestyle='--')
-            fullPlot.legend(loc='upper right',fontsize="12") 
-            fullPlot.set_ylabel(r'Voltage $(V)$',fontsize=15) 
-            fullPlot.set_xlabel(r"Time $(ms)$",fontsize=15)
-            fullPlot.set_title("Raw data: Full range", fontsize=18)
-            fullPlot.margins(x=0)
-            figFull.savefig(f"{data_path}/rawData_full.png")
-
-            diodePlot.xaxis.set_minor_locator(AutoMinorLocator())
-            diodePlot.yaxis.set_minor_locator(AutoMinorLocator())
-            diodePlot.legend(loc='upper right',fontsize="12") 
-            diodePlot.set_ylabel(r'Voltage $(V)$',fontsize=15) 
-            diodePlot.set_xlabel(r"Time $(ms)$",fontsize=15)
-            diodePlot.set_title("Photodiode raw data", fontsize=18)
-            diodePlot.margins(x=0)
-            figPhotodiode.savefig(f"{data_path}/Photodiode_raw.png")
+            plotData = dict(files=expected_file_list, filter_count=filter_count, dataArr_limit=dataArr_limit,
+                            sampling_rate=sampling_rate, bins=bins, runTime=runTime, fac=fac, pedestal_drift_passed=k,
+                            pedestal_sigma=pedestal_sigma, pedestal_correction=pedestal_correction,
+                            pedestal_hist=[pedestal[p]['hist'] for p in range(2)], pedestal_edges=[pedestal[p]['edges'] for p in range(2)],
+                            **traces)
 
         #-----------------------Sobel window size--------------------------#
-        sampling_rate = ADC_rate/prescale                                   # Usual rate ~ 1,470,588.3
         samples_per_cycle = sampling_rate/chopper_frequency
         sobelSize = int(samples_per_cycle*0.5)             # Sobel size should cover around quarter(0.25) of H-L cycle to get a triangular shape
         w = int(samples_per_cycle*selection_ratio/(4*100))  # Data selection width. Total selection =2*w
@@ -288,105 +537,144 @@ def calculateAsymmetry(data_path,
         V_mean = np.empty(filter_count) #Mean voltage level
         V_mean_err = np.empty(filter_count)
     #---------------- Data quality check ----------------#
-    dataQualityPassed = dataQualityTest(data,sobelSize)
+    features = extractFeatures(data, sobelSize, max(filter_count, 9), w, analysisMethod, keepSobel=plotting, workers=workers)
+    dataQualityPassed = dataQualityTest(data,sobelSize,features)
     #---------------- Asymmetry calculation --------------#
     if fileTestPassed and dataTestPassed and dataQualityPassed:
-        if plotting:
-            figSobel.suptitle(f"Data Filtering", fontsize=14)
-            figAsyHist.suptitle(f"LED Asymmetry distribution", fontsize=18)
-            sep_plot_lim=int(dataArr_limit*0.02) # Plot length (data points)
-
-            xt=np.arange(0,sep_plot_lim)/(sampling_rate/1000) #scale the x-axis to proper milliseconds range
+        if plotting: sep_plot_lim=int(dataArr_limit*0.02) # Plot length (data points)
 
         for i,f in enumerate(data[0:filter_count]):
             #------------------- Asymmetry pair counting ------------------#
-            DC_offset = np.mean(f) # DC offset to plot sobel triangular wave
-            sobel_filtered_data = abs(np.convolve(f, createSobel(sobelSize), mode="same"))*(1/sobelSize)  
-            sobel_filtered_data = sobel_filtered_data[int(sobelSize/2):-int(sobelSize/2)] # discard missing values from sides 
-            peaks, _  = find_peaks(sobel_filtered_data, distance = int(sobelSize*0.9))
-
-            Asy_count = int(len(peaks)/2)-2  # Asymmetry pair count. -2 for skipping last two peaks
-            A_LED_temp = np.zeros(Asy_count)
-            V_mean_temp = np.zeros(Asy_count)
-            #----------------- filtering (and plotting) data based on the analysis method ------------#
-            clr = ['red', 'orange'] # colors for quartet analysis separation plot
-            for u in range(Asy_count):  # Iterate over peaks and select H & L data points
-                if analysisMethod == 'quartet':      # Quartet analysis for 960Hz
-                    v1 = np.append(f[peaks[2*u+2]:peaks[2*u+2]+w], f[peaks[2*u+4]-w:peaks[2*u+4]])
-                    v2 = f[peaks[2*u+3]-w:peaks[2*u+3]+w]
-                    r=0 # For plotting
-                    if np.mean(v1) < np.mean(v2): # (v1<v2) = |+--+|+--+|+--+|,  (v1>v2) = |-++-|-++-|-++-| 
-                        v1 = np.append(f[peaks[2*u+3]:peaks[2*u+3]+w], f[peaks[2*u+5]-w:peaks[2*u+5]])
-                        v2 = f[peaks[2*u+4]-w:peaks[2*u+4]+w]
-                        r=1
-                    if plotting and peaks[2*u+3]+w < sep_plot_lim:
-                        sobelPlot[i].scatter(np.append(np.arange(peaks[2*u+2+r],peaks[2*u+2+r]+w)/(sampling_rate/1000), np.arange(peaks[2*u+4+r]-w,peaks[2*u+4+r])/(sampling_rate/1000)),v1, alpha=0.5, color=clr[u%2] if (np.mean(v1)>np.mean(v2)) else 'g',marker ='.',linewidths=0.2)
-                        sobelPlot[i].scatter(np.arange(peaks[2*u+3+r]-w,peaks[2*u+3+r]+w)/(sampling_rate/1000),v2, alpha=0.5, color='g' if (np.mean(v1)>np.mean(v2)) else clr[u%2],marker ='.',linewidths=0.2)
-                
-                if analysisMethod == 'pairwise':     # Pairwise analysis for 1920Hz flashing (Calculate asymmetry by selecting every adjacent H&L pair)
-                    v1 = f[peaks[2*u+2]-w:peaks[2*u+2]+w]       # Selecting data using peaks(skip two first peaks)    -+-|+-|+-|+-|+-|+-
-                    v2 = f[peaks[2*u+3]-w:peaks[2*u+3]+w]
-
-                    if plotting and peaks[2*u+3]+w < sep_plot_lim:
-                        sobelPlot[i].scatter(np.arange(peaks[2*u+2]-w,peaks[2*u+2]+w)/(sampling_rate/1000),v1, alpha=0.5, color='r' if (np.mean(v1)>np.mean(v2)) else 'g',marker ='.',linewidths=0.2)
-                        sobelPlot[i].scatter(np.arange(peaks[2*u+3]-w,peaks[2*u+3]+w)/(sampling_rate/1000),v2, alpha=0.5, color='g' if (np.mean(v1)>np.mean(v2)) else 'r',marker ='.',linewidths=0.2)
-                #------H,L separation per each asymmetry pair ------#
-                H = max(np.mean(v1), np.mean(v2))    # Differentiate H and L based on the magnitude
-                L = min(np.mean(v1), np.mean(v2))
-
-                V_mean_temp[u] = (H + L)/2
-                A_LED_temp[u] = (H - L)/(H + L) # calculate Asymmetry for selected pair of High and LOW
+            A_LED_temp = features[i]['A_LED_temp']
+            V_mean_temp = features[i]['V_mean_temp']
             #--------- Final mean asymmetry per filter --------#
             A_LED[i] = np.mean(A_LED_temp) # Final asymmetry for per filter positions
             A_LED_err[i] = np.std(A_LED_temp)/np.sqrt(len(A_LED_temp)) # standard error of mean
             
             V_mean[i]  = np.mean(V_mean_temp)
             V_mean_err[i] = np.std(V_mean_temp)/np.sqrt(len(V_mean_temp)) # standard error of mean
-            #--------- Plotting asymmetry distributions and sobel filtering--------#
+            #--------- Data of the asymmetry distributions and sobel filtering plots --------#
             if plotting:
-                sobelPlot[i].plot(xt, f[0:sep_plot_lim], label="Raw Data", alpha=0.3)
-                sobelPlot[i].plot(xt,(sobel_filtered_data + DC_offset-np.mean(sobel_filtered_data))[0:sep_plot_lim], alpha=0.7,label='Sobel filtered data')
-                peaks_plot_len = 0
-                for d,r in enumerate(peaks):
-                    if r > sep_plot_lim: 
-                        peaks_plot_len = d-1
-                        break
-                sobelPlot[i].legend(title=f'ND Filter: {filter_transmission[i]}%', bbox_to_anchor=(1.01, 1), borderaxespad=0)
-                sobelPlot[i].set_ylabel(r"$Voltage(V)$",fontsize=11)
-                sobelPlot[i].xaxis.set_minor_locator(AutoMinorLocator()) 
-                sobelPlot[i].margins(x=0)     
-
-                nn, b, patches = asyPlot[int(i/3), i%3].hist(A_LED_temp, bins=bins, alpha=0.6, label="Data")
-                nk=np.max(nn)
-                asyPlot[int(i/3), i%3].axvline(A_LED[i],ls='--',color='r',label=r'$\mu$',lw=1)
-                # asyPlot[int(i/3), i%3].fill_betweenx(np.arange(0,nk), eminus, eplus, facecolor='green', alpha=0.8)
-                asyPlot[int(i/3), i%3].errorbar(A_LED[i], nk/10, xerr=A_LED_err[i],elinewidth=1, capsize=3, ecolor='k', lw=0, label=r'$\sigma /\sqrt{{n}}$')
-                asyPlot[int(i/3), i%3].set_title(fr"F:{filter_transmission[i]}%, $\sigma$={np.std(A_LED_temp):.2e}, $\mu$={A_LED[i]:.2e}, $\sigma /\sqrt{{n}}$={np.std(A_LED_temp)/np.sqrt(len(A_LED_temp)):.2e}",fontsize=12)
-                asyPlot[int(i/3), i%3].set_xlabel(r"$A_{LED}$",fontsize=14)
-                asyPlot[int(i/3), i%3].set_ylabel(r"$Count$",fontsize=14)
-                asyPlot[int(i/3), i%3].margins(0)
-                asyPlot[int(i/3), i%3].legend(title=f'n={len(A_LED_temp)}')
-                asyPlot[int(i/3), i%3].xaxis.set_major_locator(AutoLocator())
-                asyPlot[int(i/3), i%3].tick_params(axis='x',rotation = 45)
-
-        if plotting:        
-            # sobelPlot[0].legend(bbox_to_anchor=(1.01, 1), borderaxespad=0)
-            sobelPlot[filter_count-1].set_xlabel(r"$Time(ms)$",fontsize=11)
-
-            figSobel.savefig(f"{data_path}/Sobel_filtering.png")
-
-            figAsyHist.savefig(f"{data_path}/Asymmetry_distribution.png")
+                sobel_filtered_data = features[i]['sobel']
+                plotData[f'sobel_{i}'] = (sobel_filtered_data - np.mean(sobel_filtered_data))[0:sep_plot_lim]
+                plotData[f'trace_{i}'] = f[0:sep_plot_lim+2*int(samples_per_cycle)] # Pedestal corrected data under the selection windows of the plotted pairs
+                plotData[f'DC_offset_{i}'] = np.mean(f)
+                for key in ('peaks', 'shift', 'v1_mean', 'v2_mean', 'A_LED_temp'):
+                    plotData[f'{key}_{i}'] = features[i][key]
 
+        if plotting:
+            plotData.update(analysisMethod=analysisMethod, w=w, A_LED=A_LED, A_LED_err=A_LED_err)
+            deferPlots(data_path, 'Asymmetry', **plotData)
         if debug: print(" ✅ [Complete]: LED Asymmetries, Means and errors are calculated")
         res=0
 
         # add/replace analysis data
-        addOrReplaceLine(data_path, 'Pedestal_Means[pre,post](V)', f'[{pedestal_mean[0]},{pedestal_mean[1]}]')
-        addOrReplaceLine(data_path, 'Pedestal_STD[pre,post](V)', f'[{pedestal_sigma[0]},{pedestal_sigma[1]}]')
+        with Experiment_Data.ExperimentData(data_path) if expData is None else nullcontext(expData) as exp:
+            exp['Pedestal_Means[pre,post](V)'] = f'[{pedestal_mean[0]},{pedestal_mean[1]}]'
+            exp['Pedestal_STD[pre,post](V)'] = f'[{pedestal_sigma[0]},{pedestal_sigma[1]}]'
 
         return res, A_LED, A_LED_err, V_mean, V_mean_err, diodeMean, diodeMean_err
 
     else: 
+        if plotting and dataTestPassed: deferPlots(data_path, 'Asymmetry', **plotData) # Raw data plots for the inspection
         print(f" 🚨 [ERROR]: {pmtName} analysis failed. One or more tests failed")
         res=-1
-        return res, A_LED, A_LED_err, V_mean, V_mean_err, diodeMean, diodeMean_err
\ No newline at end of file
+        return res, A_LED, A_LED_err, V_mean, V_mean_err, diodeMean, diodeMean_err
+
+def lengthPassed(length, sampling_rate, dataArr_limit):
+    return length/(sampling_rate/1000) > 100 and length > dataArr_limit # Record time(ms) taken from the sample count
+
+def reduceRecord(data_path, rootFile, dataArr_limit, sampling_rate, sobelSize, w, analysisMethod, chunkSize=chunk_size):
+    '''
+    Everything streamAsymmetry needs from one record: the untrimmed length, the anomaly factors and the raw pair
+    window means of the PMT data (streamFeatures) and the photodiode mean and std. The statistics of a pedestal
+    record are saved by pedestalStats on the way. Reductions are cached per root file (Record_Features), so the
+    records reduced during the acquisition (Check_Record.py, Pipelined_Analysis.py) are not loaded again
+    '''
+    path = f'{data_path}/{rootFile}'
+    params = {'dataArr_limit': dataArr_limit, 'sobelSize': sobelSize, 'w': w, 'analysisMethod': analysisMethod,
+              'chunkSize': chunkSize, 'threshold': dataQualityThreshold}
+    reduction = Record_Features.lookup(path, params)
+    if reduction is not None: return reduction
+    with Record_Features.locked(path): # Reduced once if another process is reducing the same record
+        reduction = Record_Features.lookup(path, params)
+        if reduction is not None: return reduction
+        pedestal = rootFile in pedestal_files
+        signature = Record_Cache.fileSignature(path)
+        record = loadRecords(data_path, [rootFile], dataArr_limit, keepFull=(rootFile,) if pedestal else (), threads=1)[0]
+        reduction = {'length': record['length']}
+        if lengthPassed(record['length'], sampling_rate, dataArr_limit):
+            feature = streamFeatures(record['ch1_data'], sobelSize, w, analysisMethod, chunkSize)
+            diode = RunningStats.of(record['ch0_data'], chunkSize)
+            reduction.update(stat_factor=feature['stat_factor'], diode_mean=diode.mean, diode_std=diode.std)
+            if sobelSize is not None:
+                reduction.update(sobel_factor=feature['sobel_factor'], v1_mean=feature['v1_mean'], v2_mean=feature['v2_mean'])
+            if pedestal: pedestalStats(data_path, [rootFile], records=[record])
+        del record
+        Record_Features.store(path, params, reduction, signature)
+    return reduction
+
+def streamAsymmetry(data_path, expected_file_list, fileTestPassed, prescale, dataArr_limit, filter_count,
+                    forcePairwise=False, forceQuartet=False, chunkSize=chunk_size, expData=None):
+    '''
+    Streaming mode of calculateAsymmetry for long records. The records are loaded and reduced one at a time and
+    each record is processed in chunks (streamFeatures), so the [13, dataArr_limit] data arrays are never allocated.
+    Records already reduced with the same parameters (reduceRecord) are not loaded.
+    The pairs are selected on the raw data and the pedestal correction is applied to the window means afterwards
+    '''
+    sampling_rate = ADC_rate/prescale
+    chopper_frequency, runTime, pmtName, analysisMethod = analysisSettings(data_path, forcePairwise, forceQuartet)
+    sobelSize, w = streamWindows(sampling_rate, chopper_frequency)
+
+    A_LED = np.empty(filter_count) #Ratio between high and low levels
+    A_LED_err = np.empty(filter_count)
+    V_mean = np.empty(filter_count) #Mean voltage level
+    V_mean_err = np.empty(filter_count)
+    diodeMean = np.empty(filter_count)
+    diodeMean_err = np.empty(filter_count)
+    #----------------------- Load and reduce one record at a time ------------------------#
+    length_passed = np.zeros([len(expected_file_list)])
+    features = []
+    diode_stats = []
+    pedestal = []
+    for f,rootFile in enumerate(expected_file_list):
+        reduction = reduceRecord(data_path, rootFile, dataArr_limit, sampling_rate,
+                                 sobelSize if f < max(filter_count, 9) else None, w, analysisMethod, chunkSize)
+        if not lengthPassed(reduction['length'], sampling_rate, dataArr_limit): break
+        length_passed[f] = 1
+        features.append(reduction)
+        diode_stats.append(reduction)
+        if rootFile in pedestal_files: pedestal += pedestalStats(data_path, [rootFile])
+
+    if not np.all(length_passed):
+        logging.error(f" 🚨 [Test Failed]: Data length is less than {dataArr_limit} ms")
+        print(f" 🚨 [ERROR]: {pmtName} analysis failed. One or more tests failed")
+        return -1, A_LED, A_LED_err, V_mean, V_mean_err, diodeMean, diodeMean_err
+    #----------------------Pedestal Correction------------------------#
+    pedestal_mean = [pedestal[0]['mean'], pedestal[1]['mean']] # mean of each pedestal
+    pedestal_sigma = [pedestal[0]['std'], pedestal[1]['std']]
+    pedestal_correction = np.mean(pedestal_mean) # average of both mean
+
+    photodiode_pedestal = np.mean([diode_stats[11]['diode_mean'], diode_stats[12]['diode_mean']])
+    diodeMean = np.array([diode_stats[i]['diode_mean'] for i in range(filter_count)]) - photodiode_pedestal
+    diodeMean_err = np.array([diode_stats[i]['diode_std'] for i in range(filter_count)])/np.sqrt(dataArr_limit)
+    #---------------- Data quality check ----------------#
+    dataQualityPassed = dataQualityTest(None, sobelSize, features)
+    #---------------- Asymmetry calculation --------------#
+    if fileTestPassed and dataQualityPassed:
+        for i in range(filter_count):
+            A_LED_temp, V_mean_temp = asymmetryFromMeans(features[i]['v1_mean'] - pedestal_correction,
+                                                         features[i]['v2_mean'] - pedestal_correction)
+            A_LED[i] = np.mean(A_LED_temp) # Final asymmetry for per filter positions
+            A_LED_err[i] = np.std(A_LED_temp)/np.sqrt(len(A_LED_temp)) # standard error of mean
+            V_mean[i]  = np.mean(V_mean_temp)
+            V_mean_err[i] = np.std(V_mean_temp)/np.sqrt(len(V_mean_temp)) # standard error of mean
+
+        if debug: print(" ✅ [Complete]: LED Asymmetries, Means and errors are calculated")
+        with Experiment_Data.ExperimentData(data_path) if expData is None else nullcontext(expData) as exp:
+            exp['Pedestal_Means[pre,post](V)'] = f'[{pedestal_mean[0]},{pedestal_mean[1]}]'
+            exp['Pedestal_STD[pre,post](V)'] = f'[{pedestal_sigma[0]},{pedestal_sigma[1]}]'
+        return 0, A_LED, A_LED_err, V_mean, V_mean_err, diodeMean, diodeMean_err
+    else:
+        print(f" 🚨 [ERROR]: {pmtName} analysis failed. One or more tests failed")
+        return -1, A_LED, A_LED_err, V_mean, V_mean_err, diodeMean, diodeMean_err
@@ -3,10 +3,11 @@
 # Description: Calculate the final integral and differential non-linearity of a PMT.
 
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import AutoMinorLocator
 from scipy.optimize import curve_fit
 import Calculate_Asymmetry
+import Record_Cache
+import Pedestal_Stats
+import Experiment_Data
 import sys
 import logging
 import argparse
@@ -35,12 +36,15 @@ def division_with_uncertainty(n,nr,d,dr):
 def multiplication_with_uncertainty(n,nr,d,dr):
     return n*d, abs(np.sqrt(((nr/n)**2)+(dr/d)**2)*(n*d))
 
-def ComputeLinearity(path):
+def ComputeLinearity(path, workers=1, chunkSize=None, expData=None):
     res, y, y_err, x, x_err,_,_ = Calculate_Asymmetry.calculateAsymmetry(path , 
                                                                        filter_count=9, 
                                                                     #    forceQuartet=True,
                                                                     #    forcePairwise=True,
-                                                                       plotting=True
+                                                                       plotting=True,
+                                                                       workers=workers,
+                                                                       chunkSize=chunkSize,
+                                                                       expData=expData
                                                                        )
     if res==0:
         params,cov = curve_fit(linearFunc,x,y, sigma=y_err, p0=[np.mean(y), 0], absolute_sigma=True) # set initial guesses of intercept to mean of the asymmetries and 0 for slope
@@ -70,23 +74,24 @@ def main():
                                      description='Calculate the PMT linearity for the MOLLER experiment. \nCode by: Anuradha Gunawardhana')
     
     parser.add_argument("dir", help=",<dir> .root file directory for single run ")
+    parser.add_argument("-w","--workers",type=int, default=1, help="Number of processes used for the per filter analysis")
+    parser.add_argument("-c","--chunk",type=int, default=None, help="Stream the records in chunks of this many samples (for long RunLength records). Reads the record reductions cached during the recording (main.sh -p) with the same chunk size")
+    parser.add_argument("--cache", action='store_true', help="Cache the decoded root files and the pedestal statistics next to the records for faster reanalysis")
     args = parser.parse_args()
+    Record_Cache.enabled = args.cache
+    Pedestal_Stats.persistent = args.cache
     mypath = os.path.normpath(args.dir) # remove trailing slashes
     timeStamp = mypath.split('/')[-1]                  
     # res, y, y_err, x, x_err = Calculate_Asymmetry.calculateAsymmetry(mypath , filter_count=9, plotting=True)  # y:(H-L)/(H+L) , x:(H+L)/2
     print('***** Please Do Not Interrupt The Process *****')
-    res,x, x_err, y, y_err, y_fit_linear,chisqr, ndf, lin, lin_err = ComputeLinearity(mypath)
-    with open(f"{mypath}/Experiment_data.txt", 'r') as Exp_data:
-        expLines = Exp_data.readlines()
-        for i in expLines:
-            id = i.split('=')[0]
-            value = i.split('=')[1].strip()
-            if id == "Preamp_gain(Ohm)" : preamp = value
-            elif id == "PMT_high_voltage(V)" : hv = value
-            elif id == "PMT_Serial" : serial = value
-            elif id == "Chopper_Frequency(Hz)" : frq = value
-            elif id == "Constant_LED(V)" : vol = value
-            elif id == "Cathode_Current_at_max_brightness(nA)" : I_cathode = value
+    expData = Experiment_Data.ExperimentData(mypath) # All the analysis entries are written at once
+    res,x, x_err, y, y_err, y_fit_linear,chisqr, ndf, lin, lin_err = ComputeLinearity(mypath, args.workers, args.chunk, expData)
+    preamp = expData["Preamp_gain(Ohm)"]
+    hv = expData["PMT_high_voltage(V)"]
+    serial = expData["PMT_Serial"]
+    frq = expData["Chopper_Frequency(Hz)"]
+    vol = expData["Constant_LED(V)"]
+    I_cathode = expData["Cathode_Current_at_max_brightness(nA)"]
 
     if (preamp == "1M"): gain = 1000
     else: gain = int(preamp[0:-1])
@@ -95,48 +100,17 @@ def main():
     x_err = (x_err/gain)*1000
 
     if res==0:        
-        fig,axs = plt.subplots(2,1, figsize=(10,7),layout='constrained',sharex=True)
-
-        axs[0].errorbar(x, y, yerr=y_err, fmt='r.',  markersize=5 ,elinewidth=2, capsize=4, ecolor='k', lw=0, label='LED Asymmetry')
-        axs[0].plot(x,y_fit_linear,label='Linear fit',c='tab:blue')
-        # ax.plot(x,y_fit_sec,label='Second ord. fit', c='tab:purple', linestyle='--')
-        axs[0].set_ylabel(r"$A_{LED}$",fontsize=15)
-
-        axs[0].set_title(f"",fontsize=18)
-        axs[0].grid(linestyle='--')
-        axs[0].xaxis.set_minor_locator(AutoMinorLocator())
-        axs[0].yaxis.set_minor_locator(AutoMinorLocator())
-        plt.suptitle("PMT non-linearity measurement", fontsize=16)
-        axs[0].set_title(fr" PMT:{serial}, Pre-amp:{preamp}Ω, HV:-{hv}V, Frequency:{frq}Hz, $I_{{cathode}}@maxBrightness:{I_cathode}nA$",fontsize=12)
-
-        axs[0].tick_params(axis='x', labelsize=11)
-        axs[0].tick_params(axis='y', labelsize=11)
-        
-        s=0.005
-        y_min = np.mean(y)-s
-        y_max = np.mean(y)+s
-        for k,point in enumerate(y):
-                if point >= y_max:
-                    axs[0].scatter(x[k],y_max*0.98, marker='$↑$', c='k')
-                if point <= y_min:
-                    axs[0].scatter(x[k],y_min*1.02, marker='$↓$', c='k')
-
-        # logging.info(f"{'✅ ' if abs(lin*100) < 0.51 else ''}{serial}:({timeStamp}) - Non_linearity = ({(lin)*100:.3f} ± {(abs(lin_err))*100:.3f}) % ")
-        axs[0].legend(title=f"% non-lin= {(lin)*100:.2f}±{(abs(lin_err))*100:.2f}" "\n" rf"$ \chi ^2 / ndf\ =$ {chisqr:.1f}/{ndf}",fontsize=12)
-
-        axs[0].set_ylim(y_min, y_max)
-
-
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Non-Linearity(%)',f'{(lin)*100:.2f}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Non-Linearity_Uncertainty(%)',f'{(abs(lin_err))*100:.2f}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Linear_Fit_Chi_Square',f'{chisqr:.1f}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Linear_Fit_degrees_of_freedom',f'{ndf}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Minimum_Anode_Current(uA)',f'{np.min(x):.2f}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Maximum_Anode_Current(uA)',f'{np.max(x):.2f}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'X-Anode_Current(uA)',f'{x.tolist()}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Y-Asymmetry',f'{y.tolist()}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Asymmetry_Uncertainty',f'{y_err.tolist()}')
-        Calculate_Asymmetry.addOrReplaceLine(mypath,'Anode_Current_Uncertainty(uA)',f'{x_err.tolist()}')
+        expData['Non-Linearity(%)'] = f'{(lin)*100:.2f}'
+        expData['Non-Linearity_Uncertainty(%)'] = f'{(abs(lin_err))*100:.2f}'
+        expData['Linear_Fit_Chi_Square'] = f'{chisqr:.1f}'
+        expData['Linear_Fit_degrees_of_freedom'] = f'{ndf}'
+        expData['Minimum_Anode_Current(uA)'] = f'{np.min(x):.2f}'
+        expData['Maximum_Anode_Current(uA)'] = f'{np.max(x):.2f}'
+        expData['X-Anode_Current(uA)'] = f'{x.tolist()}'
+        expData['Y-Asymmetry'] = f'{y.tolist()}'
+        expData['Asymmetry_Uncertainty'] = f'{y_err.tolist()}'
+        expData['Anode_Current_Uncertainty(uA)'] = f'{x_err.tolist()}'
+        expData.flush()
 
         # iter_list = np.arange(0,len(y))
         # comb = combinations(iter_list, 2) # calculating the combinations selecting 2 from 9 objects (n=9, r=2,nCr=36)
@@ -160,21 +134,12 @@ def main():
 
         # mean_dAdI = np.mean(dAdI)
         # mean_dAdI_err = np.sqrt(np.sum(np.array(dAdI_err)**2))/len(dAdI_err)
-
-        axs[1].errorbar(Im, dAdI, yerr=dAdI_err, fmt='r.',  markersize=5 ,elinewidth=2, capsize=4, ecolor='k', lw=0, label=r'$\Delta A /\Delta I$')
-        axs[1].set_ylabel(r'$\Delta A_{LED} / \Delta I_{Anode}} (\mu A^{-1})$',fontsize=15)
-        axs[1].set_xlabel(r"$I_{anode}\ (μA)$", fontsize=15)
-        # axs[1].set_title(r'$\frac{\Delta A_{LED}}{\Delta I_{Anode}}}$' + ' vs. ' + r'$I_{Anode}}$', fontsize=16)
-        axs[1].set_ylim(np.mean(dAdI)-s, np.mean(dAdI)+s)
-        axs[1].grid(linestyle='--')
-        axs[1].xaxis.set_minor_locator(AutoMinorLocator())
-        axs[1].yaxis.set_minor_locator(AutoMinorLocator())
-        axs[1].tick_params(axis='x', labelsize=11)
-        axs[1].tick_params(axis='y', labelsize=11)
         dAdI_title = fr"$dA/dI_{{mean}} $= ({mean_dAdI*100*1000:.2f} ± {mean_dAdI_err*100*1000:.2f})x10⁻³ %μA⁻¹"
-        axs[1].legend(title=dAdI_title,fontsize=12)
 
-        fig.savefig(f"{mypath}/Non_linearity.pdf")
+        # Non_linearity.pdf is rendered in the background (Render_Plots.py)
+        Calculate_Asymmetry.deferPlots(mypath, 'Non_linearity', x=x, y=y, y_err=y_err, y_fit_linear=y_fit_linear,
+                                       lin=lin, lin_err=lin_err, chisqr=chisqr, ndf=ndf, Im=Im, dAdI=dAdI, dAdI_err=dAdI_err,
+                                       dAdI_title=dAdI_title, serial=serial, preamp=preamp, hv=hv, frq=frq, I_cathode=I_cathode)
 
         logging.info(dAdI_title)
 
@@ -0,0 +1,59 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Data quality gate of a single record, run by main.sh right after each CMData recording. The record is
+#              reduced (Calculate_Asymmetry.reduceRecord, cached for the final analysis) and tested with the anomaly
+#              and Sobel-period tests of dataQualityTest for its filter position.
+#              Exit codes: 0 = passed, 1 = failed (the position should be recorded again),
+#                          2 = the record could not be tested (decode error, bad settings file, analysis error)
+#   e.g. python Check_Record.py $DIRNAME 4.root -f 1920 -s ./CMDataSettings.txt
+
+import os
+import sys
+import logging
+import argparse
+import Calculate_Asymmetry
+import Pedestal_Stats
+from Pipelined_Analysis import expectedFiles, reductionSettings
+
+error_code = 2 # Exit code of a record that could not be tested, not a data quality failure
+
+def checkRecord(args):
+    '''
+    Reduce the record and run its data quality tests. Returns True if it passed
+    '''
+    data_path = os.path.normpath(args.dir)
+    dataArr_limit, sampling_rate, analysisMethod, sobelSize, w = reductionSettings(args.settings, args.frequency)
+    i = expectedFiles().index(args.rootFile)
+    reduction = Calculate_Asymmetry.reduceRecord(data_path, args.rootFile, dataArr_limit, sampling_rate,
+                                                 sobelSize if i < max(args.filters, 9) else None,
+                                                 w, analysisMethod, args.chunk)
+    if not Calculate_Asymmetry.lengthPassed(reduction['length'], sampling_rate, dataArr_limit):
+        logging.error(f"🚨 [Test Failed]: {args.rootFile} data length is less than {dataArr_limit} samples")
+        return False
+    error = Calculate_Asymmetry.featureQuality(i, reduction)
+    if error:
+        print(error)
+        return False
+    print(f"✅ [Test Passed]: {args.rootFile}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(prog='MOLLER Experiment PMT Record Quality Check',
+                                     description='Data quality test of a single filter position record. \nCode by: Anuradha Gunawardhana')
+    parser.add_argument("dir", help="<dir> .root file directory of the run being recorded")
+    parser.add_argument("rootFile", help="Record to test (1.root ... 11.root, 12-0.root, 12-1.root)")
+    parser.add_argument("-f","--frequency", type=int, required=True, help="Chopper frequency (Hz)")
+    parser.add_argument("-s","--settings", default='CMDataSettings.txt', help="CMData settings file used for the recording")
+    parser.add_argument("-c","--chunk", type=int, default=Calculate_Asymmetry.chunk_size, help="Samples per chunk (same as Calculate_non-linearity.py -c)")
+    parser.add_argument("-n","--filters", type=int, default=9, help="Number of filters used for the analysis")
+    args = parser.parse_args()
+    Pedestal_Stats.persistent = True # Statistics of the pedestals being recorded, read by the final analysis
+    try:
+        passed = checkRecord(args)
+    except Exception:
+        logging.exception(f"🚨 [Check Record]: Could not test {args.rootFile}")
+        sys.exit(error_code)
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,31 @@ import sys
 
 debug = False
 
-def main():
+def findPort():
+    '''
+    Open the serial port of the chopper controller (None if it is not connected)
+    '''
+    ports = serial.tools.list_ports.comports()
+    if ports == []:
+        print("[Chopper Error]: No serial devices detected!")
+        return None
+
+    for port, desc, hwid in sorted(ports):
+        # print(port,desc,hwid)
+        if desc == "MC2000B - MC2000B" :
+            ser = serial.Serial(port, 115200, timeout=1)
+            if debug: print("[Chopper]: Wait - Opening the filter wheel serial port!")
+            if ser.is_open: 
+                if debug: print("[Chopper]: Port is already open!")
+            else:
+                ser.open()
+                if ser.is_open and debug: print("[Chopper]: Port is Open!")
+            return ser
+
+    print("[Chopper Failed]: Thorlabs Chopper wheel not detected!")
+    return None
+
+def main(ser=None): # ser: port held open by the Instrument_Server
     counter = 0
 
     parser = argparse.ArgumentParser(prog='Chopper Control v0.1',
@@ -36,90 +60,77 @@ def main():
             "setBlade" : 'blade=',           # 3 = MC1F30
             "setEnable": "enable="}          # 0 / 1
 
-    ports = serial.tools.list_ports.comports()
-    if ports == []:
-        print("[Chopper Error]: No serial devices detected!")
-        sys.exit(1)
-
-    else:
-        for port, desc, hwid in sorted(ports):
-            # print(port,desc,hwid)
-            if desc == "MC2000B - MC2000B" :
-                ser = serial.Serial(port, 115200, timeout=1)
-                if debug: print("[Chopper]: Wait - Opening the filter wheel serial port!")
-                if ser.is_open: 
-                    if debug: print("[Chopper]: Port is already open!")
-                else:
-                    ser.open()
-                    if ser.is_open and debug: print("[Chopper]: Port is Open!")
-                def getInfo(n):
-                    p = str.encode(info[n]+'\r') # encode string as byte
-                    ser.write(p)
-                    ser.reset_output_buffer()
-                    time.sleep(.1)
-
-                    line = (str(ser.read_until('\r')))[2:-5]
-                    q = line.split('\\r')
-                    # print(f'[Chopper INFO]: {n} - {q[-1]}' )
-                    return q[-1]
-
-                def setCmd(cmd,val):
-                    p = str.encode(cmds[cmd]+str(val)+'\r') # encode string as byte
-                    ser.write(p)
-                    ser.reset_output_buffer()
-                    time.sleep(.2)
-                    # print(f'[Chopper ACTION]: {cmd} - {val}' )
-                    ser.reset_output_buffer()
-
-                if args.r:
-                    out = getInfo(args.r)
-                    if out != "":
-                        ser.close()
-                        sys.exit(0)
-
-                if args.c:
-                    command, value = args.c
-                    setCmd(command, value)
-                    if command == "setFrequency":
-                        time.sleep(.5)
-                        while(getInfo('getFrequency') != value):
-                            print('[Chopper Failed]: Moving to position. Retrying..')
-                            setCmd(command, value)
-                            counter+=1
-                            if (counter == 10):
-                                print('[Chopper EXIT]: Failed to move into position.')
-                                sys.exit(1)
-                            time.sleep(1)
-
-                        if (getInfo('getBlade') != 3):
-                            time.sleep(.5)
-                            setCmd('setBlade', 3)
-                            while(not getInfo('getEnable')):
-                                print('[Chopper Failed]: Couldn\'t set the blade type!')
-                                setCmd('setBlade', 3)
-                                counter+=1
-                                if (counter == 10):
-                                    print('[Chopper EXIT]: Failed to set the blade Type.')
-                                    sys.exit(1)
-                                time.sleep(1)
-
-                        setCmd('setEnable', 1)
-                        time.sleep(.5)
-                        while(not getInfo('getEnable')):
-                            print('[Chopper Failed]: Couldn\'t start the chopper!')
-                            setCmd('setEnable', 1)
-                            counter+=1
-                            if (counter == 10):
-                                print('[Chopper EXIT]: Failed to Start the shopper.')
-                                sys.exit(1)
-                            time.sleep(1)
-
-                        print(f'[Chopper Done]: Running chopper at {value} Hz')
-                        ser.close()
-                        sys.exit(0)
-
-        print("[Chopper Failed]: Thorlabs Chopper wheel not detected!")
-        sys.exit(1)
+    owned = ser is None
+    if owned: ser = findPort()
+    if ser is None: sys.exit(1)
+
+    def getInfo(n):
+        p = str.encode(info[n]+'\r') # encode string as byte
+        ser.write(p)
+        ser.reset_output_buffer()
+        time.sleep(.1)
+
+        line = (str(ser.read_until('\r')))[2:-5]
+        q = line.split('\\r')
+        # print(f'[Chopper INFO]: {n} - {q[-1]}' )
+        return q[-1]
+
+    def setCmd(cmd,val):
+        p = str.encode(cmds[cmd]+str(val)+'\r') # encode string as byte
+        ser.write(p)
+        ser.reset_output_buffer()
+        time.sleep(.2)
+        # print(f'[Chopper ACTION]: {cmd} - {val}' )
+        ser.reset_output_buffer()
+
+    if args.r:
+        out = getInfo(args.r)
+        if out != "":
+            if owned: ser.close()
+            sys.exit(0)
+
+    if args.c:
+        command, value = args.c
+        setCmd(command, value)
+        if command == "setFrequency":
+            time.sleep(.5)
+            while(getInfo('getFrequency') != value):
+                print('[Chopper Failed]: Moving to position. Retrying..')
+                setCmd(command, value)
+                counter+=1
+                if (counter == 10):
+                    print('[Chopper EXIT]: Failed to move into position.')
+                    sys.exit(1)
+                time.sleep(1)
+
+            if (getInfo('getBlade') != 3):
+                time.sleep(.5)
+                setCmd('setBlade', 3)
+                while(not getInfo('getEnable')):
+                    print('[Chopper Failed]: Couldn\'t set the blade type!')
+                    setCmd('setBlade', 3)
+                    counter+=1
+                    if (counter == 10):
+                        print('[Chopper EXIT]: Failed to set the blade Type.')
+                        sys.exit(1)
+                    time.sleep(1)
+
+            setCmd('setEnable', 1)
+            time.sleep(.5)
+            while(not getInfo('getEnable')):
+                print('[Chopper Failed]: Couldn\'t start the chopper!')
+                setCmd('setEnable', 1)
+                counter+=1
+                if (counter == 10):
+                    print('[Chopper EXIT]: Failed to Start the shopper.')
+                    sys.exit(1)
+                time.sleep(1)
+
+            print(f'[Chopper Done]: Running chopper at {value} Hz')
+            if owned: ser.close()
+            sys.exit(0)
+
+    sys.exit(1)
 
 if __name__ == "__main__":
     main()
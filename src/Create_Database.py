@@ -3,21 +3,32 @@
 # Description: Generate the final database (a .json file) that contain analysis data of all the performed run.
 
 import numpy as np
-import matplotlib.pyplot as plt
 import argparse
 from scipy.optimize import curve_fit
 import os
 import sys
 import Calculate_Asymmetry
-import pprint
-from pathlib import Path
+import Record_Cache
+import Pedestal_Stats
+import Results_Store
+import Run_Catalog
+import Experiment_Data
+from collections import Counter
 import time
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-dirDepth = 4
 gain = 200 #kilo-ohms
+results_store = 'Database_store' # Columnar (memory-mappable) companion of Database.json
+database_cache = 'Database_cache.pkl' # Analysed runs and their fingerprints, reused by the incremental (--update) builds
+required_keys = ['Filter_Order', 'Test_Run', 'PMT_Power_On_Timestamp(DateTime)', 'PMT_Current(mA)', 'PMT_Base_Stages', # main.sh
+                 'PMT_Serial', 'Chopper_Frequency(Hz)', 'Constant_LED(V)', 'Constant_LED(mA)', 'Flashing_LED(V)',
+                 'PMT_high_voltage(V)', 'Preamp_gain(Ohm)', 'Cathode_Current_at_max_brightness(nA)', 'Record_Time(s)',
+                 'Temperature[LEDs,Dark Box](C)', 'Humidity[LEDs,Dark Box](%)',                                # Read_Temp.py
+                 'Pedestal_Means[pre,post](V)', 'Pedestal_STD[pre,post](V)']                                   # Analysis
 
-def progressbar(it, prefix="[Computing]", size=50, out=sys.stdout):
-    count = len(it)
+def progressbar(it, prefix="[Computing]", size=50, out=sys.stdout, count=None): # count: length of a generator input
+    count = len(it) if count is None else count
     start_time = time.time()  # Record the start time
     def show(j):
         elapsed_time = time.time() - start_time
@@ -45,18 +56,16 @@ def find(name, path):
         if name in files:
             return os.path.join(root, name)
         
-def allDirsPassed(path):
-    all_base_dirs = [i[0] for i in os.walk(path) if len(Path(i[0]).parents)==dirDepth-1]
+def allDirsPassed(path, catalogRuns):
+    runCount = Counter(run['pmt'] for run in catalogRuns)
+    with os.scandir(path) as entries: # Every PMT directory, also the ones without any run
+        pmt_dirs = sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.') and entry.name not in Run_Catalog.skip_dirs)
     need_to_remove=[]
     e=True
-    for directory in all_base_dirs:
-        try:
-            subdir_count = len(next(os.walk(directory))[1])
-            if subdir_count < 11:
-                need_to_remove.append(directory)
-                e=False
-        except OSError:
-            continue
+    for pmt in pmt_dirs:
+        if runCount[pmt] < 11:
+            need_to_remove.append(os.path.join(path, pmt))
+            e=False
     print("[ERROR]: Check the run count of following directories and try again!")
     for d in need_to_remove:
         print(d)
@@ -101,33 +110,146 @@ def ComputeLinearity(path):
         return x, x_err, y, y_err ,chisqr, ndf, lin, lin_err, slope, inter, diodeMean, diodeMean_err
     else: print(f"[Error] Analysis failed: {path}")
 
+def analysisParameters():
+    return {'gain': gain,
+            'ADC_rate': Calculate_Asymmetry.ADC_rate,
+            'selection_ratio': Calculate_Asymmetry.selection_ratio,
+            'quartet_frequency': Calculate_Asymmetry.quartet_frequency,
+            'pairwise_frequency': Calculate_Asymmetry.pairwise_frequency,
+            'dataQualityThreshold': Calculate_Asymmetry.dataQualityThreshold}
+
+def runFingerprint(dir, previous=None):
+    '''
+    Signatures (size, mtime, hash) of the root and settings files of a run directory and the analysis parameters.
+    The hashes are recomputed only for files whose size or mtime differ from the previous fingerprint
+    '''
+    fingerprint = {'parameters': analysisParameters()}
+    for entry in sorted(os.scandir(dir), key=lambda e: e.name):
+        if not (entry.name.endswith('.root') or entry.name in ('Experiment_data.txt', 'CMDataSettings.txt')): continue
+        st = entry.stat()
+        old = previous.get(entry.name) if previous else None
+        if old and old['size'] == st.st_size and old['mtime'] == st.st_mtime_ns: fingerprint[entry.name] = old
+        else: fingerprint[entry.name] = Record_Cache.fileSignature(entry.path)
+    return fingerprint
+
+def sameContent(a, b): # Equal files and parameters, ignoring the mtimes (e.g. copied directories)
+    if a.keys() != b.keys() or a['parameters'] != b['parameters']: return False
+    return all(a[k]['size'] == b[k]['size'] and a[k]['hash'] == b[k]['hash'] for k in a if k != 'parameters')
+
+def loadDatabaseCache():
+    try:
+        with open(database_cache, 'rb') as file:
+            return pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+
+def saveDatabaseCache(cache):
+    with open(f'{database_cache}.tmp', 'wb') as file:
+        pickle.dump(cache, file)
+    os.replace(f'{database_cache}.tmp', database_cache)
+
+def initWorker(cache):
+    Record_Cache.enabled = cache
+    Pedestal_Stats.persistent = cache
+
+def analyseRun(dir):
+    '''
+    Analysis of a single run directory (executed in a worker process).
+    Returns the PMT serial, whether the Experiment_data file is incomplete, the database entry and the fingerprint of the run
+    '''
+    res = ComputeLinearity(dir)
+    if res is None: raise RuntimeError("Asymmetry analysis failed")
+    x, x_err, y, y_err ,chiSqr, ndf, lin, lin_err, slope, inter, diodeMean, diodeMean_err = res
+
+    expData = Experiment_Data.readExperimentData(dir) # Read after the analysis to get the updated pedestal data
+    dataLoss = any(key not in expData for key in required_keys) # Extra keys are not counted
+    serial = expData["PMT_Serial"]
+    frq = int(expData["Chopper_Frequency(Hz)"])
+    hv = -int(expData["PMT_high_voltage(V)"])
+    I_cathode = int(expData["Cathode_Current_at_max_brightness(nA)"])
+    baseStages = int(expData["PMT_Base_Stages"])
+    temp = float(expData["Temperature[LEDs,Dark Box](C)"].split(',')[1]) if "Temperature[LEDs,Dark Box](C)" in expData else "NA" # Account for any potential data losses
+    pedestalMeans = expData["Pedestal_Means[pre,post](V)"]
+    PedestalSTD = float(expData["Pedestal_STD[pre,post](V)"].split(',')[0].strip('[]'))
+    VC = float(expData["Constant_LED(V)"])
+    VB = float(expData["Flashing_LED(V)"])
+    timestamp = int(expData["PMT_Power_On_Timestamp(DateTime)"])
+
+    comb=[]
+    for i in range(8):
+        comb.append((i, i+1))
+    dAdI=[]
+    dAdI_err=[]
+    Im=[]
+    for i,u in list(comb):
+        div,div_err = division_with_uncertainty((y[u]-y[i]), (y_err[u]+y_err[i]), (x[u]-x[i]), (x_err[u]+x_err[i]))
+        dAdI_err.append(div_err)
+        dAdI.append(div)
+        Im.append((x[u]+x[i])/2)
+
+    params,cov = curve_fit(constFunc,Im,dAdI, sigma=dAdI_err, p0=[0], absolute_sigma=True) # set initial guess for mean as 0
+    mean_dAdI = params[0]
+    mean_dAdI_err = np.sqrt(np.diag(cov))[0]
+
+    fit_params={"m": slope, "c": inter,"Chi_square": chiSqr, "ndf": ndf}
+    LED_voltages={"constant": VC, "flashing": VB}
+    linearity={"Non_Linearity": lin,"Lin_err": lin_err}
+    method= 'Quartet' if frq==960 else 'Pairwise'
+    dAdI_data={"dAdI":mean_dAdI, "dAdI_err":mean_dAdI_err}
+    pedestalData={"preMean": float(pedestalMeans.strip('[]').split(',')[0]), 
+                  "postMean": float(pedestalMeans.strip('[]').split(',')[1]), 
+                  "STD": PedestalSTD}
+    
+    run = {"Timestamp": timestamp,
+           "HV": hv, 
+           "Max_cathode_current": I_cathode,
+           "LED_flashing_frequency": frq, 
+           "PMT_base_stages": baseStages, 
+           "Dark_box_temperature": temp, 
+           "Non_Linearity": linearity,
+           "LED_voltages": LED_voltages,
+           "Pedestal_data":pedestalData,
+           "Linear_fit_params": fit_params,
+           "dAdI_analysis": dAdI_data,
+           "Anode_current": x.tolist(),
+           "Anode_current_err": x_err.tolist(),
+           "Asymmetry_calculation_method": method,
+           "Asymmetry": y.tolist(),
+           "Asymmetry_err": y_err.tolist(),
+           "Photodiode_mean": diodeMean.tolist(), 
+           "Photodiode_mean_err": diodeMean_err.tolist()
+           }
+    return serial, dataLoss, run, runFingerprint(dir) # Fingerprint after the analysis (it updates Experiment_data.txt)
+
 def main():
     parser = argparse.ArgumentParser(prog='MOLLER Experiment: Linearity uncertainty test',
                                      description='Compare linearity data of one PMT. \nCode by: Anuradha Gunawardhana')
     
     parser.add_argument("-d", "--dir", required=True, help="Record directory")
     parser.add_argument("-i","--ignore",type=bool, help="Ignore file count test")
+    parser.add_argument("-w","--workers",type=int, default=os.cpu_count(), help="Number of run directories analysed in parallel")
+    parser.add_argument("-u","--update", action='store_true', help="Only analyse the new or changed runs (uses the results of the previous build)")
+    parser.add_argument("--no-json", action='store_true', help="Only write the columnar store, skip the Database.json export")
+    parser.add_argument("--cache", action='store_true', help="Cache the decoded root files and the pedestal statistics next to the records for faster reanalysis")
+    parser.add_argument("-p","--plots", action='store_true', help="Render the per-PMT plots of the database (Database_plots/<serial>.png)")
 
     args = parser.parse_args()
+    Record_Cache.enabled = args.cache
+    Pedestal_Stats.persistent = args.cache
     mypath = os.path.normpath(args.dir) # remove trailing slashes
     if args.ignore == None: ig=False
     else: ig=True
     
-    if not ig and not allDirsPassed(mypath): return
+    Run_Catalog.update(mypath)
+    catalogRuns = Run_Catalog.runs(mypath, depth=2) # <dir>/<PMT>/<run>
+    if not ig and not allDirsPassed(mypath, catalogRuns): return
     
-    all_dirs = [i[0] for i in os.walk(mypath) if len(Path(i[0]).parents)==dirDepth]
-    # all_dirs = filter_directories(all_dirs)
-    pmt_list = list(set([i[0].split('/')[dirDepth-2] for i in os.walk(mypath) if len(Path(i[0]).parents)==dirDepth]))
-    dirs = []
+    pmt_list = sorted(set(run['pmt'] for run in catalogRuns))
     # Discard test runs
-    for dir in all_dirs:
-        with open(f"{dir}/Experiment_data.txt", 'r') as Exp_data:
-                expLines = Exp_data.readlines()
-                for i in expLines:
-                    id = i.split('=')[0]
-                    value = i.split('=')[1].strip() 
-                    if id == "Test_Run" : testRun = value
-        if testRun=='false': dirs.append(dir)
+    pmt_dirs = {pmt: [] for pmt in pmt_list}
+    for run in catalogRuns:
+        if run['data'].get("Test_Run") == 'false': pmt_dirs[run['pmt']].append(run['path'])
+    dirs = [dir for pmt in pmt_list for dir in pmt_dirs[pmt]]
     # 'Serial', 'CB', 'CR','D1','Nominal_Sensitivity','Dark_Current','Maximum_sensitivity'
     PMT_Spec = np.loadtxt('PMT_Specs.csv',delimiter=',',skiprows=1, usecols=(1,2,3,4,5,6))
     PMT_Spec_Serial = np.loadtxt('PMT_Specs.csv',dtype=('U8'), delimiter=',',skiprows=1, usecols=(0))
@@ -140,98 +262,60 @@ def main():
     print(f'Number of PMTs: {len(pmt_list)}')
     print(f"Total number of runs: {len(dirs)}")
     # print(dirs)
-    json_data = []
     noTemperatureData = 0
-    # Fill the database
-    for pmt in progressbar(pmt_list):
-        singlePMT_dirs = list(filter(lambda x: pmt in x, dirs))
-        runs = [] # runs start empty 
-        for dir in singlePMT_dirs:
-            with open(f"{dir}/Experiment_data.txt", 'r') as Exp_data:
-                expLines = Exp_data.readlines()
-                if len(expLines) != 28: noTemperatureData+=1
-                temp = "NA" # Account for any potential data losses
-                for i in expLines:
-                    id = i.split('=')[0]
-                    value = i.split('=')[1].strip()
-                    if id == "PMT_Serial" : serial = value
-                    elif id == "Chopper_Frequency(Hz)" : frq = int(value)
-                    elif id == "PMT_high_voltage(V)" : hv = -int(value)
-                    elif id == "Cathode_Current_at_max_brightness(nA)" : I_cathode = int(value)
-                    elif id == "PMT_Base_Stages" : baseStages = int(value)
-                    elif id == "Temperature[LEDs,Dark Box](C)" : temp = float(value.split(',')[1])
-                    elif id == "Pedestal_Means[pre,post](V)" : pedestalMeans = value
-                    elif id == "Pedestal_STD[pre,post](V)" : PedestalSTD = float(value.split(',')[0].strip('[]'))
-                    elif id == "Constant_LED(V)" : VC = float(value)
-                    elif id == "Flashing_LED(V)" : VB = float(value)
-                    elif id == "PMT_Power_On_Timestamp(DateTime)" : timestamp = int(value)
-
+    failed = {}
+    # Reuse the cached results of the unchanged runs (incremental build)
+    cache = loadDatabaseCache() if args.update else {}
+    results = {}
+    fingerprints = {}
+    for dir in dirs:
+        key = os.path.abspath(dir)
+        if key not in cache: continue
+        fingerprints[dir] = runFingerprint(dir, cache[key][0])
+        if sameContent(fingerprints[dir], cache[key][0]): results[dir] = cache[key][1]
+    pending = [dir for dir in dirs if dir not in results]
+    if args.update: print(f"Runs to analyse (new or changed): {len(pending)}")
+    # Analyse the runs in parallel and collect the results as they complete
+    if pending:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=initWorker, initargs=(args.cache,)) as executor:
+            jobs = {executor.submit(analyseRun, dir): dir for dir in pending}
+            for job in progressbar(as_completed(jobs), count=len(jobs)):
+                dir = jobs[job]
+                try:
+                    *results[dir], fingerprints[dir] = job.result()
+                except Exception as e:
+                    failed[dir] = e
+    saveDatabaseCache({os.path.abspath(dir): (fingerprints[dir], results[dir]) for dir in results})
+    # Fill the database in a fixed (sorted) order, independent of the completion order.
+    # Each PMT entry is streamed to the columnar store and the Database.json export
+    with Results_Store.ResultsWriter(results_store, json_path=None if args.no_json else 'Database.json') as writer:
+        for pmt in pmt_list:
+            runs = [] # runs start empty 
+            for dir in pmt_dirs[pmt]:
+                if dir not in results: continue
+                serial, dataLoss, run = results[dir]
+                if dataLoss: noTemperatureData+=1
                 if serial != pmt: print('\nError: Serial number does not match!', pmt, serial)
-            x, x_err, y, y_err ,chiSqr, ndf, lin, lin_err, slope, inter, diodeMean, diodeMean_err = ComputeLinearity(dir)
-
-            comb=[]
-            for i in range(8):
-                comb.append((i, i+1))
-            dAdI=[]
-            dAdI_err=[]
-            Im=[]
-            for i,u in list(comb):
-                div,div_err = division_with_uncertainty((y[u]-y[i]), (y_err[u]+y_err[i]), (x[u]-x[i]), (x_err[u]+x_err[i]))
-                dAdI_err.append(div_err)
-                dAdI.append(div)
-                Im.append((x[u]+x[i])/2)
-
-            params,cov = curve_fit(constFunc,Im,dAdI, sigma=dAdI_err, p0=[0], absolute_sigma=True) # set initial guess for mean as 0
-            mean_dAdI = params[0]
-            mean_dAdI_err = np.sqrt(np.diag(cov))[0]
-
-            fit_params={"m": slope, "c": inter,"Chi_square": chiSqr, "ndf": ndf}
-            LED_voltages={"constant": VC, "flashing": VB}
-            linearity={"Non_Linearity": lin,"Lin_err": lin_err}
-            method= 'Quartet' if frq==960 else 'Pairwise'
-            dAdI_data={"dAdI":mean_dAdI, "dAdI_err":mean_dAdI_err}
-            pedestalData={"preMean": float(pedestalMeans.strip('[]').split(',')[0]), 
-                          "postMean": float(pedestalMeans.strip('[]').split(',')[1]), 
-                          "STD": PedestalSTD}
-            
-            runs.append({"Timestamp": timestamp,
-                        "HV": hv, 
-                        "Max_cathode_current": I_cathode,
-                        "LED_flashing_frequency": frq, 
-                        "PMT_base_stages": baseStages, 
-                        "Dark_box_temperature": temp, 
-                        "Non_Linearity": linearity,
-                        "LED_voltages": LED_voltages,
-                        "Pedestal_data":pedestalData,
-                        "Linear_fit_params": fit_params,
-                        "dAdI_analysis": dAdI_data,
-                        "Anode_current": x.tolist(),
-                        "Anode_current_err": x_err.tolist(),
-                        "Asymmetry_calculation_method": method,
-                        "Asymmetry": y.tolist(),
-                        "Asymmetry_err": y_err.tolist(),
-                        "Photodiode_mean": diodeMean.tolist(), 
-                        "Photodiode_mean_err": diodeMean_err.tolist()
-                        })
-
-        sid = np.where(PMT_Spec_Serial == pmt)    
-        testTicket = {'CB': PMT_Spec[sid][0][0], 
-                          'CR': PMT_Spec[sid][0][1], 
-                          'D1_gain': PMT_Spec[sid][0][2], 
-                          'Nominal_sensitivity':  int(PMT_Spec[sid][0][3]), 
-                          'Dark_Current': PMT_Spec[sid][0][4], 
-                          'Max_sensitivity': int(PMT_Spec[sid][0][5])}
-
-        json_data.append({"PMT": pmt, "TestTicket": testTicket, "runs": runs})
-
-    formatted_data = pprint.pformat(json_data, indent=1, width=100, compact=True) # make 
-    formatted_data = str(formatted_data).replace("'", '"')
-
-    with open('Database.json', 'w') as f:
-        f.write(formatted_data)
-    
+                runs.append(run)
+
+            sid = np.where(PMT_Spec_Serial == pmt)    
+            testTicket = {'CB': PMT_Spec[sid][0][0], 
+                              'CR': PMT_Spec[sid][0][1], 
+                              'D1_gain': PMT_Spec[sid][0][2], 
+                              'Nominal_sensitivity':  int(PMT_Spec[sid][0][3]), 
+                              'Dark_Current': PMT_Spec[sid][0][4], 
+                              'Max_sensitivity': int(PMT_Spec[sid][0][5])}
+
+            writer.write({"PMT": pmt, "TestTicket": testTicket, "runs": runs})
+
     print(f"[Info]: Database created successfully!")
+    if args.plots:
+        import Render_Plots # matplotlib is only needed here
+        print(f"[Info]: PMT plots saved to {Render_Plots.renderDatabase(results_store)}")
     if noTemperatureData:print(f"[Info]: Potential data losses detected in {noTemperatureData} directories")
+    if failed:
+        print(f"[Error]: Analysis failed in {len(failed)} directories (not included in the database)")
+        for dir in sorted(failed): print(f"{dir}: {failed[dir]}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,87 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Reader and batched writer of the Experiment_data text file (key=value lines) of a run.
+#              The updates are written with a single flush: under an exclusive lock on 'Experiment_data.txt.lock'
+#              the file is read again (keeping the lines other writers appended meanwhile), updated and replaced
+#              through a temporary file rename. The shell scripts append to the file holding the same lock (flock).
+
+import os
+import fcntl
+
+class ExperimentData:
+    '''
+    Entries of the Experiment_data file of a run, parsed once. Assigned entries are kept until flush()
+    (or the end of a with block) and then written in one go. Existing entries are replaced in place,
+    new entries are appended.
+        with ExperimentData(data_path) as expData:
+            expData['Linear_Fit_Chi_Square'] = f'{chisqr:.1f}'
+    '''
+    def __init__(self, data_path):
+        self.path = f"{data_path}/Experiment_data.txt"
+        self.updates = {}
+        self.entries = {}
+        try:
+            with open(self.path, 'r') as Exp_data:
+                self.entries = parseLines(Exp_data)
+        except FileNotFoundError:
+            pass
+
+    def __getitem__(self, key):
+        return self.updates[key] if key in self.updates else self.entries[key]
+
+    def __setitem__(self, key, value):
+        self.updates[key] = str(value)
+
+    def __contains__(self, key):
+        return key in self.updates or key in self.entries
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __len__(self):
+        return len(self.entries.keys() | self.updates.keys())
+
+    def flush(self):
+        if not self.updates: return
+        with open(f'{self.path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'r') as Exp_data:
+                    lines = Exp_data.readlines()
+            except FileNotFoundError:
+                lines = []
+            lineNum = {line.split('=')[0]: i for i, line in enumerate(lines)} # Last line of each identifier
+            if lines and not lines[-1].endswith('\n'): lines[-1] += '\n'
+            for key, value in self.updates.items():
+                if key in lineNum: lines[lineNum[key]] = f'{key}={value}\n' # Replace the line with new data
+                else: lines.append(f'{key}={value}\n') # Add the new data line if not exist
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as Exp_data:
+                Exp_data.writelines(lines)
+                Exp_data.flush()
+                os.fsync(Exp_data.fileno())
+            os.replace(tmp, self.path)
+        self.entries.update(self.updates)
+        self.updates = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None: self.flush()
+        return False
+
+def readExperimentData(data_path):
+    '''
+    Entries of the Experiment_data file of a run as a dictionary of strings (key=value lines)
+    '''
+    with open(f"{data_path}/Experiment_data.txt", 'r') as Exp_data:
+        return parseLines(Exp_data)
+
+def parseLines(lines):
+    entries = {}
+    for line in lines:
+        if '=' not in line: continue
+        id, value = line.split('=', 1)
+        entries[id] = value.strip()
+    return entries
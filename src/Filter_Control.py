@@ -7,10 +7,74 @@ import time
 import serial.tools.list_ports
 import argparse
 import sys
+import os
 
 debug = False
-
-def main():
+positions = 12              # Filter slots on the wheel
+move_overhead = 0.3         # (s) Start and settle time of a move
+slot_time = 0.35            # (s) Travel time per slot (high speed), calibrate with the latency log
+poll_interval = 0.05        # (s) Time between the 'pos?' queries while the wheel moves
+deadline_factor = 2         # A move is re-sent after deadline_factor x its expected travel time (a slow move is not a failed one)
+deadline_margin = 1         # (s) Added to the deadline, covers the serial round trips and the 0 s expected time of a null move
+move_log = os.path.expanduser('~/.cache/moller_pmt_filter_moves.csv') # Measured move latencies
+move_log_limit = 2**20      # (bytes) The latency log is moved to move_log.1 (previous one dropped) above this size
+
+def query(ser, text):
+    '''
+    Send a command and read the reply up to the '>' prompt (no fixed waits).
+    Returns the reply lines without the command echo
+    '''
+    ser.write(str.encode(text+'\r')) # encode string as byte
+    ser.flush()
+    reply = ser.read_until(b'>').decode(errors='replace')
+    lines = [l.strip() for l in reply.rstrip('>').split('\r') if l.strip()]
+    if lines and lines[0] == text: lines = lines[1:]
+    return lines
+
+def travelTime(start, target):
+    '''
+    Distance (slots, the wheel takes the shorter way) and expected travel time of a move
+    '''
+    if not (start.isdigit() and target.isdigit()): return positions//2, move_overhead + positions//2*slot_time
+    d = abs(int(target) - int(start)) % positions
+    d = min(d, positions - d)
+    return d, (move_overhead + d*slot_time if d else 0)
+
+def logMove(start, target, distance, expected, latency, polls, retries):
+    try:
+        os.makedirs(os.path.dirname(move_log), exist_ok=True)
+        if os.path.exists(move_log) and os.path.getsize(move_log) > move_log_limit: os.replace(move_log, f'{move_log}.1')
+        new = not os.path.exists(move_log)
+        with open(move_log, 'a') as file:
+            if new: file.write('time,from,to,distance,expected(s),measured(s),polls,retries\n')
+            file.write(f'{time.strftime("%Y-%m-%d %H:%M:%S")},{start},{target},{distance},{expected:.2f},{latency:.3f},{polls},{retries}\n')
+    except OSError as e:
+        print(f'[Filter Warning]: Could not log the move latency ({e})')
+
+def findPort():
+    '''
+    Open the serial port of the filter wheel (None if it is not connected)
+    '''
+    ports = serial.tools.list_ports.comports()
+    if ports == []:
+        print("[Filter Error]: No serial devices detected!")
+        return None
+
+    for port, desc, hwid in sorted(ports):
+        if desc == "FW102C - FW102C" :
+            ser = serial.Serial(port, 115200, timeout=1)
+            if debug: print("[Filter]: Wait - Opening the filter wheel serial port!")
+            if ser.is_open: 
+                if debug: print("[Filter]: Port is already open!")
+            else:
+                ser.open()
+                if ser.is_open and debug: print("[Filter]: Port is Open!")
+            return ser
+
+    print("[Filter Failed]: Thorlabs FW2112CNEB filter wheel not detected!")
+    return None
+
+def main(ser=None): # ser: port held open by the Instrument_Server
     counter = 0
 
     parser = argparse.ArgumentParser(prog='Filter Control v0.1',
@@ -43,66 +107,58 @@ def main():
             "setBaud" : 'baud=',             # 0=9600, 1=115200
             "save" : 'save'}
 
-    ports = serial.tools.list_ports.comports()
-    if ports == []:
-        print("[Filter Error]: No serial devices detected!")
-        sys.exit(1)
-
-    else:
-        for port, desc, hwid in sorted(ports):
-            if desc == "FW102C - FW102C" :
-                ser = serial.Serial(port, 115200, timeout=1)
-                if debug: print("[Filter]: Wait - Opening the filter wheel serial port!")
-                if ser.is_open: 
-                    if debug: print("[Filter]: Port is already open!")
-                else:
-                    ser.open()
-                    if ser.is_open and debug: print("[Filter]: Port is Open!")
-                def getInfo(n):
-                    p = str.encode(info[n]+'\r') # encode string as byte
-                    ser.write(p)
-                    ser.reset_output_buffer()
-                    time.sleep(.1)
-
-                    line = (str(ser.read_until('\r')))[2:-5]
-                    q = line.split('\\r')
-                    print(f'[Filter INFO]: {n} - {q[-1]}' )
-                    return q[-1]
-
-                def setCmd(cmd,val):
-                    p = str.encode(cmds[cmd]+str(val)+'\r') # encode string as byte
-                    ser.write(p)
-                    ser.reset_output_buffer()
-                    time.sleep(.2)
-                    print(f'[Filter ACTION]: {cmd} - {val}' )
-                    ser.reset_output_buffer()
-
-                if args.r:
-                    out = getInfo(args.r)
-                    if out != "":
-                        ser.close()
-                        sys.exit(0)
-
-                if args.c:
-                    command, value = args.c
+    owned = ser is None
+    if owned: ser = findPort()
+    if ser is None: sys.exit(1)
+
+    def getInfo(n, verbose=True):
+        q = query(ser, info[n])
+        value = q[-1] if q else ''
+        if verbose: print(f'[Filter INFO]: {n} - {value}' )
+        return value
+
+    def setCmd(cmd,val):
+        query(ser, cmds[cmd]+str(val)) # Reads the echo, so no reply is left for the next query
+        print(f'[Filter ACTION]: {cmd} - {val}' )
+
+    if args.r:
+        out = getInfo(args.r)
+        if out != "":
+            if owned: ser.close()
+            sys.exit(0)
+
+    if args.c:
+        command, value = args.c
+        if command == "setPosition":
+            # Poll 'pos?' until the wheel arrives, re-sending the command if it misses the travel time deadline
+            start = getInfo('currentPosition', verbose=False)
+            distance, expected = travelTime(start, value)
+            t0 = time.time()
+            setCmd(command, value)
+            deadline = t0 + deadline_factor*expected + deadline_margin
+            polls = 0
+            while True:
+                position = getInfo('currentPosition', verbose=False)
+                polls += 1
+                if position == value: break
+                if time.time() > deadline:
+                    print('[Filter Failed]: Moving to position. Retrying..')
                     setCmd(command, value)
-                    if command == "setPosition":
-                        time.sleep(3)
-                        while(getInfo('currentPosition') != value):
-                            print('[Filter Failed]: Moving to position. Retrying..')
-                            setCmd(command, value)
-                            counter+=1
-                            if (counter == 10):
-                                print('[Filter EXIT]: Failed to move into position.')
-                                sys.exit(1)
-                            time.sleep(1)
-
-                        print('[Filter Done]: Moving to position')
-                        ser.close()
-                        sys.exit(0)
-
-        print("[Filter Failed]: Thorlabs FW2112CNEB filter wheel not detected!")
-        sys.exit(1)
+                    counter+=1
+                    if (counter == 10):
+                        print('[Filter EXIT]: Failed to move into position.')
+                        sys.exit(1)
+                    deadline = time.time() + deadline_factor*expected + deadline_margin
+                time.sleep(poll_interval)
+            latency = time.time() - t0
+            logMove(start, value, distance, expected, latency, polls, counter)
+            print(f'[Filter INFO]: currentPosition - {position}' )
+            print(f'[Filter Done]: Moving to position ({distance} slots in {latency:.2f} s, expected {expected:.2f} s)')
+            if owned: ser.close()
+            sys.exit(0)
+        setCmd(command, value)
+
+    sys.exit(1)
 
 if __name__ == "__main__":
     main()
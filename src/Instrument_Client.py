@@ -0,0 +1,18 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Thin client of the Instrument_Server. Runs a control script command on the serial ports held open by
+#              the server and exits with the exit code of the script. If the server is not running, the script is run directly.
+#   e.g. python Instrument_Client.py Filter_Control.py -c setPosition 4
+
+import sys
+from Analysis_Client import runScript
+from Instrument_Server import socket_path
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python Instrument_Client.py <script> [arguments]")
+        sys.exit(1)
+    runScript(socket_path, sys.argv[1], sys.argv[2:])
+
+if __name__ == "__main__":
+    main()
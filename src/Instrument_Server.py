@@ -0,0 +1,147 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Long-lived local instrument service. The serial ports of the filter wheel, chopper and power supply
+#              are found and opened once and kept open; every command received over the Unix socket from
+#              Instrument_Client.py runs the main() of the control script on the open port. Output and exit codes
+#              are the same as running the control script directly. Commands run one at a time.
+#   start:  python Instrument_Server.py start     stop:  python Instrument_Server.py stop
+
+import os
+import sys
+import json
+import socket
+import argparse
+import importlib
+import traceback
+import serial
+from contextlib import redirect_stdout, redirect_stderr
+from Analysis_Server import listenPrivate, readRequest, exit_marker
+
+socket_path = '/tmp/moller_instruments.sock'
+log_file = 'instrument_server.log'
+# Scripts served (script name: module name)
+scripts = {'Filter_Control.py': 'Filter_Control',
+           'Chopper_Control.py': 'Chopper_Control',
+           'Power_Supply_Control.py': 'Power_Supply_Control'}
+
+def runCommand(conn, request, modules, ports):
+    '''
+    Run the control script main() on the held port with the output sent to the client.
+    A port that fails is closed and found again on the next command. So is the port of a command whose
+    client disconnected (e.g. Ctrl-C in main.sh during a move): the exchange with the instrument is unfinished
+    '''
+    out = conn.makefile('w', encoding='utf-8')
+    out.reconfigure(line_buffering=True)
+    code = 1
+    script = os.path.basename(request.get('script', ''))
+    with redirect_stdout(out), redirect_stderr(out):
+        try:
+            if script not in modules: raise ValueError(f"[Instrument Server]: {script} is not served")
+            sys.argv = [script, *request['args']]
+            ser = ports.get(script)
+            if ser is None or not ser.is_open:
+                ser = ports[script] = modules[script].findPort()
+                if ser is None: sys.exit(1)
+            ser.reset_input_buffer() # Drop replies left over from an interrupted command
+            modules[script].main(ser)
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except ConnectionError: # Client gone, writing to its stream failed
+            print(f"[Instrument Server]: Client disconnected during {script} {' '.join(request['args'])}", file=sys.__stderr__, flush=True)
+            closePort(ports, script)
+            discard(out)
+            return
+        except serial.SerialException as e:
+            logError(out, e)
+            closePort(ports, script)
+        except Exception as e:
+            logError(out, e)
+    try:
+        out.flush()
+        conn.sendall(exit_marker + f'{code}\n'.encode())
+    except OSError: # Client gone
+        discard(out)
+
+def logError(out, error):
+    '''
+    Traceback to the server log (not the client stream, which may be the cause), the error to the client if it is still there
+    '''
+    traceback.print_exc(file=sys.__stderr__)
+    sys.__stderr__.flush()
+    try: print(f"🚨 [Instrument Server]: {error!r}", file=out)
+    except OSError: pass
+
+def discard(out):
+    '''
+    Close the stream of a disconnected client, dropping the unsent output
+    '''
+    try: out.close()
+    except OSError: pass
+
+def closePort(ports, script):
+    ser = ports.pop(script, None)
+    if ser is None: return
+    try: ser.close()
+    except serial.SerialException: pass
+
+def serve():
+    modules = {script: importlib.import_module(module) for script, module in scripts.items()}
+    ports = {}
+    server = listenPrivate(socket_path)
+    print(f"[Instrument Server]: Ready ({socket_path})", flush=True)
+    while True:
+        conn, _ = server.accept()
+        try:
+            request = readRequest(conn)
+        except (OSError, ValueError):
+            conn.close()
+            continue
+        if request.get('stop'):
+            conn.close()
+            break
+        try:
+            runCommand(conn, request, modules, ports)
+        except OSError: # A client socket error never stops the server
+            traceback.print_exc(file=sys.__stderr__)
+        conn.close()
+    for script in list(ports): closePort(ports, script)
+    server.close()
+    os.remove(socket_path)
+
+def isRunning():
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(prog='MOLLER Experiment: Instrument server',
+                                     description='Keep the serial ports of the filter wheel, chopper and power supply open and run their control commands. \nCode by: Anuradha Gunawardhana')
+    parser.add_argument("command", choices=['start', 'stop', 'run'], help="start: run in the background, stop: stop the running server, run: run in the foreground")
+    args = parser.parse_args()
+
+    if args.command == 'stop':
+        if isRunning():
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(socket_path)
+                s.sendall(json.dumps({'stop': True}).encode() + b'\n')
+            print("[Instrument Server]: Stopped")
+        return
+    if isRunning():
+        print("[Instrument Server]: Already running")
+        return
+    if args.command == 'start':
+        if os.fork() != 0: return # Detach from the calling shell
+        os.setsid()
+        log = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+    serve()
+
+if __name__ == "__main__":
+    main()
@@ -167,7 +167,7 @@ echo "------------------------------------------------"
 echo "|         Initiating the data collection       | "
 echo "------------------------------------------------"
 # Set LED voltages
-STD_OUT="$(python Power_Supply_Control.py -v $VC $VB)"
+STD_OUT="$(python Instrument_Client.py Power_Supply_Control.py -v $VC $VB)"
 if [ $? -eq "1" ] ; then
   echo "[Recording Failed] Power supply failed!"
   exit 1
@@ -186,7 +186,7 @@ else
 fi
 
 # Set Chopper frequency
-python Chopper_Control.py -c setFrequency $FRQ
+python Instrument_Client.py Chopper_Control.py -c setFrequency $FRQ
 if [ $? -eq "1" ] ; then
   echo "[Recording Failed] Could not initiate the Chopper!"
   exit 1
@@ -199,7 +199,7 @@ echo "------------------------------------------------"
 echo "|  New record | Run 0 -- Filter position 12   |"
 echo "------------------------------------------------"
 echo "[Wait]: Setting filter position: 12"
-python Filter_Control.py -c setPosition 12
+python Instrument_Client.py Filter_Control.py -c setPosition 12
 if [ $? -eq "1" ] ; then
   echo "[Recording Failed] Moving filter into position!"
   exit 1
@@ -232,7 +232,7 @@ for (( u=1; u<=RUNS; u++ ))
         echo "|  New record | Run $u -- Filter position $i   |"
         echo "------------------------------------------------"
         echo "[Wait]: Setting filter position: $i"
-        python Filter_Control.py -c setPosition $i
+        python Instrument_Client.py Filter_Control.py -c setPosition $i
         if [ $? -eq "1" ] ; then
           echo "[Recording Failed] Moving filter into position!"
           exit 1
@@ -265,6 +265,9 @@ echo "================================================"
 echo ""
 echo ""
 
+# Append under the Experiment_data lock (shared with the python writers)
+{
+flock 9
 echo "Filter_Order=4,11,8,2,9,7,3,5,1,6,10,12
 Test_Run=$TEST
 Multiple_Runs=True
@@ -280,5 +283,6 @@ PMT_high_voltage(V)=$HV
 Preamp_gain(Ohm)=$GAIN
 Cathode_Current_at_max_brightness(nA)=$I_Cathode
 Record_Time(s)=$SECONDS" >> $DIRNAME/Experiment_data.txt
+} 9>>$DIRNAME/Experiment_data.txt.lock
 
 exit 0
\ No newline at end of file
@@ -5,11 +5,17 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.signal import find_peaks
+import Calculate_Asymmetry
+import Render_Plots
+import Experiment_Data
 from matplotlib.ticker import AutoMinorLocator,AutoLocator
-import uproot
 import os
 import logging
 import argparse
+from functools import partial
+from contextlib import nullcontext
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 #import scienceplotse
 import matplotlib
 from scipy.optimize import curve_fit
@@ -43,11 +49,6 @@ gain = 200
 
 filter_transmission = [100, 79, 63, 50, 40, 32, 25, 10, 5, 1, 0.1, 0.01]
 
-def createSobel(n): # n=8 -> [1, 1, 1, 1,-1,-1,-1,-1]
-    arr_1 = np.ones((int(n/2),),dtype=int)
-    f = np.append(arr_1, arr_1*-1)
-    return f
-
 def constFunc(x,c):
     return c
 
@@ -61,23 +62,6 @@ def multiplication_with_uncertainty(n,nr,d,dr):
     return n*d, abs(np.sqrt(((nr/n)**2)+(dr/d)**2)*(n*d))
 
 
-def addOrReplaceLine(data_path, lineIdentifier, value):
-    lineFound=False
-    with open(f"{data_path}/Experiment_data.txt", 'r+') as Exp_data:
-        expLines = Exp_data.readlines()
-        for i, line in enumerate(expLines):
-            id = line.split('=')[0]
-            # value = i.split('=')[1].strip() 
-            if id == lineIdentifier:
-                lineFound=True
-                lineNum=i
-        if lineFound:
-            with open(f"{data_path}/Experiment_data.txt", 'w') as Exp_data:
-                for i, line in enumerate(expLines):
-                    if lineNum!=i: Exp_data.write(line)
-                    else: Exp_data.write(f'{lineIdentifier}={value}\n') # Replace the line with new data
-        else: Exp_data.write(f'{lineIdentifier}={value}\n') # Add the new data line if not exist
-
 def linearFit(x,y,x_err,y_err):
 
     params,cov = curve_fit(linearFunc,x,y, sigma=y_err, p0=[np.mean(y), 0], absolute_sigma=True) # set initial guesses of intercept to mean of the asymmetries and 0 for slope
@@ -102,11 +86,75 @@ def linearFit(x,y,x_err,y_err):
 
     return lin, lin_err, y_fit_linear, chisqr, ndf
 
+def runPedestal(data_path, n):
+    '''
+    Statistics of the pedestal record Run-n-F12, post-pedestal of the run n and pre-pedestal of the run n+1
+    '''
+    return Calculate_Asymmetry.pedestalStats(data_path, [f'Run-{n}-F12.root'])[0]
+
+def analyseRun(data_path, r, pedestals, dataArr_limit, sampling_rate, sobelSize, w, analysisMethod, pt):
+    '''
+    Load, pedestal correct and reduce the run r (0 based): Run-(r+1)-F1..F9 with the pedestals Run-r-F12 (pre) and
+    Run-(r+1)-F12 (post), taken from pedestals (runPedestal of every pedestal record). Only the per filter results,
+    the asymmetry distributions and the first pt samples of the records (raw data plot) are returned, so the memory
+    use does not depend on the run count
+    '''
+    files = [f'Run-{r+1}-F{i}.root' for i in range(1, filter_count+1)]
+    records = Calculate_Asymmetry.loadRecords(data_path, files, dataArr_limit, branches=('ch1_data',))
+    result = {'run': r, 'length_passed': True}
+    data = np.empty([filter_count, dataArr_limit])
+    for f, (rootFile, record) in enumerate(zip(files, records)):
+        if (record['length']/(sampling_rate/1000) > 100 and record['length'] > dataArr_limit): # Record time(ms) taken from the sample count
+            data[f] = record['ch1_data']    # Trimmed edges
+        else: 
+            if debug: print(f"[ERROR]: {rootFile} - [Initial,Trimmed] shapes = [{record['length']},{dataArr_limit}]")
+            result['length_passed'] = False
+    del records
+    if not result['length_passed']: return result
+    #----------------------Pedestal Correction------------------------#
+    pedestal = pedestals[r:r+2]
+    pedestal_sigma = [stats['std'] for stats in pedestal]
+    pedestal_mean = [stats['mean'] for stats in pedestal] # mean of each pedestal
+    data -= np.mean(pedestal_mean)
+    if debug: print(f'Pedestal [mean(correction), drift/pre_sigma] = [{np.mean(pedestal_mean):.4f}, {abs((pedestal_mean[0]-pedestal_mean[1])/pedestal_sigma[0]):.8f}]')
+    #---------------------- Asymmetry calculation ----------------------#
+    A_LED = np.empty(filter_count)
+    A_LED_err = np.empty(filter_count)
+    I_anode = np.empty(filter_count)
+    I_anode_err = np.empty(filter_count)
+    A_LED_temps = []
+    for i,f in enumerate(data):
+        sobel_filtered_data = Calculate_Asymmetry.sobelResponse(f, sobelSize)
+        peaks, _  = find_peaks(sobel_filtered_data, distance = int(sobelSize*0.9))
+
+        A_LED_temp, V_mean_temp, _, _, _ = Calculate_Asymmetry.pairAsymmetry(f, peaks, w, analysisMethod)
+        A_LED_temps.append(A_LED_temp)
+        
+        A_LED[i] = np.mean(A_LED_temp) # Final asymmetry for per filter positions
+        A_LED_err[i] = np.std(A_LED_temp)/np.sqrt(len(A_LED_temp)) # standard error of mean
+        
+        I_anode[i]  = (np.mean(V_mean_temp)/gain)*1000
+        I_anode_err[i] = ((np.std(V_mean_temp)/np.sqrt(len(V_mean_temp)))/gain)*1000 # standard error of mean
+    result.update(A_LED=A_LED, A_LED_err=A_LED_err, I_anode=I_anode, I_anode_err=I_anode_err, A_LED_temps=A_LED_temps,
+                  raw=data[:, 0:pt].copy(), pedestal_mean=pedestal_mean, pedestal_sigma=pedestal_sigma)
+    return result
+
+def boundedMap(executor, fn, items, window):
+    '''
+    executor.map in order, with at most 'window' results pending (bounded memory for any number of items)
+    '''
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window: yield pending.popleft().result()
+    while pending: yield pending.popleft().result()
+
 def main():
     parser = argparse.ArgumentParser(prog='MOLLER Experiment PMT Linearity Calculation',
                                      description='Calculate the PMT linearity for the MOLLER experiment. \nCode by: Anuradha Gunawardhana')
     
     parser.add_argument("-d","--dir",required=True, help="Root file directory for single run ")
+    parser.add_argument("-w","--workers",type=int, default=1, help="Number of runs analysed in parallel")
     # parser.add_argument("-r","--runs",required=True, help="Number of complete non-linearity runs")
     args = parser.parse_args()
     data_path = os.path.normpath(args.dir) # remove trailing slashes
@@ -154,37 +202,9 @@ def main():
         record_length = float(lines[5].split(" ")[1])
     dataArr_limit = int((ADC_rate/prescale)*record_length*0.9)  # Trim the data equally at 90%
     if debug: print(f'prescale={prescale}, record_length={record_length:.2f}, data_limit:{dataArr_limit}')
+    sampling_rate = ADC_rate/prescale                                   # Usual rate ~ 1,470,588.3
 
-    if debug: print(f"[Test begin]: Preprocessing \"{data_path}\"")
-    length_passed = np.empty([runCount,9])
-    data = np.empty([runCount,9,dataArr_limit])
-    if debug: print(f"Data size= {data.shape}")
-    #----------------------- Plot config ------------------------#
-    for rootFile in expected_file_list:
-        RunNumber = int(rootFile.split('-')[1])-1
-        f = int(rootFile.split('-')[2].split('.')[0][1:])-1
-        r = int(rootFile.split('-')[1])-1
-        file = uproot.open(f'{data_path}/{rootFile}')
-        tree = file['DataTree']
-        branches = tree.arrays()  
-        t = branches['tStmp'].to_numpy()
-        t = t.reshape((t.shape[1]))
-        ch0 = branches['ch1_data'].to_numpy()   # Photomultiplier(PMT) data
-        ch0 = ch0.reshape((ch0.shape[1]))
-
-        if (t[-1] > 100 and len(ch0) > dataArr_limit): 
-            data[RunNumber,f] = ch0[0:dataArr_limit]    # Trim the edges
-            length_passed[r,f] = 1
-        else: 
-            if debug: print(f"[ERROR]: {rootFile} - [Initial,Trimmed] shapes = [{ch0.shape},{data[f].shape}]")
-            length_passed[r,f] = 0
-    
-    if not np.all(length_passed): 
-        logging.error(f" 🚨 [Test Failed]: Data length is less than {dataArr_limit} ms")
-    else: 
-        if debug: print(f" ✅ [Test Passed]: Found adequate data for the analysis")
-        dataTestPassed = True
-
+    if fileTestPassed:
         TEMP_PMT = np.empty([runCount])
         TEMP_LED = np.empty([runCount])
         with open(f"{data_path}/Temp_data.txt", 'r') as Temp_data:
@@ -193,13 +213,9 @@ def main():
                 TEMP_PMT[idx] = float(line.split(',')[-1])
                 TEMP_LED[idx] = float(line.split(',')[1].split('=')[-1])
 
-        with open(f"{data_path}/Experiment_data.txt", 'r') as Exp_data:
-            expLines = Exp_data.readlines()
-            for i in expLines:
-                id = i.split('=')[0]
-                value = i.split('=')[1].strip() 
-                if id == "Chopper_Frequency(Hz)" : chopper_frequency = int(value)
-                if id == "Record_Time(s)" : runTime = value
+        expData = Experiment_Data.readExperimentData(data_path)
+        chopper_frequency = int(expData["Chopper_Frequency(Hz)"])
+        runTime = expData["Record_Time(s)"]
         
         if chopper_frequency != pairwise_frequency and chopper_frequency != quartet_frequency: 
             logging.error("🚨 [Analysis Failed]:Chopper frequencies don't match")
@@ -216,28 +232,7 @@ def main():
         elif forceQuartet: 
             logging.info(f'Forcing quartet analysis on {chopper_frequency} Hz data')
             analysisMethod = 'quartet'
-        #----------------------Pedestal Correction------------------------#
-        pedestal = [0,0]
-        pedestal_sigma = [0,0]
-        pedestal_mean = [0,0]
-
-        for n in range(runCount):
-            for p in range(2):
-                # file = uproot.open(f'{data_path}/12-{p}.root')
-                if p==0: file = uproot.open(f'{data_path}/Run-{n}-F12.root')
-                else: file = uproot.open(f'{data_path}/Run-{n+1}-F12.root')
-
-                ch0 = file['DataTree'].arrays()['ch1_data'].to_numpy()
-                pedestal[p] = ch0.reshape((ch0.shape[1]))
-                pedestal_sigma[p] = np.std(pedestal[p])
-                pedestal_mean[p] = np.mean(pedestal[p]) # mean of each pedestal
-
-            data[n] -= np.mean(pedestal_mean)
-
-            if debug: print(f'Pedestal [mean(correction), drift/pre_sigma] = [{np.mean(pedestal_mean):.4f}, {abs((np.mean(pedestal[0])-np.mean(pedestal[1]))/pedestal_sigma[0]):.8f}]')
-
         #-----------------------Sobel window size--------------------------#
-        sampling_rate = ADC_rate/prescale                                   # Usual rate ~ 1,470,588.3
         samples_per_cycle = sampling_rate/chopper_frequency
         sobelSize = int(samples_per_cycle*0.5)             # Sobel size should cover around quarter(0.25) of H-L cycle to get a triangular shape
         w = int(samples_per_cycle*selection_ratio/(4*100))  # Data selection width. Total selection =2*w
@@ -249,80 +244,48 @@ def main():
         I_anode = np.empty([runCount, filter_count]) #Mean voltage level
         I_anode_err = np.empty([runCount, filter_count])
 
+        #------------- Runs are loaded, pedestal corrected and reduced one at a time ---------------#
+        if debug: print(f"[Test begin]: Preprocessing \"{data_path}\"")
+        pt = int(dataArr_limit*0.1) # custom points
+        analyse = partial(analyseRun, data_path, dataArr_limit=dataArr_limit, sampling_rate=sampling_rate,
+                          sobelSize=sobelSize, w=w, analysisMethod=analysisMethod, pt=pt)
+        failedRuns = []
+        pedestal_mean = pedestal_sigma = None # Pedestals of the last run (written to Experiment_data)
+        runFigures = Render_Plots.RunFigures(filter_count) # Figures built once, only the data is replaced per run
+        with ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else nullcontext() as executor:
+            # Each pedestal is shared by two runs: reduced once here, before the runs are fanned out to the workers
+            pedestalOf = partial(runPedestal, data_path)
+            pedestals = list((map if executor is None else executor.map)(pedestalOf, range(runCount+1)))
+            analyse = partial(analyse, pedestals=pedestals)
+            for result in (map(analyse, range(runCount)) if executor is None else boundedMap(executor, analyse, range(runCount), 2*args.workers)):
+                r = result['run']
+                if not result['length_passed']:
+                    failedRuns.append(r+1)
+                    continue
+                A_LED[r], A_LED_err[r], I_anode[r], I_anode_err[r] = result['A_LED'], result['A_LED_err'], result['I_anode'], result['I_anode_err']
+                # Taken from run runCount-1 whatever order the results arrive in (a run that fails the length test
+                # leaves them unset, but then dataTestPassed is False and they are not written)
+                if r == runCount-1: pedestal_mean, pedestal_sigma = result['pedestal_mean'], result['pedestal_sigma']
+                runFigures.update(f"Asymmetry distribution [Run: {r+1:02}]", result['A_LED_temps'], A_LED[r], A_LED_err[r], result['raw'])
+                runFigures.save(f"{data_path}/Asymmetry_distribution_{r+1:02}.png", f"{data_path}/Raw_data_{r+1:02}.png")
+        runFigures.close()
+
+        if failedRuns: 
+            logging.error(f" 🚨 [Test Failed]: Data length is less than {dataArr_limit} ms (runs {failedRuns})")
+        else: 
+            if debug: print(f" ✅ [Test Passed]: Found adequate data for the analysis")
+            dataTestPassed = True
+
     if fileTestPassed and dataTestPassed:
-        for r in range(runCount):
-            figAsyHist, asyPlot = plt.subplots(3, 3, figsize=(13, 12),constrained_layout = True)
-            figRaw, rawPlot = plt.subplots(figsize=(10, 7), constrained_layout = True)
-            pt = int(dataArr_limit*0.1) # custom points
-            for i,f in enumerate(data[r][0:filter_count]):
-
-                DC_offset = np.mean(f) # DC offset to plot triangular wave
-                sobel_filtered_data = abs(np.convolve(f, createSobel(sobelSize), mode="same"))*(1/sobelSize) 
-                
-                sobel_filtered_data = sobel_filtered_data[int(sobelSize/2):-int(sobelSize/2)] # discard missing values from sides 
-                peaks, _  = find_peaks(sobel_filtered_data, distance = int(sobelSize*0.9))
-
-                Asy_count = int(len(peaks)/2)-2  # -2 for skipping last two peaks
-                A_LED_temp = np.zeros(Asy_count)
-                A_LED_err_temp = np.zeros(Asy_count)
-                V_mean_temp = np.zeros(Asy_count)
-                V_mean_err_temp = np.zeros(Asy_count)
-
-                clr = ['red', 'orange'] # colors for quartet analysis separation plot
-                for u in range(Asy_count):  # Iterate over peaks and select H & L data points
-                    if analysisMethod == 'quartet':      # Quartet analysis for 960Hz
-                        v1 = np.append(f[peaks[2*u+2]:peaks[2*u+2]+w], f[peaks[2*u+4]-w:peaks[2*u+4]])
-                        v2 = f[peaks[2*u+3]-w:peaks[2*u+3]+w]
-                        r=0 # For plotting
-                        if np.mean(v1) < np.mean(v2): # v1<v2: |+--+|+--+|+--+|  v1>v2: |-++-|-++-|-++-| 
-                            v1 = np.append(f[peaks[2*u+3]:peaks[2*u+3]+w], f[peaks[2*u+5]-w:peaks[2*u+5]])
-                            v2 = f[peaks[2*u+4]-w:peaks[2*u+4]+w]
-                            r=1
-                
-                    if analysisMethod == 'pairwise':     # Pairwise analysis for 1920Hz flashing (Calculate asymmetry by selecting every adjacent H&L pair)
-                        v1 = f[peaks[2*u+2]-w:peaks[2*u+2]+w]       # Selecting data using peaks(skip two first peaks)    -+-|+-|+-|+-|+-|+-
-                        v2 = f[peaks[2*u+3]-w:peaks[2*u+3]+w]
-
-                    H = max(np.mean(v1), np.mean(v2))    # Differentiate H and L using min and max
-                    L = min(np.mean(v1), np.mean(v2))
-
-                    V_mean_temp[u] = (H + L)/2
-                    A_LED_temp[u] = (H - L)/(H + L) # calculate Asymmetry for selected pair of High and LOW
-                
-                A_LED[r][i] = np.mean(A_LED_temp) # Final asymmetry for per filter positions
-                A_LED_err[r][i] = np.std(A_LED_temp)/np.sqrt(len(A_LED_temp)) # standard error of mean
-                
-                I_anode[r][i]  = (np.mean(V_mean_temp)/gain)*1000
-                I_anode_err[r][i] = ((np.std(V_mean_temp)/np.sqrt(len(V_mean_temp)))/gain)*1000 # standard error of mean
-            
-                nn, b, patches = asyPlot[int(i/3), i%3].hist(A_LED_temp, bins=100, alpha=0.6)
-                nk=np.max(nn)
-                asyPlot[int(i/3), i%3].axvline(A_LED[r][i],ls='--',color='r',label=r'Mean($\mu$)',lw=1)
-                # asyPlot[int(i/3), i%3].fill_betweenx(np.arange(0,nk), eminus, eplus, facecolor='green', alpha=0.8)
-                asyPlot[int(i/3), i%3].errorbar(A_LED[r][i], nk/10, xerr=A_LED_err[r][i],elinewidth=1, capsize=3, ecolor='k', lw=0, label=r'$\delta\mu=\pm\sigma /\sqrt{{n}}$')
-                asyPlot[int(i/3), i%3].set_title(fr"F:{filter_transmission[i]}\%, $\sigma$={np.std(A_LED_temp):.2e}, $\mu$={A_LED[0][i]:.2e}, $\sigma /                     \sqrt{{n}}$={np.std(A_LED_temp)/np.sqrt(len(A_LED_temp)):.2e}",fontsize=11)
-                asyPlot[int(i/3), i%3].set_xlabel(r"$A_{LED}$",fontsize=14)
-                asyPlot[int(i/3), i%3].set_ylabel(r"$Count$",fontsize=14)
-                asyPlot[int(i/3), i%3].margins(0)
-                asyPlot[int(i/3), i%3].legend(title=f'n={len(A_LED_temp)}')
-                asyPlot[int(i/3), i%3].xaxis.set_major_locator(AutoLocator())
-                asyPlot[int(i/3), i%3].tick_params(axis='x',rotation = 45)
-
-                rawPlot.plot(f[0:pt],alpha=0.5,label=f'F{i+1}: {filter_transmission[i]}%')
-
-            plt.suptitle(f"Asymmetry distribution [Run: {r+1:02}]", fontsize=18)
-            figAsyHist.savefig(f"{data_path}/Asymmetry_distribution_{r+1:02}.png")
-            figRaw.savefig(f"{data_path}/Raw_data_{r+1:02}.png")
-            plt.close(figAsyHist) # Close the figure to save memory
-            plt.close(figRaw)
             
 
         if debug: print(" ✅ [Complete]: LED Asymmetries, Means and errors are calculated")
         res=0
 
         # add/replace analysis data
-        addOrReplaceLine(data_path, 'Pedestal_Means[pre,post](V)', f'[{pedestal_mean[0]},{pedestal_mean[1]}]')
-        addOrReplaceLine(data_path, 'Pedestal_STD[pre,post](V)', f'[{pedestal_sigma[0]},{pedestal_sigma[1]}]')
+        with Experiment_Data.ExperimentData(data_path) as expData:
+            expData['Pedestal_Means[pre,post](V)'] = f'[{pedestal_mean[0]},{pedestal_mean[1]}]'
+            expData['Pedestal_STD[pre,post](V)'] = f'[{pedestal_sigma[0]},{pedestal_sigma[1]}]'
 
         figAsyScatter, asyScatterPlot = plt.subplots(figsize=(6,4))
         for i in range(runCount):
@@ -0,0 +1,89 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Cache of the statistics of the pedestal records (count, mean, standard deviation, min, max and
+#              optionally a histogram), keyed by the root file. A pedestal shared by two consecutive runs
+#              (Run-n-F12) or analysed again is not decoded again: the statistics are kept in memory for the
+#              process and in a small '.pedestal_stats' sidecar folder, valid while the root file is unchanged
+#              (Record_Cache.fileSignature). The sidecar is always read but only written if persistent is set:
+#              by the --cache option of the analysis scripts and by the acquisition scripts (Check_Record.py,
+#              Pipelined_Analysis.py), so archived data directories are not written to by default.
+
+import numpy as np
+import os
+import json
+import logging
+import Record_Cache
+from Running_Stats import RunningStats
+
+cache_dir_name = '.pedestal_stats'   # Sidecar folder created next to the root files
+persistent = False                   # Write the sidecar entries (set by --cache and the acquisition scripts)
+_memo = {}                           # path: (size, mtime, entry) of the files seen by this process
+
+def compute(y, bins=None, chunkSize=2**20):
+    '''
+    Statistics of a full record in one pass over its chunks (RunningStats).
+    With bins, the histogram over [min, max] (the numpy default range) is added as 'hist' and 'edges'
+    '''
+    running = RunningStats.of(y, chunkSize)
+    if running.count == 0: raise ValueError("Empty pedestal record")
+    stats = {'count': running.count, 'mean': running.mean, 'std': float(running.std),
+             'min': running.min, 'max': running.max}
+    if bins:
+        edges = np.histogram_bin_edges(np.array([running.min, running.max]), bins=bins)
+        hist = np.zeros(bins, dtype=np.int64)
+        for a in range(0, len(y), chunkSize):
+            hist += np.histogram(y[a:a+chunkSize], bins=edges)[0]
+        stats.update(hist=hist, edges=edges)
+    return stats
+
+def _entryPath(path):
+    folder, rootFile = os.path.split(path)
+    return os.path.join(folder, cache_dir_name, f'{rootFile}.json')
+
+def _entry(path):
+    '''
+    Cached entry {'signature':..., 'branches': {branch: stats}} of an unchanged root file, or None
+    '''
+    st = os.stat(path)
+    memo = _memo.get(path)
+    if memo and memo[:2] == (st.st_size, st.st_mtime_ns): return memo[2]
+    try:
+        with open(_entryPath(path), 'r') as file:
+            entry = json.load(file)
+        if entry['signature'] != Record_Cache.fileSignature(path): return None
+    except (OSError, ValueError, KeyError):
+        return None
+    _memo[path] = (st.st_size, st.st_mtime_ns, entry)
+    return entry
+
+def lookup(path, branch='ch1_data', bins=None):
+    '''
+    Cached statistics of a branch of a root file (with the histogram of 'bins' bins if requested), or None
+    '''
+    entry = _entry(path)
+    stats = entry['branches'].get(branch) if entry else None
+    if stats is None: return None
+    stats = dict(stats)
+    if bins:
+        if str(bins) not in stats['hist']: return None
+        stats['hist'], stats['edges'] = (np.asarray(v) for v in stats['hist'][str(bins)])
+    else: del stats['hist']
+    return stats
+
+def store(path, stats, branch='ch1_data'):
+    entry = _entry(path) or {'signature': Record_Cache.fileSignature(path), 'branches': {}}
+    saved = entry['branches'].setdefault(branch, {'hist': {}})
+    saved.update({k: v for k, v in stats.items() if k not in ('hist', 'edges')})
+    if 'hist' in stats: saved['hist'][str(len(stats['hist']))] = [stats['hist'].tolist(), stats['edges'].tolist()]
+    st = os.stat(path)
+    _memo[path] = (st.st_size, st.st_mtime_ns, entry)
+    if not persistent: return
+    entry_path = _entryPath(path)
+    try:
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp = f'{entry_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(entry, file)
+        os.replace(tmp, entry_path)
+    except OSError as e:
+        logging.warning(f" ⚠️ [Cache]: Could not save the pedestal statistics of {path} ({e})")
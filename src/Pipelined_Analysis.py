@@ -0,0 +1,126 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Reduce the records of a run while it is being recorded. Started by main.sh (-p) before the filter
+#              cycle, it waits for each N.root to land in the run directory and reduces it right away (streaming
+#              analysis, cached by Record_Features), so the final Calculate_non-linearity.py -c only combines the
+#              cached reductions and fits. The asymmetry of each filter (pre pedestal correction) is logged as the run proceeds.
+#              Only the streaming analysis (-c, same chunk size) reads the cached reductions: without -c the records
+#              are loaded again for the in-memory analysis and its raw data plots, so main.sh -p always uses -c.
+#   e.g. python Pipelined_Analysis.py $DIRNAME -f 1920 -c 1048576 -a 3 &
+
+import numpy as np
+import os
+import sys
+import time
+import logging
+import argparse
+import Calculate_Asymmetry
+import Pedestal_Stats
+
+poll_interval = 0.2   # Seconds between the directory scans
+record_overhead = 60  # Seconds per recording besides the CMData run length (filter move, CMData start-up, quality check)
+
+logging.basicConfig(level=logging.INFO,
+                    format="[%(levelname)s]: %(message)s",
+                    handlers=[logging.StreamHandler()])
+
+def expectedFiles():
+    return [f'{i}.root' for i in range(1, 12)] + list(Calculate_Asymmetry.pedestal_files)
+
+def reductionSettings(settings_path, chopper_frequency):
+    '''
+    dataArr_limit, sampling_rate, analysisMethod, sobelSize and w of the records of a run being recorded
+    (the run directory has no CMDataSettings.txt and Experiment_data.txt yet)
+    '''
+    with open(settings_path, 'r') as CMData_settings:
+        lines = CMData_settings.readlines()
+        prescale = int(lines[4].split(" ")[1])
+        record_length = float(lines[5].split(" ")[1])
+    dataArr_limit = int((Calculate_Asymmetry.ADC_rate/prescale)*record_length*0.9)
+    sampling_rate = Calculate_Asymmetry.ADC_rate/prescale
+    analysisMethod = Calculate_Asymmetry.analysisMethodFor(chopper_frequency)
+    sobelSize, w = Calculate_Asymmetry.streamWindows(sampling_rate, chopper_frequency)
+    return dataArr_limit, sampling_rate, analysisMethod, sobelSize, w
+
+def idleTimeout(settings_path, attempts):
+    '''
+    Seconds to wait for the next record before giving up: every recording attempt of a filter position
+    (main.sh max_attempts) takes the CMData run length plus the record_overhead
+    '''
+    with open(settings_path, 'r') as CMData_settings:
+        record_length = float(CMData_settings.readlines()[5].split(" ")[1])
+    return attempts*(record_length + record_overhead)
+
+def readyFiles(data_path, files, done, sizes):
+    '''
+    Records not reduced yet (or recorded again since, see Check_Record.py) whose size did not change since the
+    previous scan, oldest first: (mtime, root file). main.sh moves complete files into the run directory, the
+    size check also covers a copy across file systems
+    '''
+    ready = []
+    for rootFile in files:
+        try: st = os.stat(f'{data_path}/{rootFile}')
+        except OSError: continue
+        if done.get(rootFile) == st.st_mtime_ns: continue
+        if st.st_size > 0 and sizes.get(rootFile) == st.st_size: ready.append((st.st_mtime_ns, rootFile))
+        sizes[rootFile] = st.st_size
+    return sorted(ready) # In the recording order
+
+def main():
+    parser = argparse.ArgumentParser(prog='MOLLER Experiment PMT Pipelined Analysis',
+                                     description='Reduce the records of a run while it is being recorded. \nCode by: Anuradha Gunawardhana')
+    parser.add_argument("dir", help="<dir> .root file directory of the run being recorded")
+    parser.add_argument("-f","--frequency", type=int, required=True, help="Chopper frequency (Hz)")
+    parser.add_argument("-s","--settings", default='CMDataSettings.txt', help="CMData settings file used for the recording")
+    parser.add_argument("-c","--chunk", type=int, default=Calculate_Asymmetry.chunk_size, help="Samples per chunk (same as Calculate_non-linearity.py -c)")
+    parser.add_argument("-n","--filters", type=int, default=9, help="Number of filters used for the analysis")
+    parser.add_argument("-a","--attempts", type=int, default=3, help="Recordings of a filter position failing the data quality test (main.sh max_attempts)")
+    args = parser.parse_args()
+    data_path = os.path.normpath(args.dir)
+    Pedestal_Stats.persistent = True # Statistics of the pedestals being recorded, read by the final analysis
+
+    dataArr_limit, sampling_rate, analysisMethod, sobelSize, w = reductionSettings(args.settings, args.frequency)
+    idle_timeout = idleTimeout(args.settings, args.attempts)
+    parent = os.getppid() # main.sh, stops the pipeline from its EXIT trap
+
+    files = expectedFiles()
+    done = {}   # root file: mtime of the reduced record
+    sizes = {}
+    pedestal = None
+    last = time.time()
+    while len(done) < len(files):
+        ready = readyFiles(data_path, files, done, sizes) if os.path.isdir(data_path) else []
+        if not ready:
+            if os.getppid() != parent: # The recording script was killed without running its EXIT trap
+                logging.error("🚨 [Pipeline]: Recording stopped, exiting")
+                sys.exit(1)
+            if time.time() - last > idle_timeout:
+                logging.error(f"🚨 [Pipeline]: No new record in {idle_timeout:.0f} s, missing {[f for f in files if f not in done]}")
+                sys.exit(1)
+            time.sleep(poll_interval)
+            continue
+        for mtime, rootFile in ready:
+            t = time.time()
+            f = files.index(rootFile)
+            try:
+                reduction = Calculate_Asymmetry.reduceRecord(data_path, rootFile, dataArr_limit, sampling_rate,
+                                                             sobelSize if f < max(args.filters, 9) else None,
+                                                             w, analysisMethod, args.chunk)
+            except OSError: # Rejected by Check_Record.py and moved away, the next recording is found by the scan
+                continue
+            done[rootFile] = mtime
+            last = time.time()
+            if not Calculate_Asymmetry.lengthPassed(reduction['length'], sampling_rate, dataArr_limit):
+                logging.warning(f"🟡 [Pipeline]: {rootFile} is shorter than {dataArr_limit} samples")
+                continue
+            if rootFile == Calculate_Asymmetry.pedestal_files[0]:
+                pedestal = Calculate_Asymmetry.pedestalStats(data_path, [rootFile])[0]['mean']
+            message = f"[Pipeline]: {rootFile} reduced in {last-t:.1f} s"
+            if 'v1_mean' in reduction and pedestal is not None:
+                A_LED_temp, _ = Calculate_Asymmetry.asymmetryFromMeans(reduction['v1_mean'] - pedestal, reduction['v2_mean'] - pedestal)
+                message += f", A_LED(F{f+1}) = {np.mean(A_LED_temp):.6f}"
+            logging.info(message)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
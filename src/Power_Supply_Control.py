@@ -9,7 +9,31 @@ import serial.tools.list_ports
 import argparse
 import sys
 
-def main():
+def findPort(debug=False):
+    '''
+    Open the serial port of the power supply (None if it is not connected)
+    '''
+    ports = serial.tools.list_ports.comports()
+    if ports == []:
+        print("[PowerSupply Error]: No serial devices detected!")
+        return None
+
+    for port, desc, hwid in sorted(ports):
+        if debug: print(port, desc, hwid)
+        if "067B:2303" in hwid: #Hardware id for the TTL to USB converter
+            ser = serial.Serial(port, 38400,timeout=1) # Need to to set baud rate value on the Power supply on the MENU
+            if debug: print("[PowerSupply]: Wait - Opening the serial port!")
+            if ser.is_open: 
+                if debug: print("[PowerSupply]: Port is already open!")
+            else:
+                ser.open()
+                if ser.is_open and debug: print("[PowerSupply]: Port is Open!")
+            return ser
+
+    print("[PowerSupply Failed]: BK PRECISION 9129B power supply not detected!")
+    return None
+
+def main(ser=None): # ser: port held open by the Instrument_Server
     counter = 0
     debug = False
     Imax_PMT = 1
@@ -57,85 +81,69 @@ def main():
             "readCurrent":'MEAS:CURR:ALL?',
             "readVolt" : "MEAS:ALL?"}
 
-    ports = serial.tools.list_ports.comports()
-    if ports == []:
-        print("[PowerSupply Error]: No serial devices detected!")
-        sys.exit(1)
-
-    else:
-        for port, desc, hwid in sorted(ports):
-            if debug: print(port, desc, hwid)
-            if "067B:2303" in hwid: #Hardware id for the TTL to USB converter
-                ser = serial.Serial(port, 38400,timeout=1) # Need to to set baud rate value on the Power supply on the MENU
-                if debug: print("[PowerSupply]: Wait - Opening the serial port!")
-                if ser.is_open: 
-                    if debug: print("[PowerSupply]: Port is already open!")
-                else:
-                    ser.open()
-                    if ser.is_open and debug: print("[PowerSupply]: Port is Open!")
-                
-                def setCommand(n):
-                    p = str.encode(cmds[n]+'\n') # encode string as byte
-                    ser.write(p)
-                    ser.reset_output_buffer()
-                    time.sleep(.1)
-
-                    line = (str(ser.read_until('\r')))[2:-5]
-                    q = line.split('\\r')
-                    return q[-1]
-                
-                setCommand("remoteEnabled") # Allow remote access
-                if args.c:setCommand(args.c)
-                elif args.v:
-                    setCommand("setCurrentLimit")
-                    setCommand("setVoltage")
-                    setCommand("outputON")
-                    s = setCommand("readVolt")
-                    while(s == ''): # no response
-                        print('[Power Supply Failed]: Couldn\'t set the voltage!')
-                        setCommand("readVolt")
-                        counter+=1
-                        if (counter == 1):
-                            print('[Power Supply EXIT]: Failed to set the voltage.')
-                            sys.exit(1)
-                        time.sleep(1)
-                    if float(s.split(",")[0]) == 0: setCommand("outputON")
-                    q = setCommand("readVolt")
-                    r = setCommand("readCurrent")
-                    vpmt = float(0 if q.split(",")[0]=='' else q.split(",")[0])
-                    vconst = float(0 if q.split(",")[1]=='' else q.split(",")[1])
-                    vblink = float(0 if q.split(",")[2]=='' else q.split(",")[2])
-
-                    Ipmt = float(0 if r.split(",")[0]=='' else r.split(",")[0])*1000
-                    Iconst = float(0 if r.split(",")[1]=='' else r.split(",")[1])*1000
-                    Iblink = float(0 if r.split(",")[2]=='' else r.split(",")[2])
-                    print(f'[PowerSupply Done]: Measured ch1:[{vpmt:.2f} V, {Ipmt:.2f} mA], ch2:[{vconst:.2f} V, {Iconst} mA], ch3:[{vblink:.2f} V, {Iblink} mA]')
-                    baseImax = I_PMT_operational*1.1
-                    baseImin = I_PMT_operational*0.9
-                    time.sleep(.2)
-                    if (Ipmt >= baseImax or Ipmt < baseImin):
-                        print('[PowerSupply Warning]: PMT current anomaly detected')
-                        print('[PowerSupply] Turning off')
-                        setCommand("outputOFF")
-                        sys.exit(1)
-
-                elif args.ri:
-                    q = setCommand("readCurrent")
-                    ch = int(args.ri)-1
-                    x = q.split(',')[ch]
-                    print(f'Current: Ch{ch+1} = {x if x!="" else "NULL"}' )
-                elif args.rv:
-                    q = setCommand("readVolt")
-                    ch = int(args.rv)-1
-                    x = q.split(',')[ch]
-                    print(f'Voltage: Ch{ch+1} = {x if x!="" else "NULL"}' )
-                setCommand("remoteDisabled") # Enable local control
-
-                ser.close()
-                sys.exit(0)
-
-        print("[PowerSupply Failed]: BK PRECISION 9129B power supply not detected!")
-        sys.exit(1)
+    owned = ser is None
+    if owned: ser = findPort(debug)
+    if ser is None: sys.exit(1)
+
+    def setCommand(n):
+        p = str.encode(cmds[n]+'\n') # encode string as byte
+        ser.write(p)
+        ser.reset_output_buffer()
+        time.sleep(.1)
+
+        line = (str(ser.read_until('\r')))[2:-5]
+        q = line.split('\\r')
+        return q[-1]
+    
+    setCommand("remoteEnabled") # Allow remote access
+    if args.c:setCommand(args.c)
+    elif args.v:
+        setCommand("setCurrentLimit")
+        setCommand("setVoltage")
+        setCommand("outputON")
+        s = setCommand("readVolt")
+        while(s == ''): # no response
+            print('[Power Supply Failed]: Couldn\'t set the voltage!')
+            setCommand("readVolt")
+            counter+=1
+            if (counter == 1):
+                print('[Power Supply EXIT]: Failed to set the voltage.')
+                sys.exit(1)
+            time.sleep(1)
+        if float(s.split(",")[0]) == 0: setCommand("outputON")
+        q = setCommand("readVolt")
+        r = setCommand("readCurrent")
+        vpmt = float(0 if q.split(",")[0]=='' else q.split(",")[0])
+        vconst = float(0 if q.split(",")[1]=='' else q.split(",")[1])
+        vblink = float(0 if q.split(",")[2]=='' else q.split(",")[2])
+
+        Ipmt = float(0 if r.split(",")[0]=='' else r.split(",")[0])*1000
+        Iconst = float(0 if r.split(",")[1]=='' else r.split(",")[1])*1000
+        Iblink = float(0 if r.split(",")[2]=='' else r.split(",")[2])
+        print(f'[PowerSupply Done]: Measured ch1:[{vpmt:.2f} V, {Ipmt:.2f} mA], ch2:[{vconst:.2f} V, {Iconst} mA], ch3:[{vblink:.2f} V, {Iblink} mA]')
+        baseImax = I_PMT_operational*1.1
+        baseImin = I_PMT_operational*0.9
+        time.sleep(.2)
+        if (Ipmt >= baseImax or Ipmt < baseImin):
+            print('[PowerSupply Warning]: PMT current anomaly detected')
+            print('[PowerSupply] Turning off')
+            setCommand("outputOFF")
+            sys.exit(1)
+
+    elif args.ri:
+        q = setCommand("readCurrent")
+        ch = int(args.ri)-1
+        x = q.split(',')[ch]
+        print(f'Current: Ch{ch+1} = {x if x!="" else "NULL"}' )
+    elif args.rv:
+        q = setCommand("readVolt")
+        ch = int(args.rv)-1
+        x = q.split(',')[ch]
+        print(f'Voltage: Ch{ch+1} = {x if x!="" else "NULL"}' )
+    setCommand("remoteDisabled") # Enable local control
+
+    if owned: ser.close()
+    sys.exit(0)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,58 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.10
+# Description: Query the runs of the PMT database (the columnar store written by Create_Database.py)
+#   e.g. all 1920 Hz runs at -800 V for 3-stage bases with a non-linearity above 0.5%:
+#   python Query_Database.py -w HV=-800 -w LED_flashing_frequency=1920 -w PMT_base_stages=3 -w Non_Linearity.Non_Linearity=0.5:
+
+import numpy as np
+import argparse
+import Results_Store
+
+def parseValue(value):
+    for t in (int, float):
+        try: return t(value)
+        except ValueError: pass
+    return value
+
+def parseFilter(text):
+    '''
+    KEY=VALUE for equality, KEY=MIN:MAX for an inclusive range (either end can be empty)
+    '''
+    key, value = text.split('=', 1)
+    if ':' in value:
+        lo, hi = value.split(':', 1)
+        return key, (parseValue(lo) if lo else None, parseValue(hi) if hi else None)
+    return key, parseValue(value)
+
+def main():
+    parser = argparse.ArgumentParser(prog='MOLLER Experiment: PMT database query',
+                                     description='Query the runs of the PMT database. \nCode by: Anuradha Gunawardhana')
+
+    parser.add_argument("-s","--store", default='Database_store', help="Columnar database directory (written by Create_Database.py)")
+    parser.add_argument("-p","--pmt", action='append', help="PMT serial (repeat for more PMTs)")
+    parser.add_argument("-w","--where", action='append', default=[], help="Filter KEY=VALUE or KEY=MIN:MAX, e.g. HV=-800, Timestamp=202409010000:")
+    parser.add_argument("-a","--arrays", action='store_true', help="Print the per filter anode currents and asymmetries")
+    parser.add_argument("-o","--output", help="Save the selected runs to a .npz file")
+    args = parser.parse_args()
+
+    store = Results_Store.ResultsStore(args.store)
+    filters = dict(parseFilter(w) for w in args.where)
+    if args.pmt: filters['PMT'] = args.pmt
+    columns = ['Timestamp', 'HV', 'LED_flashing_frequency', 'PMT_base_stages', 'Max_cathode_current',
+               'Non_Linearity.Non_Linearity', 'Non_Linearity.Lin_err',
+               'Anode_current', 'Anode_current_err', 'Asymmetry', 'Asymmetry_err']
+    result = store.query(filters, columns)
+
+    print(f"{'PMT':<10}{'Timestamp':<14}{'HV(V)':>7}{'f(Hz)':>7}{'Stages':>7}{'Ik(nA)':>7}{'Non-Linearity(%)':>20}")
+    for r in range(len(result['run'])):
+        print(f"{result['PMT'][r]:<10}{result['Timestamp'][r]:<14}{result['HV'][r]:>7}{result['LED_flashing_frequency'][r]:>7}"
+              f"{result['PMT_base_stages'][r]:>7}{result['Max_cathode_current'][r]:>7}"
+              f"{result['Non_Linearity.Non_Linearity'][r]:>12.3f} ± {result['Non_Linearity.Lin_err'][r]:.3f}")
+        if args.arrays:
+            print(f"    Anode current(uA): {np.array2string(result['Anode_current'][r], precision=3)}")
+            print(f"    Asymmetry:         {np.array2string(result['Asymmetry'][r], precision=6)}")
+    print(f"[Info]: {len(result['run'])} of {store.meta['run_count']} runs selected")
+    if args.output: np.savez(args.output, **result)
+
+if __name__ == "__main__":
+    main()
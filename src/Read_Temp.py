@@ -7,6 +7,7 @@ import serial
 import sys
 import serial.tools.list_ports
 import argparse
+import Experiment_Data
  
 def main():
     print("------------------------------------------------")
@@ -49,9 +50,9 @@ def main():
             h_darkBox = line.strip().split(',')[2][5:]
 
             print(f"[TEMP_Monitor]: LEDs:{t_LEDs}, DarkBox:{t_darkBox}")
-            with open(f"{args.dir}/Experiment_data.txt", 'a') as f:
-                f.writelines(f"Temperature[LEDs,Dark Box](C)={t_LEDs},{t_darkBox}\n")
-                f.writelines(f"Humidity[LEDs,Dark Box](%)={h_room},{h_darkBox}\n")
+            with Experiment_Data.ExperimentData(args.dir) as expData:
+                expData["Temperature[LEDs,Dark Box](C)"] = f"{t_LEDs},{t_darkBox}"
+                expData["Humidity[LEDs,Dark Box](%)"] = f"{h_room},{h_darkBox}"
             print(f"[TEMP_Monitor]: Done saving temperature to {args.dir}/Experiment_data.txt")
             ser.close()
             sys.exit(0)
@@ -3,7 +3,9 @@
 # Description:  Use the recorded open and closed PMT readings to calculate the max anode current
 
 import numpy as np
-import uproot
+import Calculate_Asymmetry
+import Experiment_Data
+from Running_Stats import RunningStats
 import os
 import sys
 import logging
@@ -54,19 +56,13 @@ def main():
     if debug: print(f"Data size= {data.shape}")
 
     data = np.empty((2))
-    for f,rootFile in enumerate(expected_file_list):
-        file = uproot.open(f'{data_path}/{rootFile}')
-        tree = file['DataTree']
-        branches = tree.arrays()  
-        data[f] = np.mean(branches['ch1_data'].to_numpy())   # Photomultiplier(PMT) data
+    record = Calculate_Asymmetry.loadRecords(data_path, expected_file_list[0:1], branches=('ch1_data',))[0]
+    data[0] = RunningStats.of(record['ch1_data']).mean   # Photomultiplier(PMT) data
+    data[1] = Calculate_Asymmetry.pedestalStats(data_path, expected_file_list[1:2])[0]['mean'] # Dark filter (cached statistics)
 
-    with open(f"{data_path}/Experiment_data.txt", 'r') as Exp_data:
-        expLines = Exp_data.readlines()
-        for i in expLines:
-            id = i.split('=')[0]
-            value = i.split('=')[1].strip()
-            if id == "Preamp_gain(Ohm)" : preamp = value
-            elif id == "PMT_Serial" : serial = value
+    expData = Experiment_Data.readExperimentData(data_path)
+    preamp = expData["Preamp_gain(Ohm)"]
+    serial = expData["PMT_Serial"]
 
     if (preamp == "1M"): gain = 1000
     else: gain = int(preamp[0:-1])
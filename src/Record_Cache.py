@@ -0,0 +1,175 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Sidecar cache of the decoded root file branches as memory-mapped .npy files.
+#              Each run directory gets a '.record_cache' folder. An entry is valid only while the size, mtime and
+#              hash of its root file are unchanged. The least recently used entries are evicted above a total size cap.
+#              The registry of the cache directories keeps a running total of the stored bytes (under a flock, the
+#              pool workers of Create_Database.py store concurrently), the directories are only scanned above the cap.
+#              An eviction holds the same lock from the scan to the new total, so stores and evictions are serialised.
+
+import numpy as np
+import os
+import json
+import fcntl
+import hashlib
+import logging
+from contextlib import contextmanager
+
+enabled = False                             # Set by the --cache option of the analysis scripts
+cache_dir_name = '.record_cache'            # Sidecar folder created next to the root files
+size_limit = 20*2**30                       # Total size cap of all the cache entries (bytes)
+evict_to = 0.8                              # Fraction of the size cap left after an eviction, the directories are scanned once per 20% of the cap stored
+hash_block = 2**20                          # Bytes hashed from the start, middle and end of a root file
+registry = os.path.expanduser('~/.cache/moller_pmt_record_cache.txt') # List of the directories holding cache entries
+
+def fileSignature(path):
+    '''
+    Size, mtime and a hash of the root file. Only three blocks of the file are hashed (start, middle, end),
+    so validating an entry costs a few reads instead of a full pass over the raw data
+    '''
+    st = os.stat(path)
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for offset in sorted({0, max(st.st_size//2 - hash_block//2, 0), max(st.st_size - hash_block, 0)}):
+            file.seek(offset)
+            h.update(file.read(hash_block))
+    return {'size': st.st_size, 'mtime': st.st_mtime_ns, 'hash': h.hexdigest()}
+
+def _entryPaths(path):
+    folder, rootFile = os.path.split(path)
+    cache_dir = os.path.join(folder, cache_dir_name)
+    return cache_dir, os.path.join(cache_dir, f'{rootFile}.json')
+
+def _readMeta(meta_path):
+    try:
+        with open(meta_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def load(path, branches):
+    '''
+    Memory-mapped arrays of the requested branches of a root file, or None if any of them is not cached
+    or the root file changed since it was cached
+    '''
+    cache_dir, meta_path = _entryPaths(path)
+    meta = _readMeta(meta_path)
+    if meta is None or any(b not in meta['branches'] for b in branches): return None
+    try:
+        if meta['signature'] != fileSignature(path): return None
+        arrays = {b: np.load(os.path.join(cache_dir, meta['branches'][b]), mmap_mode='r') for b in branches}
+        os.utime(meta_path) # Mark the entry as recently used
+    except (OSError, ValueError):
+        return None
+    return arrays
+
+def store(path, arrays):
+    '''
+    Write the decoded branches of a root file to the cache. Branches cached earlier for the same (unchanged)
+    root file are kept. Files are written to a temporary name and renamed, so readers never see partial entries
+    '''
+    cache_dir, meta_path = _entryPaths(path)
+    rootFile = os.path.basename(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        signature = fileSignature(path)
+        meta = _readMeta(meta_path)
+        if meta is None or meta['signature'] != signature: meta = {'signature': signature, 'branches': {}}
+        for b, arr in arrays.items():
+            name = f'{rootFile}.{b}.npy'
+            tmp = os.path.join(cache_dir, f'.{name}.{os.getpid()}.tmp')
+            with open(tmp, 'wb') as file:
+                np.save(file, np.ascontiguousarray(arr))
+            os.replace(tmp, os.path.join(cache_dir, name))
+            meta['branches'][b] = name
+        tmp = f'{meta_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(meta, file)
+        os.replace(tmp, meta_path)
+        if _register(cache_dir, sum(np.asarray(arr).nbytes for arr in arrays.values())) > size_limit: evict(evict_to*size_limit)
+    except OSError as e:
+        logging.warning(f" ⚠️ [Cache]: Could not cache {path} ({e})")
+
+@contextmanager
+def _registryLock():
+    '''
+    Exclusive lock (flock) of the registry and the running total of the stored bytes
+    '''
+    os.makedirs(os.path.dirname(registry), exist_ok=True)
+    with open(f'{registry}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def _register(cache_dir, nbytes):
+    '''
+    Add the cache directory to the registry and nbytes to the running total of the stored bytes.
+    Returns the new total. Stored entries are replaced in place, so the total can only overestimate
+    the cache size until the next evict() counts it again
+    '''
+    cache_dir = os.path.abspath(cache_dir)
+    with _registryLock():
+        if cache_dir not in _registeredDirs():
+            with open(registry, 'a') as file:
+                file.write(f'{cache_dir}\n')
+        total = _storedBytes() + nbytes
+        _setStoredBytes(total)
+    return total
+
+def _registeredDirs():
+    try:
+        with open(registry, 'r') as file:
+            return [line.strip() for line in file if line.strip()]
+    except OSError:
+        return []
+
+def _storedBytes():
+    try:
+        with open(f'{registry}.size', 'r') as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return 0
+
+def _setStoredBytes(total):
+    with open(f'{registry}.size', 'w') as file:
+        file.write(f'{total}\n')
+
+def _entries():
+    '''
+    (last use, size, meta path, file paths) of every cache entry in the registered directories
+    '''
+    entries = []
+    for cache_dir in _registeredDirs():
+        try:
+            metas = [e for e in os.scandir(cache_dir) if e.name.endswith('.json')]
+        except OSError:
+            continue
+        for m in metas:
+            meta = _readMeta(m.path)
+            if meta is None: continue
+            files = [os.path.join(cache_dir, name) for name in meta['branches'].values()]
+            size = sum(os.path.getsize(f) for f in files if os.path.exists(f))
+            try: entries.append((m.stat().st_mtime, size, m.path, files))
+            except OSError: continue
+    return entries
+
+def evict(limit=None):
+    '''
+    Remove the least recently used entries until the total cache size is below the limit.
+    Runs under the registry lock: a concurrent store waits and adds its bytes to the new total, a concurrent
+    eviction starts from the sizes left by this one
+    '''
+    limit = size_limit if limit is None else limit
+    with _registryLock():
+        entries = sorted(_entries())
+        total = sum(e[1] for e in entries)
+        for _, size, meta_path, files in entries:
+            if total <= limit: break
+            for f in [meta_path] + files:
+                try: os.remove(f)
+                except OSError: pass
+            total -= size
+            logging.info(f"[Cache]: Evicted {meta_path}")
+        _setStoredBytes(max(total, 0))
+
+def clear():
+    evict(0)
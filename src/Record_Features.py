@@ -0,0 +1,68 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Cache of the per-record reductions of the streaming analysis (record length, anomaly factors, raw pair
+#              window means and photodiode statistics), keyed by the root file and the analysis parameters.
+#              Filled by Check_Record.py and Pipelined_Analysis.py while a run is being recorded and read by
+#              streamAsymmetry, so the records are not decoded again for the final fit. Entries are kept in a
+#              '.record_features' sidecar folder and are valid while the root file is unchanged (Record_Cache.fileSignature).
+#              Both scripts reduce the same record at the same time: the reduction is done under a per-record lock,
+#              the second one waits and reads the cached entry.
+
+import numpy as np
+import os
+import json
+import fcntl
+import logging
+import Record_Cache
+from contextlib import contextmanager
+
+cache_dir_name = '.record_features'  # Sidecar folder created next to the root files
+
+def _entryPath(path):
+    folder, rootFile = os.path.split(path)
+    return os.path.join(folder, cache_dir_name, f'{rootFile}.npz')
+
+def lookup(path, params):
+    '''
+    Cached reduction of an unchanged root file analysed with the same parameters, or None
+    '''
+    try:
+        with np.load(_entryPath(path), allow_pickle=False) as entry:
+            meta = json.loads(str(entry['meta']))
+            if meta['params'] != params or meta['signature'] != Record_Cache.fileSignature(path): return None
+            return {k: (entry[k].item() if entry[k].ndim == 0 else entry[k]) for k in entry.files if k != 'meta'}
+    except (OSError, ValueError, KeyError):
+        return None
+
+@contextmanager
+def locked(path):
+    '''
+    Exclusive lock (flock) of the cache entry of a root file, held while the record is reduced.
+    Without a writable sidecar folder the record is reduced without the lock
+    '''
+    entry_path = _entryPath(path)
+    try:
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        lock = open(f'{entry_path}.lock', 'a')
+    except OSError:
+        yield
+        return
+    with lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def store(path, params, reduction, signature=None):
+    '''
+    signature: Record_Cache.fileSignature of the root file taken before it was loaded (a record moved away and
+    recorded again while it was reduced then leaves an invalid entry instead of a wrong one)
+    '''
+    entry_path = _entryPath(path)
+    try:
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        meta = json.dumps({'signature': signature or Record_Cache.fileSignature(path), 'params': params})
+        tmp = f'{entry_path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as file:
+            np.savez(file, meta=meta, **reduction)
+        os.replace(tmp, entry_path)
+    except OSError as e:
+        logging.warning(f" ⚠️ [Cache]: Could not save the record reduction of {path} ({e})")
@@ -0,0 +1,373 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Render the analysis figures of a run from the intermediate arrays saved by the analysis
+#              (<kind>_plot_data.npz). Started in the background by Calculate_Asymmetry.deferPlots, so the
+#              numeric results and exit codes do not wait for matplotlib. Can also be run by hand:
+#   python Render_Plots.py <dir> [Asymmetry] [Non_linearity]
+#              Batch figures (many runs / PMTs) use figure templates: the figure is built once and only the
+#              data of its artists is replaced for every run, e.g. the per-PMT plots of the database:
+#   python Render_Plots.py Database_store Database
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.ticker import AutoMinorLocator,AutoLocator,MaxNLocator,NullLocator
+from matplotlib.collections import LineCollection
+import Results_Store
+from Calculate_Asymmetry import filter_transmission, minMaxDecimate
+import os
+import sys
+import traceback
+import argparse
+
+def loadPlotData(data_path, kind):
+    with np.load(f"{data_path}/{kind}_plot_data.npz") as d:
+        return {key: d[key] for key in d.files}
+
+def renderAsymmetry(data_path):
+    '''
+    pedestal.png, RawData.png, rawData_full.png, Photodiode_raw.png and (if the analysis passed)
+    Sobel_filtering.png, Asymmetry_distribution.png
+    '''
+    d = loadPlotData(data_path, 'Asymmetry')
+    filter_count = int(d['filter_count'])
+    dataArr_limit = int(d['dataArr_limit'])
+    sampling_rate = float(d['sampling_rate'])
+    bins = int(d['bins'])
+    pedestal_sigma = d['pedestal_sigma']
+    runTime = str(d['runTime'])
+
+    figRaw, rawPlot = plt.subplots(figsize=(10, 7), constrained_layout = True)
+    figFull, fullPlot = plt.subplots(figsize=(10,7),constrained_layout = True)
+    figPhotodiode, diodePlot = plt.subplots(figsize=(10, 7), constrained_layout = True)
+    figPedestal, pedestalPlot = plt.subplots(figsize=(8, 6), constrained_layout = True)
+    #-------- raw PMT and photo-diode data (decimated by Calculate_Asymmetry.rawTraces) -------#
+    for f in range(len(d['files'])):
+        if f<9: label = f'F{f+1}: {filter_transmission[f]}%'
+        elif f==11: label = 'Pre-Pedestal'
+        elif f==12: label = 'Post-Pedestal'
+        else: continue
+        rawPlot.plot(d[f'raw_t_{f}'], d[f'raw_{f}'],alpha=0.5,label=label)
+        fullPlot.plot(d[f'full_t_{f}'], d[f'full_{f}'],alpha=0.5,label=label)
+        diodePlot.plot(d[f'diode_t_{f}'], d[f'diode_{f}'],alpha=0.5,label=label)
+    #---------------------- Pedestals ------------------------#
+    for p in range(2):
+        m="Pre" if p==0 else "Post"
+        hist, edges = d['pedestal_hist'][p], d['pedestal_edges'][p] # Histogram of the full pedestal record (Pedestal_Stats)
+        pedestalPlot.stairs(hist/np.sum(hist)/np.diff(edges), edges, fill=True, alpha=0.6, label=f'{m}-Pedestal')
+    fac = float(d['fac']) # fraction of acceptable drift
+    k = bool(d['pedestal_drift_passed'])
+    pedestalPlot.xaxis.set_minor_locator(AutoMinorLocator())
+    pedestalPlot.yaxis.set_minor_locator(AutoMinorLocator())
+    pedestalPlot.set_xlabel("ADC Voltage (V)")
+    pedestalPlot.set_ylabel("Probability Density")
+    pedestalPlot.set_title("Probability densities of ADC pedestal runs")
+    pedestalPlot.legend(title=rf'$\sigma_{{pre}}$= {pedestal_sigma[0]:.3e}'+'\n'+
+                            fr'$\sigma_{{post}}$= {pedestal_sigma[1]:.3e}'+'\n'+
+                            fr'{"✔️" if k else "‼️"} $|\mu_{{post}}-\mu_{{pre}}| {"<" if k else ">"} \sigma_{{avg}}*{int(fac*100)}\%$'+'\n'+
+                            f'Run Time = {runTime}s')
+    pedestalPlot.margins(0)
+    figPedestal.savefig(f"{data_path}/pedestal.png")
+
+    rawPlot.xaxis.set_minor_locator(AutoMinorLocator())
+    rawPlot.yaxis.set_minor_locator(AutoMinorLocator())
+    rawPlot.legend(loc='upper right',fontsize="12")
+    rawPlot.set_ylabel(r'Voltage $(V)$',fontsize=15)
+    rawPlot.set_xlabel(r"Time $(ms)$",fontsize=15)
+    rawPlot.set_title("Raw data: Constant LED with Flashing LED", fontsize=18)
+    rawPlot.margins(x=0)
+    figRaw.savefig(f"{data_path}/RawData.png")
+
+    # fullPlot.xaxis.set_minor_locator(AutoMinorLocator())
+    # fullPlot.yaxis.set_minor_locator(AutoMinorLocator())
+    fullPlot.grid(linestyle='--')
+    fullPlot.legend(loc='upper right',fontsize="12")
+    fullPlot.set_ylabel(r'Voltage $(V)$',fontsize=15)
+    fullPlot.set_xlabel(r"Time $(ms)$",fontsize=15)
+    fullPlot.set_title("Raw data: Full range", fontsize=18)
+    fullPlot.margins(x=0)
+    figFull.savefig(f"{data_path}/rawData_full.png")
+
+    diodePlot.xaxis.set_minor_locator(AutoMinorLocator())
+    diodePlot.yaxis.set_minor_locator(AutoMinorLocator())
+    diodePlot.legend(loc='upper right',fontsize="12")
+    diodePlot.set_ylabel(r'Voltage $(V)$',fontsize=15)
+    diodePlot.set_xlabel(r"Time $(ms)$",fontsize=15)
+    diodePlot.set_title("Photodiode raw data", fontsize=18)
+    diodePlot.margins(x=0)
+    figPhotodiode.savefig(f"{data_path}/Photodiode_raw.png")
+    plt.close('all')
+
+    if 'A_LED' not in d: return # The analysis did not pass the tests
+    #--------- Plotting asymmetry distributions and sobel filtering--------#
+    analysisMethod = str(d['analysisMethod'])
+    w = int(d['w'])
+    A_LED = d['A_LED']
+    A_LED_err = d['A_LED_err']
+    figSobel, sobelPlot = plt.subplots(filter_count, 1,figsize=(15, 10),constrained_layout = True,sharex=True)
+    figAsyHist, asyPlot = plt.subplots(3, 3, figsize=(13, 12),constrained_layout = True)
+    figSobel.suptitle(f"Data Filtering", fontsize=14)
+    figAsyHist.suptitle(f"LED Asymmetry distribution", fontsize=18)
+    sep_plot_lim=int(dataArr_limit*0.02) # Plot length (data points)
+    xt=np.arange(0,sep_plot_lim)/(sampling_rate/1000) #scale the x-axis to proper milliseconds range
+    for i in range(filter_count):
+        f = d[f'trace_{i}'] # Pedestal corrected data
+        DC_offset = float(d[f'DC_offset_{i}']) # DC offset to plot sobel triangular wave
+        peaks = d[f'peaks_{i}']
+        A_LED_temp = d[f'A_LED_temp_{i}']
+        v1_mean, v2_mean, shift = d[f'v1_mean_{i}'], d[f'v2_mean_{i}'], d[f'shift_{i}']
+        #----------------- plotting the selected data based on the analysis method ------------#
+        clr = ['red', 'orange'] # colors for quartet analysis separation plot
+        u_plot = np.flatnonzero(peaks[2*np.arange(len(A_LED_temp))+3]+w < sep_plot_lim)
+        for u in u_plot:
+            r = shift[u]
+            if analysisMethod == 'quartet':      # Quartet analysis for 960Hz
+                v1 = np.append(f[peaks[2*u+2+r]:peaks[2*u+2+r]+w], f[peaks[2*u+4+r]-w:peaks[2*u+4+r]])
+                v2 = f[peaks[2*u+3+r]-w:peaks[2*u+3+r]+w]
+                sobelPlot[i].scatter(np.append(np.arange(peaks[2*u+2+r],peaks[2*u+2+r]+w)/(sampling_rate/1000), np.arange(peaks[2*u+4+r]-w,peaks[2*u+4+r])/(sampling_rate/1000)),v1, alpha=0.5, color=clr[u%2] if (v1_mean[u]>v2_mean[u]) else 'g',marker ='.',linewidths=0.2)
+                sobelPlot[i].scatter(np.arange(peaks[2*u+3+r]-w,peaks[2*u+3+r]+w)/(sampling_rate/1000),v2, alpha=0.5, color='g' if (v1_mean[u]>v2_mean[u]) else clr[u%2],marker ='.',linewidths=0.2)
+
+            if analysisMethod == 'pairwise':     # Pairwise analysis for 1920Hz flashing
+                v1 = f[peaks[2*u+2]-w:peaks[2*u+2]+w]
+                v2 = f[peaks[2*u+3]-w:peaks[2*u+3]+w]
+                sobelPlot[i].scatter(np.arange(peaks[2*u+2]-w,peaks[2*u+2]+w)/(sampling_rate/1000),v1, alpha=0.5, color='r' if (v1_mean[u]>v2_mean[u]) else 'g',marker ='.',linewidths=0.2)
+                sobelPlot[i].scatter(np.arange(peaks[2*u+3]-w,peaks[2*u+3]+w)/(sampling_rate/1000),v2, alpha=0.5, color='g' if (v1_mean[u]>v2_mean[u]) else 'r',marker ='.',linewidths=0.2)
+
+        sobelPlot[i].plot(*minMaxDecimate(f[0:sep_plot_lim], xt), label="Raw Data", alpha=0.3)
+        sobelPlot[i].plot(xt,(d[f'sobel_{i}'] + DC_offset), alpha=0.7,label='Sobel filtered data')
+        sobelPlot[i].legend(title=f'ND Filter: {filter_transmission[i]}%', bbox_to_anchor=(1.01, 1), borderaxespad=0)
+        sobelPlot[i].set_ylabel(r"$Voltage(V)$",fontsize=11)
+        sobelPlot[i].xaxis.set_minor_locator(AutoMinorLocator())
+        sobelPlot[i].margins(x=0)
+
+        nn, b, patches = asyPlot[int(i/3), i%3].hist(A_LED_temp, bins=bins, alpha=0.6, label="Data")
+        nk=np.max(nn)
+        asyPlot[int(i/3), i%3].axvline(A_LED[i],ls='--',color='r',label=r'$\mu$',lw=1)
+        asyPlot[int(i/3), i%3].errorbar(A_LED[i], nk/10, xerr=A_LED_err[i],elinewidth=1, capsize=3, ecolor='k', lw=0, label=r'$\sigma /\sqrt{{n}}$')
+        asyPlot[int(i/3), i%3].set_title(fr"F:{filter_transmission[i]}%, $\sigma$={np.std(A_LED_temp):.2e}, $\mu$={A_LED[i]:.2e}, $\sigma /\sqrt{{n}}$={np.std(A_LED_temp)/np.sqrt(len(A_LED_temp)):.2e}",fontsize=12)
+        asyPlot[int(i/3), i%3].set_xlabel(r"$A_{LED}$",fontsize=14)
+        asyPlot[int(i/3), i%3].set_ylabel(r"$Count$",fontsize=14)
+        asyPlot[int(i/3), i%3].margins(0)
+        asyPlot[int(i/3), i%3].legend(title=f'n={len(A_LED_temp)}')
+        asyPlot[int(i/3), i%3].xaxis.set_major_locator(AutoLocator())
+        asyPlot[int(i/3), i%3].tick_params(axis='x',rotation = 45)
+
+    sobelPlot[filter_count-1].set_xlabel(r"$Time(ms)$",fontsize=11)
+    figSobel.savefig(f"{data_path}/Sobel_filtering.png")
+    figAsyHist.savefig(f"{data_path}/Asymmetry_distribution.png")
+    plt.close('all')
+
+def renderNonLinearity(data_path):
+    '''
+    Non_linearity.pdf: asymmetry vs. anode current with the linear fit, and dA/dI
+    '''
+    d = loadPlotData(data_path, 'Non_linearity')
+    x, y, y_err, y_fit_linear = d['x'], d['y'], d['y_err'], d['y_fit_linear']
+    lin, lin_err, chisqr, ndf = float(d['lin']), float(d['lin_err']), float(d['chisqr']), int(d['ndf'])
+    Im, dAdI, dAdI_err = d['Im'], d['dAdI'], d['dAdI_err']
+    serial, preamp, hv, frq, I_cathode = (str(d[k]) for k in ('serial', 'preamp', 'hv', 'frq', 'I_cathode'))
+    dAdI_title = str(d['dAdI_title'])
+
+    fig,axs = plt.subplots(2,1, figsize=(10,7),layout='constrained',sharex=True)
+
+    axs[0].errorbar(x, y, yerr=y_err, fmt='r.',  markersize=5 ,elinewidth=2, capsize=4, ecolor='k', lw=0, label='LED Asymmetry')
+    axs[0].plot(x,y_fit_linear,label='Linear fit',c='tab:blue')
+    axs[0].set_ylabel(r"$A_{LED}$",fontsize=15)
+
+    axs[0].set_title(f"",fontsize=18)
+    axs[0].grid(linestyle='--')
+    axs[0].xaxis.set_minor_locator(AutoMinorLocator())
+    axs[0].yaxis.set_minor_locator(AutoMinorLocator())
+    plt.suptitle("PMT non-linearity measurement", fontsize=16)
+    axs[0].set_title(fr" PMT:{serial}, Pre-amp:{preamp}Ω, HV:-{hv}V, Frequency:{frq}Hz, $I_{{cathode}}@maxBrightness:{I_cathode}nA$",fontsize=12)
+
+    axs[0].tick_params(axis='x', labelsize=11)
+    axs[0].tick_params(axis='y', labelsize=11)
+
+    s=0.005
+    y_min = np.mean(y)-s
+    y_max = np.mean(y)+s
+    for k,point in enumerate(y):
+            if point >= y_max:
+                axs[0].scatter(x[k],y_max*0.98, marker='$↑$', c='k')
+            if point <= y_min:
+                axs[0].scatter(x[k],y_min*1.02, marker='$↓$', c='k')
+
+    axs[0].legend(title=f"% non-lin= {(lin)*100:.2f}±{(abs(lin_err))*100:.2f}" "\n" rf"$ \chi ^2 / ndf\ =$ {chisqr:.1f}/{ndf}",fontsize=12)
+    axs[0].set_ylim(y_min, y_max)
+
+    axs[1].errorbar(Im, dAdI, yerr=dAdI_err, fmt='r.',  markersize=5 ,elinewidth=2, capsize=4, ecolor='k', lw=0, label=r'$\Delta A /\Delta I$')
+    axs[1].set_ylabel(r'$\Delta A_{LED} / \Delta I_{Anode} (\mu A^{-1})$',fontsize=15)
+    axs[1].set_xlabel(r"$I_{anode}\ (μA)$", fontsize=15)
+    axs[1].set_ylim(np.mean(dAdI)-s, np.mean(dAdI)+s)
+    axs[1].grid(linestyle='--')
+    axs[1].xaxis.set_minor_locator(AutoMinorLocator())
+    axs[1].yaxis.set_minor_locator(AutoMinorLocator())
+    axs[1].tick_params(axis='x', labelsize=11)
+    axs[1].tick_params(axis='y', labelsize=11)
+    axs[1].legend(title=dAdI_title,fontsize=12)
+
+    fig.savefig(f"{data_path}/Non_linearity.pdf")
+    plt.close(fig)
+
+class Errorbar:
+    '''
+    Errorbar plot made of updatable artists (points, error lines and caps) for the figure templates.
+    xerr=True draws horizontal error bars. fmt=None draws the error bars only
+    '''
+    def __init__(self, ax, xerr=False, fmt='.', color='r', markersize=5, ecolor='k', elinewidth=1, capsize=3, alpha=None, label=None):
+        self.xerr = xerr
+        self.points = ax.plot([], [], fmt, color=color, markersize=markersize, lw=0, alpha=alpha, label=label)[0] if fmt else None
+        self.bars = LineCollection([], colors=ecolor, linewidths=elinewidth, alpha=alpha, label=None if fmt else label)
+        ax.add_collection(self.bars)
+        self.caps = ax.plot([], [], '|' if xerr else '_', color=ecolor, markersize=2*capsize, lw=0, alpha=alpha)[0]
+
+    def set_data(self, x, y, err):
+        x, y, err = (np.ravel(np.asarray(v, dtype=float)) for v in (x, y, err))
+        if self.points: self.points.set_data(x, y)
+        if self.xerr: lo, hi = np.stack([x-err, y], -1), np.stack([x+err, y], -1)
+        else: lo, hi = np.stack([x, y-err], -1), np.stack([x, y+err], -1)
+        self.bars.set_segments(np.stack([lo, hi], 1))
+        self.caps.set_data(np.concatenate([lo[:,0], hi[:,0]]), np.concatenate([lo[:,1], hi[:,1]]))
+
+def freezeLayout(fig):
+    '''
+    Keep the constrained layout computed by the first savefig of a template for the next ones
+    '''
+    if fig.get_layout_engine() is not None: fig.set_layout_engine('none')
+
+class RunFigures:
+    '''
+    Template of the per-run figures of Multiple_runs_analysis: 3x3 asymmetry distributions and the raw PMT data.
+        runFigures = RunFigures()
+        for r in runs:
+            runFigures.update(f"Run {r}", A_LED_temps, A_LED[r], A_LED_err[r], data[r][:, 0:pt])
+            runFigures.save(f"Asymmetry_distribution_{r}.png", f"Raw_data_{r}.png")
+    '''
+    def __init__(self, filter_count=9, bins=100):
+        self.bins = bins
+        self.figAsyHist, asyPlot = plt.subplots(3, 3, figsize=(13, 12),constrained_layout = True)
+        self.figRaw, self.rawPlot = plt.subplots(figsize=(10, 7), constrained_layout = True)
+        self.title = self.figAsyHist.suptitle('', fontsize=18)
+        self.hists = []
+        for i in range(filter_count):
+            ax = asyPlot[int(i/3), i%3]
+            hist = {'ax': ax,
+                    'stairs': ax.stairs(np.zeros(bins), np.arange(bins+1), fill=True, alpha=0.6),
+                    'mean': ax.axvline(0,ls='--',color='r',label=r'Mean($\mu$)',lw=1),
+                    'err': Errorbar(ax, xerr=True, fmt=None, label=r'$\delta\mu=\pm\sigma /\sqrt{{n}}$')}
+            ax.set_xlabel(r"$A_{LED}$",fontsize=14)
+            ax.set_ylabel(r"$Count$",fontsize=14)
+            hist['legend'] = ax.legend(title='n=0')
+            ax.xaxis.set_major_locator(AutoLocator())
+            ax.tick_params(axis='x',rotation = 45)
+            self.hists.append(hist)
+        self.rawLines = [self.rawPlot.plot([], [], alpha=0.5, label=f'F{i+1}: {filter_transmission[i]}%')[0] for i in range(filter_count)]
+
+    def update(self, title, A_LED_temps, A_LED, A_LED_err, raw):
+        self.title.set_text(title)
+        for i, (hist, A_LED_temp) in enumerate(zip(self.hists, A_LED_temps)):
+            ax = hist['ax']
+            nn, edges = np.histogram(A_LED_temp, bins=self.bins)
+            nk = np.max(nn)
+            hist['stairs'].set_data(nn, edges)
+            hist['mean'].set_xdata([A_LED[i], A_LED[i]])
+            hist['err'].set_data(A_LED[i], nk/10, A_LED_err[i])
+            ax.set_xlim(edges[0], edges[-1])
+            ax.set_ylim(0, nk)
+            ax.set_title(fr"F:{filter_transmission[i]}\%, $\sigma$={np.std(A_LED_temp):.2e}, $\mu$={A_LED[i]:.2e}, $\sigma /\sqrt{{n}}$={np.std(A_LED_temp)/np.sqrt(len(A_LED_temp)):.2e}",fontsize=11)
+            hist['legend'].set_title(f'n={len(A_LED_temp)}')
+        for line, trace in zip(self.rawLines, raw):
+            line.set_data(*minMaxDecimate(trace))
+        self.rawPlot.relim()
+        self.rawPlot.autoscale_view()
+
+    def save(self, asyHistPath, rawPath):
+        self.figAsyHist.savefig(asyHistPath)
+        self.figRaw.savefig(rawPath)
+        freezeLayout(self.figAsyHist)
+        freezeLayout(self.figRaw)
+
+    def close(self):
+        plt.close(self.figAsyHist)
+        plt.close(self.figRaw)
+
+class PMTFigure:
+    '''
+    Template of the per-PMT database figure: the LED asymmetry vs. anode current of all the runs of a PMT and
+    the non-linearity of each run
+    '''
+    def __init__(self):
+        self.fig, (self.asyPlot, self.linPlot) = plt.subplots(2, 1, figsize=(10, 8), constrained_layout = True)
+        self.title = self.fig.suptitle('', fontsize=16)
+        self.asymmetry = Errorbar(self.asyPlot, fmt='.', markersize=4, capsize=2, alpha=0.7, label='LED Asymmetry')
+        self.linearity = Errorbar(self.linPlot, fmt='.', markersize=5, capsize=3, label='Non-linearity')
+        self.asyPlot.set_xlabel(r"$I_{anode}\ (μA)$", fontsize=13)
+        self.asyPlot.set_ylabel(r"$A_{LED}$", fontsize=13)
+        self.linPlot.set_xlabel("Run", fontsize=13)
+        self.linPlot.set_ylabel(r"Non-linearity $(\%)$", fontsize=13)
+        for ax in (self.asyPlot, self.linPlot):
+            ax.grid(linestyle='--')
+            ax.xaxis.set_minor_locator(AutoMinorLocator())
+            ax.yaxis.set_minor_locator(AutoMinorLocator())
+        self.linPlot.xaxis.set_major_locator(MaxNLocator(integer=True))
+        self.linPlot.xaxis.set_minor_locator(NullLocator())
+        self.legend = self.linPlot.legend(title='')
+
+    def update(self, serial, I_anode, A_LED, A_LED_err, lin, lin_err):
+        self.title.set_text(f"PMT: {serial}, Runs: {len(lin)}")
+        self.asymmetry.set_data(I_anode, A_LED, A_LED_err)
+        self.linearity.set_data(np.arange(1, len(lin)+1), lin, lin_err)
+        self.legend.set_title(f"mean = {np.mean(lin):.2f} %")
+        for ax in (self.asyPlot, self.linPlot):
+            ax.relim()
+            ax.autoscale_view()
+        # relim() skips collections: include the error bars in the y limits
+        for ax, y, y_err in ((self.asyPlot, A_LED, A_LED_err), (self.linPlot, lin, lin_err)):
+            low, high = np.nanmin(y - y_err), np.nanmax(y + y_err)
+            if high > low: ax.set_ylim(low - 0.05*(high-low), high + 0.05*(high-low))
+        self.linPlot.set_xlim(0.5, len(lin) + 0.5)
+
+    def save(self, path):
+        self.fig.savefig(path)
+        freezeLayout(self.fig)
+
+def renderDatabase(store_path, out_dir=None):
+    '''
+    <out_dir>/<serial>.png for every PMT of the results store (default out_dir: Database_plots next to the store)
+    '''
+    store = Results_Store.ResultsStore(store_path)
+    if out_dir is None: out_dir = os.path.join(os.path.dirname(os.path.abspath(store_path)), 'Database_plots')
+    os.makedirs(out_dir, exist_ok=True)
+    pmtFigure = PMTFigure()
+    for serial in store.column('PMT'):
+        runs = store.runSlice(serial)
+        if runs.stop == runs.start: continue
+        pmtFigure.update(serial, store.column('Anode_current')[runs], store.column('Asymmetry')[runs], store.column('Asymmetry_err')[runs],
+                         store.column('Non_Linearity.Non_Linearity')[runs], store.column('Non_Linearity.Lin_err')[runs])
+        pmtFigure.save(os.path.join(out_dir, f'{serial}.png'))
+    plt.close(pmtFigure.fig)
+    return out_dir
+
+renderers = {'Asymmetry': renderAsymmetry, 'Non_linearity': renderNonLinearity, 'Database': renderDatabase}
+
+def main():
+    parser = argparse.ArgumentParser(prog='MOLLER Experiment: Figure rendering',
+                                     description='Render the analysis figures of a run from the saved plot data. \nCode by: Anuradha Gunawardhana')
+    parser.add_argument("dir", help="Run directory (results store for Database)")
+    parser.add_argument("kinds", nargs='*', default=['Asymmetry', 'Non_linearity'], help=f"Figures to render {list(renderers)}")
+    args = parser.parse_args()
+    data_path = os.path.normpath(args.dir)
+    failed = False
+    for kind in args.kinds:
+        try:
+            renderers[kind](data_path)
+        except Exception:
+            failed = True
+            with open(f"{data_path}/plot_errors.log", 'a') as log: # Rendering runs in the background, keep the errors with the run
+                log.write(f"[{kind}]\n{traceback.format_exc()}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.10
+# Description: Columnar results store of the PMT database. The PMT records are streamed to one .npy file per field
+#              (memory-mappable) and optionally to the Database.json export at the same time.
+#              Runs are stored PMT by PMT, so the runs of the k-th PMT are run_start[k]:run_start[k]+run_count[k]
+
+import numpy as np
+import os
+import json
+
+# Fields of the PMT entries ('.' separates the nested dictionaries) and their column types
+pmt_columns = {'PMT': 'U16',
+               'TestTicket.CB': 'f8',
+               'TestTicket.CR': 'f8',
+               'TestTicket.D1_gain': 'f8',
+               'TestTicket.Nominal_sensitivity': 'i8',
+               'TestTicket.Dark_Current': 'f8',
+               'TestTicket.Max_sensitivity': 'i8'}
+# Single values of the runs
+run_columns = {'Timestamp': 'i8',
+               'HV': 'i8',
+               'Max_cathode_current': 'i8',
+               'LED_flashing_frequency': 'i8',
+               'PMT_base_stages': 'i8',
+               'Dark_box_temperature': 'f8',    # NaN if not recorded ("NA")
+               'Non_Linearity.Non_Linearity': 'f8',
+               'Non_Linearity.Lin_err': 'f8',
+               'LED_voltages.constant': 'f8',
+               'LED_voltages.flashing': 'f8',
+               'Pedestal_data.preMean': 'f8',
+               'Pedestal_data.postMean': 'f8',
+               'Pedestal_data.STD': 'f8',
+               'Linear_fit_params.m': 'f8',
+               'Linear_fit_params.c': 'f8',
+               'Linear_fit_params.Chi_square': 'f8',
+               'Linear_fit_params.ndf': 'i8',
+               'dAdI_analysis.dAdI': 'f8',
+               'dAdI_analysis.dAdI_err': 'f8',
+               'Asymmetry_calculation_method': 'U8'}
+# Per filter values of the runs, stored as [runs, filters]
+filter_columns = ['Anode_current', 'Anode_current_err', 'Asymmetry', 'Asymmetry_err', 'Photodiode_mean', 'Photodiode_mean_err']
+# Run columns with a sorted index (equality and range queries by binary search)
+indexed_columns = ['HV', 'LED_flashing_frequency', 'PMT_base_stages', 'Max_cathode_current', 'Timestamp']
+
+def _get(record, key):
+    for k in key.split('.'): record = record[k]
+    return record
+
+def _set(record, key, value):
+    keys = key.split('.')
+    for k in keys[:-1]: record = record.setdefault(k, {})
+    record[keys[-1]] = value
+
+def _buildIndex(column):
+    order = np.argsort(column, kind='stable')
+    return order, column[order]
+
+def _jsonDefault(o): # numpy scalars and arrays
+    return o.tolist()
+
+class ResultsWriter:
+    '''
+    Stream the PMT entries of the database (the Database.json schema) to a columnar store, and to a JSON file if json_path is given.
+    Only the entry being written is kept in memory. Usage:
+        with ResultsWriter('Database_store', 'Database.json') as writer:
+            writer.write({"PMT": pmt, "TestTicket": testTicket, "runs": runs})
+    '''
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self.json_path = json_path
+        self.pmt_count = 0
+        self.run_count = 0
+        self.filter_count = None
+
+    def __enter__(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.raw = {key: open(self._raw(key), 'wb') for key in [*pmt_columns, 'run_start', 'run_count', *run_columns, *filter_columns]}
+        if self.json_path:
+            self.json = open(f'{self.json_path}.tmp', 'w')
+            self.json.write('[')
+        return self
+
+    def _raw(self, key):
+        return os.path.join(self.path, f'.{key}.raw')
+
+    def write(self, pmtRecord):
+        runs = pmtRecord['runs']
+        for key, dtype in pmt_columns.items():
+            self.raw[key].write(np.asarray(_get(pmtRecord, key), dtype=dtype).tobytes())
+        self.raw['run_start'].write(np.int64(self.run_count).tobytes())
+        self.raw['run_count'].write(np.int64(len(runs)).tobytes())
+        for run in runs:
+            for key, dtype in run_columns.items():
+                value = _get(run, key)
+                if value == "NA": value = np.nan
+                self.raw[key].write(np.asarray(value, dtype=dtype).tobytes())
+            for key in filter_columns:
+                values = np.asarray(run[key], dtype='f8')
+                if self.filter_count is None: self.filter_count = len(values)
+                if len(values) != self.filter_count: raise ValueError(f"{pmtRecord['PMT']}: {key} has {len(values)} filters, expected {self.filter_count}")
+                self.raw[key].write(values.tobytes())
+        self.pmt_count += 1
+        self.run_count += len(runs)
+        if self.json_path:
+            if self.pmt_count > 1: self.json.write(',\n')
+            self.json.write(json.dumps(pmtRecord, indent=1, default=_jsonDefault))
+
+    def __exit__(self, exc_type, exc, tb):
+        for file in self.raw.values(): file.close()
+        if self.json_path:
+            self.json.write(']\n')
+            self.json.close()
+        if exc_type is not None: return False
+        # Convert the raw columns to .npy files
+        shapes = {key: (self.pmt_count,) for key in [*pmt_columns, 'run_start', 'run_count']}
+        shapes.update({key: (self.run_count,) for key in run_columns})
+        shapes.update({key: (self.run_count, self.filter_count or 0) for key in filter_columns})
+        dtypes = {**pmt_columns, 'run_start': 'i8', 'run_count': 'i8', **run_columns, **{key: 'f8' for key in filter_columns}}
+        for key, shape in shapes.items():
+            np.save(os.path.join(self.path, f'{key}.npy'), np.fromfile(self._raw(key), dtype=dtypes[key]).reshape(shape))
+            os.remove(self._raw(key))
+        for key in indexed_columns:
+            order, values = _buildIndex(np.load(os.path.join(self.path, f'{key}.npy')))
+            np.save(os.path.join(self.path, f'index.{key}.order.npy'), order)
+            np.save(os.path.join(self.path, f'index.{key}.values.npy'), values)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as file:
+            json.dump({'pmt_count': self.pmt_count, 'run_count': self.run_count, 'filter_count': self.filter_count}, file)
+        if self.json_path: os.replace(f'{self.json_path}.tmp', self.json_path)
+        return False
+
+class ResultsStore:
+    '''
+    Read access to a columnar store written by ResultsWriter. The columns are memory-mapped on first use
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as file:
+            self.meta = json.load(file)
+        self._columns = {}
+        self.serial_index = {serial: k for k, serial in enumerate(self.column('PMT'))}
+
+    def column(self, key):
+        if key not in self._columns:
+            self._columns[key] = np.load(os.path.join(self.path, f'{key}.npy'), mmap_mode='r')
+        return self._columns[key]
+
+    def runSlice(self, serial):
+        k = self.serial_index[serial]
+        start = int(self.column('run_start')[k])
+        return slice(start, start + int(self.column('run_count')[k]))
+
+    def pmtRecord(self, serial):
+        '''
+        PMT entry in the Database.json schema
+        '''
+        k = self.serial_index[serial]
+        record = {}
+        for key in pmt_columns: _set(record, key, self.column(key)[k].item())
+        record['runs'] = [self.runRecord(r) for r in range(self.runSlice(serial).start, self.runSlice(serial).stop)]
+        return record
+
+    def runPMT(self, runs):
+        '''
+        Serials of the PMTs of the given run indices
+        '''
+        k = np.searchsorted(self.column('run_start'), runs, side='right') - 1
+        return self.column('PMT')[k]
+
+    def index(self, key):
+        '''
+        (order, sorted values) index of a run column. Built in memory for the columns without a stored index
+        '''
+        if f'index.{key}' not in self._columns:
+            try:
+                self._columns[f'index.{key}'] = (np.load(os.path.join(self.path, f'index.{key}.order.npy'), mmap_mode='r'),
+                                                 np.load(os.path.join(self.path, f'index.{key}.values.npy'), mmap_mode='r'))
+            except OSError:
+                self._columns[f'index.{key}'] = _buildIndex(np.asarray(self.column(key)))
+        return self._columns[f'index.{key}']
+
+    def find(self, filters):
+        '''
+        Indices (sorted) of the runs that match all the filters.
+        filters: {column: value} for equality or {column: (min, max)} for an inclusive range (None = open end).
+        'PMT' takes a serial or a list of serials. Indexed columns are searched with the index,
+        the other columns are only read at the runs left by the indexed filters
+        '''
+        runs = None
+        def intersect(runs, selected):
+            return selected if runs is None else np.intersect1d(runs, selected, assume_unique=True)
+        if 'PMT' in filters:
+            serials = [filters['PMT']] if isinstance(filters['PMT'], str) else filters['PMT']
+            slices = [self.runSlice(serial) for serial in serials if serial in self.serial_index]
+            runs = np.unique(np.concatenate([np.arange(sl.start, sl.stop) for sl in slices] + [np.empty(0, dtype=np.int64)]))
+        for key in [k for k in filters if k in indexed_columns]:
+            lo, hi = filters[key] if isinstance(filters[key], (tuple, list)) else (filters[key], filters[key])
+            order, values = self.index(key)
+            a = 0 if lo is None else np.searchsorted(values, lo, side='left')
+            b = len(values) if hi is None else np.searchsorted(values, hi, side='right')
+            runs = intersect(runs, np.sort(order[a:b]))
+        if runs is None: runs = np.arange(self.meta['run_count'])
+        for key in [k for k in filters if k != 'PMT' and k not in indexed_columns]:
+            if isinstance(filters[key], (tuple, list)):
+                lo, hi = filters[key]
+                values = self.column(key)[runs]
+                keep = np.ones(len(runs), dtype=bool)
+                if lo is not None: keep &= values >= lo
+                if hi is not None: keep &= values <= hi
+            else: keep = self.column(key)[runs] == filters[key]
+            runs = runs[keep]
+        return runs
+
+    def query(self, filters, columns=('Anode_current', 'Anode_current_err', 'Asymmetry', 'Asymmetry_err')):
+        '''
+        Columns of the runs matching the filters (see find) as numpy arrays, with the 'PMT' serial and 'run' index of each run.
+        Only the selected runs are read from the memory-mapped columns
+        '''
+        runs = self.find(filters)
+        result = {'run': runs, 'PMT': self.runPMT(runs)}
+        for key in columns: result[key] = np.asarray(self.column(key)[runs])
+        return result
+
+    def runRecord(self, r):
+        run = {}
+        for key in run_columns:
+            value = self.column(key)[r].item()
+            if key == 'Dark_box_temperature' and np.isnan(value): value = "NA"
+            _set(run, key, value)
+        for key in filter_columns: run[key] = self.column(key)[r].tolist()
+        return run
+
+    def exportJSON(self, json_path):
+        '''
+        Write the store in the Database.json schema, one PMT at a time
+        '''
+        with open(json_path, 'w') as file:
+            file.write('[')
+            for k, serial in enumerate(self.column('PMT')):
+                if k: file.write(',\n')
+                file.write(json.dumps(self.pmtRecord(str(serial)), indent=1))
+            file.write(']\n')
@@ -0,0 +1,115 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.10
+# Description: Persistent catalog (SQLite) of the run directories and their Experiment_data entries.
+#              The catalog is updated incrementally: one os.scandir pass over the tree and only the
+#              Experiment_data files that changed (size or mtime) since the last update are parsed again.
+#   e.g. list the 1920 Hz runs of a PMT:  python Run_Catalog.py -d ../Test_Data -p A23-829 -w "Chopper_Frequency(Hz)=1920"
+
+import os
+import json
+import sqlite3
+import argparse
+import Experiment_Data
+
+catalog_path = os.path.expanduser('~/.cache/moller_pmt_run_catalog.sqlite')
+skip_dirs = ('Database_store',)     # Directories never holding runs (hidden directories are skipped as well)
+
+_under = 'path = ? OR substr(path, 1, ?) = ?' # Runs in or below a directory
+def _underArgs(root):
+    prefix = os.path.join(root, '')
+    return (root, len(prefix), prefix)
+
+def connect(path=None):
+    path = catalog_path if path is None else path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute('''CREATE TABLE IF NOT EXISTS runs (
+                              path TEXT PRIMARY KEY,    -- absolute path of the run directory
+                              parent TEXT,              -- absolute path of the PMT directory
+                              mtime INTEGER,            -- Experiment_data.txt mtime (ns)
+                              size INTEGER,             -- Experiment_data.txt size
+                              lines INTEGER,            -- number of Experiment_data entries
+                              data TEXT)                -- Experiment_data entries (json)''')
+    connection.execute('CREATE INDEX IF NOT EXISTS runs_parent ON runs(parent)')
+    return connection
+
+def update(root, connection=None):
+    '''
+    Bring the catalog entries under root up to date. Returns the number of (re)parsed and removed runs
+    '''
+    con = connect() if connection is None else connection
+    root = os.path.abspath(root)
+    known = {path: (mtime, size) for path, mtime, size in
+             con.execute(f'SELECT path, mtime, size FROM runs WHERE {_under}', _underArgs(root))}
+    seen = set()
+    changed = []
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.') and entry.name not in skip_dirs: stack.append(entry.path)
+            elif entry.name == 'Experiment_data.txt':
+                seen.add(directory)
+                st = entry.stat()
+                if known.get(directory) != (st.st_mtime_ns, st.st_size): changed.append((directory, st))
+    with con:
+        for directory, st in changed:
+            try:
+                expData = Experiment_Data.readExperimentData(directory)
+            except OSError:
+                continue
+            con.execute('INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?)',
+                        (directory, os.path.dirname(directory), st.st_mtime_ns, st.st_size, len(expData), json.dumps(expData)))
+        removed = [path for path in known if path not in seen]
+        con.executemany('DELETE FROM runs WHERE path = ?', [(path,) for path in removed])
+    if connection is None: con.close()
+    return len(changed), len(removed)
+
+def runs(root, depth=None, pmt=None, where=None, connection=None):
+    '''
+    Catalog entries under root, sorted by path. Each entry is a dictionary with the run 'path' (joined to root
+    as given, like os.walk), the 'pmt' directory name (first directory below root) and the Experiment_data entries ('data').
+    depth: only the runs this many directories below root (2 for root/PMT/run)
+    where: {Experiment_data key: value} that all have to match
+    '''
+    con = connect() if connection is None else connection
+    absroot = os.path.abspath(root)
+    if pmt is not None:
+        rows = con.execute('SELECT path, lines, data FROM runs WHERE parent = ? ORDER BY path', (os.path.join(absroot, pmt),))
+    else:
+        rows = con.execute(f'SELECT path, lines, data FROM runs WHERE {_under} ORDER BY path', _underArgs(absroot))
+    selected = []
+    for path, lines, data in rows:
+        rel = os.path.relpath(path, absroot).split(os.sep)
+        if depth is not None and len(rel) != depth: continue
+        expData = json.loads(data)
+        if where and any(expData.get(key) != str(value) for key, value in where.items()): continue
+        selected.append({'path': os.path.join(root, *rel) if rel != ['.'] else root, 'pmt': rel[0], 'lines': lines, 'data': expData})
+    if connection is None: con.close()
+    return selected
+
+def main():
+    parser = argparse.ArgumentParser(prog='MOLLER Experiment: Run catalog',
+                                     description='Update and list the run catalog. \nCode by: Anuradha Gunawardhana')
+
+    parser.add_argument("-d","--dir", required=True, help="Record directory")
+    parser.add_argument("-p","--pmt", help="PMT directory name")
+    parser.add_argument("-w","--where", action='append', default=[], help="Experiment_data entry KEY=VALUE")
+    parser.add_argument("-k","--keys", action='append', default=[], help="Experiment_data entries to print")
+    args = parser.parse_args()
+    mypath = os.path.normpath(args.dir) # remove trailing slashes
+
+    changed, removed = update(mypath)
+    print(f"[Info]: Catalog updated ({changed} new or changed, {removed} removed)")
+    selected = runs(mypath, pmt=args.pmt, where=dict(w.split('=', 1) for w in args.where))
+    for run in selected:
+        print(run['path'], *[run['data'].get(k, 'NA') for k in args.keys])
+    print(f"[Info]: {len(selected)} runs")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: Streaming statistics of the records (count, mean, variance, min, max and the anomaly count against
+#              a threshold), computed chunk by chunk on the loaded buffers or memory-mapped arrays.
+
+import numpy as np
+
+chunk_size = 2**20          # Samples per chunk
+
+class RunningStats:
+    '''
+    Welford style streaming reducer: the moments of each chunk are merged into the running moments (Chan et al.),
+    so a record is reduced in one pass without a full-size temporary.
+        stats = RunningStats.of(y)                  # or stats.update(chunk) for every chunk
+        stats.mean, stats.std, stats.count
+        stats.anomalies(y, threshold)               # samples farther than threshold*std from the mean
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0               # Sum of the squared deviations from the mean
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def of(cls, y, chunkSize=chunk_size):
+        stats = cls()
+        for a in range(0, len(y), chunkSize):
+            stats.update(y[a:a+chunkSize])
+        return stats
+
+    def update(self, chunk):
+        n = len(chunk)
+        if n == 0: return self
+        m = float(np.mean(chunk, dtype=float))
+        d = np.subtract(chunk, m, dtype=float)
+        total = self.count + n
+        delta = m - self.mean
+        self.m2 += float(np.dot(d, d)) + delta*delta*self.count*n/total
+        self.mean += delta*n/total
+        self.count = total
+        self.min = min(self.min, float(np.min(chunk)))
+        self.max = max(self.max, float(np.max(chunk)))
+        return self
+
+    @property
+    def var(self):
+        return self.m2/self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def anomalies(self, y, threshold, chunkSize=chunk_size):
+        '''
+        Number of samples of y with |y - mean| > threshold*std (second pass, one chunk at a time)
+        '''
+        limit = threshold*self.std
+        return sum(int(np.count_nonzero(np.abs(np.subtract(y[a:a+chunkSize], self.mean, dtype=float)) > limit))
+                   for a in range(0, len(y), chunkSize))
+
+    def anomalyFactor(self, y, threshold, chunkSize=chunk_size):
+        '''
+        Percentage of anomalous samples (NaN for an empty record, Calculate_Asymmetry.featureQuality fails it)
+        '''
+        return 100*self.anomalies(y, threshold, chunkSize)/self.count if self.count else np.nan
@@ -9,7 +9,11 @@
 base_dir='Test_Data'
 filter_order=( '4' '11' '8' '2' '9' '7' '3' '5' '1' '6' '10' '12' )
 pedestal_count=0
+rerecord_count=0
 directoryCreated=false
+PIPELINE=false
+chunk_size=1048576 # Samples per chunk of the per-record (streaming) analysis
+max_attempts=3 # Recordings of a filter position failing the data quality test
 SECONDS=0
 
 function usage {
@@ -36,6 +40,8 @@ function usage {
   echo "  -ts, --timeStamp  Time stamp of PMT powerd on time (YYYYMMDDhhmm)"
   echo "  -tr, --testRun    Test run or not (true,false)"
   echo "  -d,  --dir        [Optional] Data directory name. Will create a folder -d inside 'base_dir'"
+  echo "  -p,  --pipeline   [Optional] Analyse each record while the next one is recorded"
+  echo "                    (the final analysis is the streaming one, Calculate_non-linearity.py -c: no raw data plots)"
 
   exit 1
 }
@@ -97,6 +103,10 @@ while [[ $# -gt 0 ]] ; do
       shift
       shift
       ;;
+    -p | --pipeline)
+      PIPELINE=true
+      shift
+      ;;
     -h | --help)
     usage
     shift
@@ -164,7 +174,7 @@ echo "------------------------------------------------"
 echo "|         Initiating the data collection       | "
 echo "------------------------------------------------"
 # Set LED voltages
-STD_OUT="$(python Power_Supply_Control.py -v $VC $VB)"
+STD_OUT="$(python Instrument_Client.py Power_Supply_Control.py -v $VC $VB)"
 if [ $? -eq "1" ] ; then
   echo "[Recording Failed] Power supply failed!"
   exit 1
@@ -183,12 +193,20 @@ else
 fi
 
 # Set Chopper frequency
-python Chopper_Control.py -c setFrequency $FRQ
+python Instrument_Client.py Chopper_Control.py -c setFrequency $FRQ
 if [ $? -eq "1" ] ; then
   echo "[Recording Failed] Could not initiate the Chopper!"
   exit 1
 fi
 
+# Reduce the records as they land in $DIRNAME
+if [ "$PIPELINE" = true ] ; then
+  python Pipelined_Analysis.py $DIRNAME -f $FRQ -s ./CMDataSettings.txt -c $chunk_size -a $max_attempts &
+  PIPELINE_PID=$!
+  trap 'kill $PIPELINE_PID 2>/dev/null' EXIT # Stopped with the script: failed recording, Ctrl-C, SIGTERM, closed terminal
+  trap 'exit 130' INT # Abort the run on Ctrl-C, also if CMData handles the interrupt and exits normally
+fi
+
 # Start filter cycle
 for i in 12 1 2 3 4 5 6 7 8 9 10 11 12
    do
@@ -197,44 +215,69 @@ for i in 12 1 2 3 4 5 6 7 8 9 10 11 12
       echo "|  Starting a new record | Filter position $i   |"
       echo "------------------------------------------------"
       echo "[Wait]: Setting filter position: $i"
-      python Filter_Control.py -c setPosition $i
+      python Instrument_Client.py Filter_Control.py -c setPosition $i
       if [ $? -eq "1" ] ; then
         echo "[Recording Failed] Moving filter into position!"
         exit 1
       fi
 
-      echo "[CMData] Running"
-      ./CMData
-      rm *.dat
-      rm *.out
+      if [ $i -eq 12 ] ; then
+        record=$i-"$pedestal_count".root  # To get two pedestal measurements
+        ((pedestal_count=pedestal_count+1))
+      else
+        record=${filter_order[$i-1]}.root
+      fi
 
-      echo "[CMData] Recording successful!"
+      for ((attempt=1; attempt<=max_attempts; attempt++)) ; do
+        echo "[CMData] Running"
+        ./CMData
+        rm *.dat
+        rm *.out
 
-      if [ "$directoryCreated" = false ] ; then
-        echo "[Record Saving]: Creating data directory: $DIRNAME"
-        mkdir -p $DIRNAME
-        directoryCreated=true
-      fi
+        echo "[CMData] Recording successful!"
+
+        if [ "$directoryCreated" = false ] ; then
+          echo "[Record Saving]: Creating data directory: $DIRNAME"
+          mkdir -p $DIRNAME
+          directoryCreated=true
+        fi
         echo "[Record Saving]: Copying files to: $DIRNAME "
-        if [ $i -eq 12 ] ; then
-          mv ./Int_Run_000.root $DIRNAME/$i-"$pedestal_count".root  # To get two pedestal measurements
-          ((pedestal_count=pedestal_count+1))
+        mv ./Int_Run_000.root $DIRNAME/$record
+
+        # Data quality of this position (anomaly and Sobel-period tests), recorded again only if it fails the tests
+        python Analysis_Client.py Check_Record.py $DIRNAME $record -f $FRQ -s ./CMDataSettings.txt -c $chunk_size
+        status=$?
+        if [ $status -eq "0" ] ; then
+          break
+        elif [ $status -ne "1" ] ; then
+          echo "[Warning]: Could not test $record (exit code $status), keeping the record for the final analysis"
+          break
+        elif [ $attempt -lt $max_attempts ] ; then
+          echo "[Record Rejected]: Moving to $DIRNAME/rejected and recording filter position $i again ($((attempt+1))/$max_attempts)"
+          mkdir -p $DIRNAME/rejected
+          mv $DIRNAME/$record $DIRNAME/rejected/${record%.root}-$attempt.root
+          ((rerecord_count=rerecord_count+1))
         else
-          mv ./Int_Run_000.root $DIRNAME/${filter_order[$i-1]}.root
+          echo "[Warning]: $record failed the data quality test $max_attempts times, keeping the last record"
         fi
-        sleep 1
+      done
+      sleep 1
 done
 
 cp ./CMDataSettings.txt $DIRNAME
 echo "================================================"
 echo "                  Record End                    "
 echo "  Toral records:  $i filter positions           "
+echo "  Re-recorded:    $rerecord_count records                "
 echo "  Data dir:       $DIRNAME                      "
 echo "  Time escape:    $SECONDS seconds              "
 echo "================================================"
 echo ""
 echo ""
 
+# Append under the Experiment_data lock (shared with the python writers)
+{
+flock 9
 echo "Filter_Order=4,11,8,2,9,7,3,5,1,6,10,12
 Test_Run=$TEST
 PMT_Power_On_Timestamp(DateTime)=$DATETIME
@@ -249,13 +292,19 @@ PMT_high_voltage(V)=$HV
 Preamp_gain(Ohm)=$GAIN
 Cathode_Current_at_max_brightness(nA)=$I_Cathode
 Record_Time(s)=$SECONDS" >> $DIRNAME/Experiment_data.txt
+} 9>>$DIRNAME/Experiment_data.txt.lock
 
 python Read_Temp.py $DIRNAME
 
 echo "------------------------------------------------"
 echo "|         Initiating the data Analysis         | "
 echo "------------------------------------------------"
-python Calculate_non-linearity.py $DIRNAME
+if [ "$PIPELINE" = true ] ; then
+  wait $PIPELINE_PID # Records it could not reduce are reduced by the final analysis
+  python Analysis_Client.py Calculate_non-linearity.py $DIRNAME -c $chunk_size # Only the streaming analysis (-c) reads the cached reductions
+else
+  python Analysis_Client.py Calculate_non-linearity.py $DIRNAME # Runs in the warm Analysis_Server if available
+fi
 status=$?
 if [ $status -eq "1" ] ; then
   echo "[ERROR]: Analysis failed"
@@ -264,5 +313,8 @@ elif [ $status -eq "2" ] ; then
   exit 2
 elif [ $status -eq "3" ] ; then
   exit 3
+elif [ $status -ne "0" ] ; then
+  echo "[ERROR]: Analysis failed (exit code $status)"
+  exit 1
 fi
 exit 0
@@ -152,7 +152,7 @@ echo "------------------------------------------------"
 echo "|       Recording max anode current data       | "
 echo "------------------------------------------------"
 # Set LED voltages
-STD_OUT="$(python Power_Supply_Control.py -v $VC 0)"
+STD_OUT="$(python Instrument_Client.py Power_Supply_Control.py -v $VC 0)"
 if [ $? -eq "1" ] ; then
   echo "[Recording Failed] Power supply failed!"
   exit 1
@@ -177,7 +177,7 @@ for i in 12 9
     echo "|  Starting a new record | Filter position $i   |"
     echo "------------------------------------------------"
     echo "[Wait]: Setting filter position: $i"
-    python Filter_Control.py -c setPosition $i
+    python Instrument_Client.py Filter_Control.py -c setPosition $i
     if [ $? -eq "1" ] ; then
       echo "[Recording Failed] Moving filter into position!"
       exit 1
@@ -201,7 +201,7 @@ for i in 12 9
   done
 
 echo "[Wait]: Setting filter position: 12"
-python Filter_Control.py -c setPosition 12
+python Instrument_Client.py Filter_Control.py -c setPosition 12
 if [ $? -eq "1" ] ; then
   echo "[Recording Failed] Moving filter into position!"
   exit 1
@@ -216,6 +216,9 @@ echo "================================================"
 echo ""
 echo ""
 
+# Append under the Experiment_data lock (shared with the python writers)
+{
+flock 9
 echo "Filter_Order=4,11,8,2,9,7,3,5,1,6,10,12
 Test_Run=$TEST
 PMT_Power_On_Timestamp(DateTime)=$DATETIME
@@ -228,13 +231,14 @@ PMT_high_voltage(V)=$HV
 Preamp_gain(Ohm)=$GAIN
 Cathode_Current_at_max_brightness(nA)=$I_Cathode
 Record_Time(s)=$SECONDS" >> $DIRNAME/Experiment_data.txt
+} 9>>$DIRNAME/Experiment_data.txt.lock
 
 python Read_Temp.py $DIRNAME
 
 echo "------------------------------------------------"
 echo "|      Calculating the max anode current       | "
 echo "------------------------------------------------"
-python Read_max_anode_current.py $DIRNAME
+python Analysis_Client.py Read_max_anode_current.py $DIRNAME # Runs in the warm Analysis_Server if available
 status=$?
 if [ $status -eq "1" ] ; then
   echo "[ERROR]: Analysis failed"
@@ -243,5 +247,8 @@ elif [ $status -eq "2" ] ; then
   exit 2
 elif [ $status -eq "3" ] ; then
   exit 3
+elif [ $status -ne "0" ] ; then
+  echo "[ERROR]: Analysis failed (exit code $status)"
+  exit 1
 fi
 exit 0
@@ -232,6 +232,11 @@ elif [ $BASE -eq 4 ] ; then
   Ic_order=(7 9 12 9 9) # Order of cathode currents used for testing (nA)
 fi
 
+# Keep the analysis modules loaded between the runs (main.sh and max_anode_current_test.sh use it when available)
+python Analysis_Server.py start
+# Keep the filter wheel, chopper and power supply ports open between the commands (Instrument_Client.py)
+python Instrument_Server.py start
+
 # Initiate the data collection by preforming first test run at 15nA cathode current level
 ./max_anode_current_test.sh -vc ${VC[1]} -hv $HV -g $GAIN -s $SERIAL -b $BASE -ts $DATETIME -d $baseDIR -Ic ${Ic_order[1]} -tr true
 status=$?
@@ -241,7 +246,7 @@ fi
 
 #Check whether the max anode current is in the correct range
 while [ $status -eq "2" ] || [ $status -eq "3" ] ; do # Catch high anode current situation from the previous analysis
-  python Power_Supply_Control.py -c beep # Make a beep sound from the power supply
+  python Instrument_Client.py Power_Supply_Control.py -c beep # Make a beep sound from the power supply
   if [ $status -eq "2" ] ; then
     echo "[Suggestion]: Try decreasing the PMT high-voltage"
   fi
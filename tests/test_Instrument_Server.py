@@ -0,0 +1,93 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: The Instrument_Server with a fake instrument: a client disconnecting in the middle of a command
+#              does not stop the server, and the port of the interrupted command is opened again.
+#   e.g. python -m pytest -q tests
+
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import pytest
+
+pytest.importorskip('serial')
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, src)
+from Analysis_Server import exit_marker
+
+fake_instrument = '''
+import sys
+import time
+opened = 0
+
+class Port:
+    is_open = True
+    def reset_input_buffer(self): pass
+    def close(self): self.is_open = False
+
+def findPort():
+    global opened
+    opened += 1
+    return Port()
+
+def main(ser):
+    print(f"[Fake]: Moving (port opened {opened} times)")
+    time.sleep(float(sys.argv[1]))
+    print("[Fake]: Done")
+    sys.exit(0)
+'''
+
+server_code = '''
+import sys
+sys.path[:0] = [{src!r}, {tmp!r}]
+import Instrument_Server
+Instrument_Server.socket_path = {sock!r}
+Instrument_Server.scripts = {{'Fake_Control.py': 'Fake_Control'}}
+Instrument_Server.serve()
+'''
+
+def request(sock, args):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(sock)
+    conn.sendall(json.dumps({'script': 'Fake_Control.py', 'args': args}).encode() + b'\n')
+    return conn
+
+def receive(conn):
+    data = b''
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk: break
+        data += chunk
+    conn.close()
+    out, _, code = data.partition(exit_marker)
+    return out.decode(), int(code)
+
+@pytest.fixture
+def server(tmp_path):
+    with open(tmp_path/'Fake_Control.py', 'w') as file:
+        file.write(fake_instrument)
+    sock = str(tmp_path/'instruments.sock')
+    proc = subprocess.Popen([sys.executable, '-c', server_code.format(src=src, tmp=str(tmp_path), sock=sock)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    deadline = time.time() + 20
+    while not os.path.exists(sock):
+        assert proc.poll() is None and time.time() < deadline, proc.stdout.read() if proc.poll() is not None else 'No server'
+        time.sleep(0.05)
+    yield proc, sock
+    proc.kill()
+    proc.wait()
+
+def test_server_survives_client_disconnect(server):
+    proc, sock = server
+    conn = request(sock, ['0.5'])
+    assert conn.recv(65536).startswith(b'[Fake]: Moving (port opened 1 times)')
+    conn.close() # Client gone during the move, the server fails writing "Done"
+    time.sleep(1)
+    assert proc.poll() is None
+
+    out, code = receive(request(sock, ['0']))
+    assert code == 0
+    assert '[Fake]: Moving (port opened 2 times)' in out # Port of the interrupted command closed and opened again
+    assert '[Fake]: Done' in out
@@ -0,0 +1,92 @@
+# Code by:  Anuradha Gunawardhana
+# Date:     2024.09.13
+# Description: The chunked (streaming, Calculate_non-linearity.py -c) analysis against the in-memory analysis on
+#              synthetic runs, with chunk boundaries placed on and around the edge response peaks.
+#   e.g. python -m pytest -q tests
+
+import os
+import sys
+import numpy as np
+import pytest
+import uproot
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import Calculate_Asymmetry
+
+prescale = 10
+record_length = 0.12 # s, long enough for the >100 ms length test
+sampling_rate = Calculate_Asymmetry.ADC_rate/prescale
+dataArr_limit = int(sampling_rate*record_length*0.9)
+
+def writeRun(path, chopper_frequency, seed=0, spikes=0.0):
+    '''
+    Run directory of 13 synthetic records: LED square waves (1% asymmetry, one sample of edge jitter) at the
+    filter transmissions, two pedestals and the photodiode. spikes: fraction of F1 samples made anomalous
+    '''
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n = int(sampling_rate*record_length)
+    t = np.arange(n)/sampling_rate
+    half_cycles = int(t[-1]*chopper_frequency*2) + 3
+    files = [f'{i}.root' for i in range(1, 12)] + list(Calculate_Asymmetry.pedestal_files)
+    for k, rootFile in enumerate(files):
+        if k < 11:
+            edges = (np.arange(half_cycles) - 0.26)/(2*chopper_frequency) + rng.normal(0, 1/sampling_rate, half_cycles)
+            high = np.searchsorted(edges, t) % 2 == 0
+            level = 2.0*Calculate_Asymmetry.filter_transmission[k]/100
+            y = level*(1 + 0.01*np.where(high, 1, -1)) + 0.05
+        else: y = np.full(n, 0.05)
+        y = y + rng.normal(0, 0.0005, n)
+        if k == 0 and spikes: y[rng.choice(n, int(n*spikes), replace=False)] += 1.0
+        diode = 0.5 + 0.1*(y if k < 11 else 0) + rng.normal(0, 0.001, n)
+        with uproot.recreate(f'{path}/{rootFile}') as file:
+            file['DataTree'] = {'tStmp': t[None,:], 'ch1_data': y[None,:], 'ch0_data': diode[None,:]}
+    with open(f'{path}/CMDataSettings.txt', 'w') as settings:
+        settings.write(f"IP 0.0.0.0\nRun 0\nReadChannel1 1\nReadChannel2 2\nPrescaleFactor {prescale}\nRunLength(s) {record_length}\nSamplingDelay 0\n")
+    with open(f'{path}/Experiment_data.txt', 'w') as expData:
+        expData.write(f"PMT_Serial=TEST-{seed}\nChopper_Frequency(Hz)={chopper_frequency}\nRecord_Time(s)={record_length}\n")
+    return path
+
+def chunkSizes(peaks):
+    '''
+    Chunk sizes with the first boundary one sample before, on and after an edge response peak,
+    and half way to the next one. Later boundaries fall at other phases of the chopper cycle
+    '''
+    k = len(peaks)//8
+    return [int(c) for c in (peaks[k]-1, peaks[k], peaks[k]+1, (peaks[k]+peaks[k+1])//2)]
+
+@pytest.fixture(scope='module', params=[Calculate_Asymmetry.pairwise_frequency, Calculate_Asymmetry.quartet_frequency])
+def run(request, tmp_path_factory):
+    chopper_frequency = request.param
+    path = writeRun(str(tmp_path_factory.mktemp(f'run{chopper_frequency}')), chopper_frequency, seed=chopper_frequency)
+    sobelSize, w = Calculate_Asymmetry.streamWindows(sampling_rate, chopper_frequency)
+    analysisMethod = Calculate_Asymmetry.analysisMethodFor(chopper_frequency)
+    y = Calculate_Asymmetry.loadRecords(path, ['1.root'], dataArr_limit)[0]['ch1_data']
+    feature = Calculate_Asymmetry.analyseFilter(y, sobelSize, w, analysisMethod)
+    return path, y, sobelSize, w, analysisMethod, feature
+
+def test_peaks_at_chunk_edges(run):
+    path, y, sobelSize, w, analysisMethod, feature = run
+    for chunkSize in chunkSizes(feature['peaks']):
+        streamed = Calculate_Asymmetry.streamFeatures(y, sobelSize, w, analysisMethod, chunkSize)
+        np.testing.assert_array_equal(streamed['peaks'], feature['peaks'])
+        np.testing.assert_array_equal(streamed['shift'], feature['shift'])
+        np.testing.assert_allclose(streamed['v1_mean'], feature['v1_mean'], rtol=1e-12)
+        np.testing.assert_allclose(streamed['v2_mean'], feature['v2_mean'], rtol=1e-12)
+        assert streamed['sobel_factor'] == feature['sobel_factor']
+        assert streamed['stat_factor'] == Calculate_Asymmetry.anomalyPercentage(y)
+
+def test_chunked_analysis_matches_in_memory(run):
+    path, y, sobelSize, w, analysisMethod, feature = run
+    expected = Calculate_Asymmetry.calculateAsymmetry(path, 9)
+    assert expected[0] == 0
+    for chunkSize in chunkSizes(feature['peaks']):
+        result = Calculate_Asymmetry.calculateAsymmetry(path, 9, chunkSize=chunkSize)
+        assert result[0] == 0
+        for a, b in zip(result[1:], expected[1:]):
+            np.testing.assert_allclose(a, b, rtol=1e-9)
+
+def test_failed_quality_check_blocks_result(tmp_path):
+    path = writeRun(str(tmp_path/'run'), Calculate_Asymmetry.pairwise_frequency, seed=3, spikes=0.02)
+    assert Calculate_Asymmetry.calculateAsymmetry(path, 9)[0] == -1
+    assert Calculate_Asymmetry.calculateAsymmetry(path, 9, chunkSize=2**15)[0] == -1